@@ -0,0 +1,175 @@
+"""
+Микробенчмарки latex_parser:
+- extract_latex_blocks: прежняя реализация (4 прохода re.finditer,
+  сортировка, фильтр наложений) против однопроходного tokenize_latex;
+- latex_to_unicode: прежняя цепочка re.sub и str.replace против
+  однопроходного перевода (без кэша и с кэшем).
+
+Запуск из корня проекта:
+    python benchmarks/latex_parser_bench.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils import latex_parser  # noqa: E402
+from src.utils.latex_parser import extract_latex_blocks, latex_to_unicode, tokenize_latex  # noqa: E402
+
+
+def legacy_extract_latex_blocks(text):
+    """Прежняя реализация (до однопроходного разбора)"""
+    blocks = []
+
+    patterns_display = [
+        (r'\\\[(.*?)\\\]', 'display'),
+        (r'\$\$(.*?)\$\$', 'display'),
+    ]
+    for pattern, mode in patterns_display:
+        for match in re.finditer(pattern, text, re.DOTALL):
+            latex = match.group(1).strip()
+            latex = re.sub(r'\s*\n\s*', ' ', latex)
+            blocks.append({
+                'latex': latex,
+                'mode': mode,
+                'start': match.start(),
+                'end': match.end(),
+                'full': match.group(0)
+            })
+
+    patterns_inline = [
+        (r'\\\((.*?)\\\)', 'inline'),
+        (r'\$([^\$]+)\$', 'inline'),
+    ]
+    for pattern, mode in patterns_inline:
+        for match in re.finditer(pattern, text, re.DOTALL):
+            latex = match.group(1).strip()
+            latex = re.sub(r'\s*\n\s*', ' ', latex)
+            blocks.append({
+                'latex': latex,
+                'mode': mode,
+                'start': match.start(),
+                'end': match.end(),
+                'full': match.group(0)
+            })
+
+    sorted_blocks = sorted(blocks, key=lambda x: x['start'])
+    if not sorted_blocks:
+        return []
+
+    final_blocks = []
+    last_end = -1
+    for block in sorted_blocks:
+        if block['start'] >= last_end:
+            final_blocks.append(block)
+            last_end = block['end']
+    return final_blocks
+
+
+def legacy_latex_to_unicode(text):
+    """Прежняя реализация latex_to_unicode"""
+    
+    text = re.sub(r'\\\[|\\\]|\$\$', '', text) # Display
+    text = re.sub(r'\\\((.*?)\\\)', r'\1', text, flags=re.DOTALL)
+    text = re.sub(r'\$([^\$]+)\$', r'\1', text, flags=re.DOTALL) # $...$
+    
+    text = re.sub(r'\\frac\{([^}]+)\}\{([^}]+)\}', r'(\1)/(\2)', text)
+    
+    superscripts = {'0': '⁰', '1': '¹', '2': '²', '3': '³', '4': '⁴', '5': '⁵',
+                    '6': '⁶', '7': '⁷', '8': '⁸', '9': '⁹', 'n': 'ⁿ', 'x': 'ˣ',
+                    'm': 'ᵐ', 'k': 'ᵏ', '+': '⁺', '-': '⁻', 'i': 'ⁱ'}
+    
+    subscripts = {'0': '₀', '1': '₁', '2': '₂', '3': '₃', '4': '₄', '5': '₅',
+                  '6': '₆', '7': '₇', '8': '₈', '9': '₉', 'n': 'ₙ', 'm': 'ₘ'}
+    
+    def replace_power(m):
+        base, exp = m.groups()
+        return base + ''.join(superscripts.get(c, c) for c in exp)
+    
+    def replace_sub(m):
+        base, sub = m.groups()
+        return base + ''.join(subscripts.get(c, c) for c in sub)
+    
+    text = re.sub(r'(\w+)\^(\w+)', replace_power, text)
+    text = re.sub(r'(\w+)\^\{([^}]+)\}', replace_power, text)
+    text = re.sub(r'(\w+)_(\w+)', replace_sub, text)
+    text = re.sub(r'(\w+)_\{([^}]+)\}', replace_sub, text)
+    
+    replacements = {
+        r'\times': '×', r'\cdot': '·', r'\le': '≤', r'\ge': '≥',
+        r'\ne': '≠', r'\approx': '≈', r'\sum': 'Σ', r'\prod': 'Π',
+        r'\infty': '∞', r'\Rightarrow': '⇒', r'\rightarrow': '→',
+        r'\quad': '  ',
+    }
+    
+    for latex, uni in replacements.items():
+        text = text.replace(latex, uni)
+    
+    return text
+
+
+# Типичный ответ в режиме /math: текст, строчные и выносные формулы всех видов
+ANSWER_PART = r"""
+**Шаг 1.** Найдём производную функции $f(x) = x^2 \cdot \sin x$:
+\[
+f'(x) = 2x \sin x + x^2 \cos x
+\]
+При $x \to 0$ имеем \(f'(x) \approx 2x^2\), а значит
+$$\int_0^1 f(x)\,dx = \frac{1}{3} - \frac{\cos 1}{2}$$
+Стоимость решения - \$5 (обычный знак доллара, не формула).
+
+"""
+
+
+def make_answer(size):
+    """Ответ длиной около size символов"""
+    return ANSWER_PART * max(1, size // len(ANSWER_PART))
+
+
+def bench(func, text, number):
+    return min(timeit.repeat(lambda: func(text), number=number, repeat=5)) / number
+
+
+def main():
+    print(f"{'размер':>10} {'формул':>7} {'прежний, мкс':>14} {'новый, мкс':>12} {'ускорение':>10}")
+    for size in (2_000, 8_000, 32_000, 128_000):
+        text = make_answer(size)
+        number = max(1, 200_000 // len(text))
+        legacy = bench(legacy_extract_latex_blocks, text, number)
+        current = bench(extract_latex_blocks, text, number)
+        blocks = extract_latex_blocks(text)
+        print(
+            f"{len(text):>10} {len(blocks):>7} {legacy * 1e6:>14.1f} "
+            f"{current * 1e6:>12.1f} {legacy / current:>9.1f}x"
+        )
+
+    text = make_answer(32_000)
+    spans = bench(tokenize_latex, text, 20)
+    print(f"\ntokenize_latex (только фрагменты, без dict): {spans * 1e6:.1f} мкс на {len(text)} символов")
+
+    # Без кэша - кэш формул отключён; кэш формул - формулы повторяются,
+    # сам ответ новый; повтор - тот же ответ ещё раз (целиком кэшируются
+    # только тексты до _CACHED_TEXT_CHARS символов)
+    convert = latex_parser._to_unicode
+    formula_to_unicode = latex_parser._formula_to_unicode
+
+    print(f"\n{'размер':>10} {'прежний, мкс':>14} {'без кэша':>10} {'кэш формул':>11} {'повтор, мкс':>12}")
+    for size in (2_000, 8_000, 32_000, 128_000):
+        text = make_answer(size)
+        number = max(1, 200_000 // len(text))
+        legacy = bench(legacy_latex_to_unicode, text, number)
+        latex_parser._formula_to_unicode = formula_to_unicode.__wrapped__
+        current = bench(convert, text, number)
+        latex_parser._formula_to_unicode = formula_to_unicode
+        fragments = bench(convert, text, number)
+        repeated = bench(latex_to_unicode, text, number)
+        print(
+            f"{len(text):>10} {legacy * 1e6:>14.1f} {legacy / current:>9.1f}x "
+            f"{legacy / fragments:>10.1f}x {repeated * 1e6:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
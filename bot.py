@@ -1,28 +1,72 @@
 import traceback
+from functools import partial
 from vk_api.bot_longpoll import VkBotEventType
 
 import config
 from state_manager import StateManager
-from src.bot import vk_client, command_handler, message_handler
+from src.bot import vk_client, command_handler, message_handler, rate_limiter
+from src.bot.rate_limiter import PRIORITY_COMMAND
+from src.bot.dispatcher import EventDispatcher
+from src.bot.admission import BUSY_REPLIES
+from src.bot.coalescer import create_intake
+from src.services.usage_tracker import usage_tracker
 
-def main():
-    # 1. Инициализация
-    longpoll = vk_client.get_longpoll_listener()
-    state = StateManager()
-    
-    print(f"✅ Бот запущен. Группа ID: {config.GROUP_ID}")
-    if config.TRUSTED_IDS:
-        print(f"🔒 Доверенные ID: {sorted(config.TRUSTED_IDS)}")
-    else:
-        print("⚠️ Бот доступен всем (TRUSTED_IDS не задан)")
-    
-    print("👂 Слушаю...")
 
-    # 2. Главный цикл
+def process_event(state, user_id, msg):
+    """Обработка одного сообщения (выполняется в воркере)"""
+    text = msg.get("text", "").strip()
+
+    try:
+        # 4. Обработка команд
+        # (handle_command сам отправит ответ, если это команда)
+        with rate_limiter.priority(PRIORITY_COMMAND):
+            if command_handler.handle_command(text, user_id, state):
+                return
+
+        # 5. Обработка сообщений AI
+        message_handler.handle_message(msg, user_id, state)
+
+    except Exception as e:
+        print(f"❌ КРИТИЧЕСКАЯ ОШИБКА В ЦИКЛЕ: {e}")
+        traceback.print_exc()
+        try:
+            vk_client.send_message(
+                user_id,
+                "❌ Произошла непредвиденная внутренняя ошибка. "
+                "Я сообщил о ней администратору.",
+                mode="raw"
+            )
+        except:
+            pass
+
+def create_dispatcher(state):
+    """Пул воркеров, обрабатывающий события через process_event"""
+    dispatcher = EventDispatcher(
+        partial(process_event, state),
+        workers=config.WORKER_POOL_SIZE,
+        max_queue=config.WORKER_QUEUE_SIZE,
+        max_per_user=config.MAX_PENDING_PER_USER,
+    )
+    dispatcher.start()
+    return dispatcher
+
+def submit_event(dispatcher, user_id, msg):
+    """Передаёт событие в пул воркеров, при перегрузке сразу отвечает пользователю"""
+    # Порядок сообщений одного пользователя сохраняется
+    status = dispatcher.submit(user_id, msg)
+    if status in BUSY_REPLIES:
+        # Быстрый отказ вместо бесконечной очереди
+        print(f"🚦 [{user_id}] запрос отклонён: {status}")
+        with rate_limiter.priority(PRIORITY_COMMAND):
+            vk_client.send_message(user_id, BUSY_REPLIES[status], mode="raw")
+    return status
+
+def iter_messages(longpoll):
+    """Читает LongPoll и отдаёт (user_id, msg) для сообщений, прошедших фильтры"""
     for event in longpoll.listen():
         if event.type != VkBotEventType.MESSAGE_NEW:
             continue
-            
+
         msg = event.obj.message
         user_id = msg["from_id"]
         text = msg.get("text", "").strip()
@@ -32,34 +76,42 @@ def main():
         if config.TRUSTED_IDS and user_id not in config.TRUSTED_IDS:
             print(f"[{user_id}] ID нет в списке доверенных, игнорирую.")
             continue
-            
+
         if not text and not attachments:
             print(f"[{user_id}] ...пустой запрос, игнорирую.")
             continue
-            
+
         print(f"📩 [{user_id}] {text[:60]}...")
-        
-        try:
-            # 4. Обработка команд
-            # (handle_command сам отправит ответ, если это команда)
-            if command_handler.handle_command(text, user_id, state):
-                continue
-            
-            # 5. Обработка сообщений AI
-            message_handler.handle_message(msg, user_id, state)
-
-        except Exception as e:
-            print(f"❌ КРИТИЧЕСКАЯ ОШИБКА В ЦИКЛЕ: {e}")
-            traceback.print_exc()
-            try:
-                vk_client.send_message(
-                    user_id, 
-                    "❌ Произошла непредвиденная внутренняя ошибка. "
-                    "Я сообщил о ней администратору.", 
-                    mode="raw"
-                )
-            except:
-                pass
+        yield user_id, msg
+
+def print_startup_info():
+    print(f"✅ Бот запущен. Группа ID: {config.GROUP_ID}")
+    if config.TRUSTED_IDS:
+        print(f"🔒 Доверенные ID: {sorted(config.TRUSTED_IDS)}")
+    else:
+        print("⚠️ Бот доступен всем (TRUSTED_IDS не задан)")
+
+def main():
+    # 1. Инициализация
+    longpoll = vk_client.get_longpoll_listener()
+    state = StateManager()
+    dispatcher = create_dispatcher(state)
+    intake = create_intake(partial(submit_event, dispatcher), config.COALESCE_WINDOW)
+
+    print_startup_info()
+    print("👂 Слушаю...")
+
+    # 2. Главный цикл
+    try:
+        for user_id, msg in iter_messages(longpoll):
+            intake(user_id, msg)
+    except KeyboardInterrupt:
+        print("\n⏹️ Остановка бота...")
+    finally:
+        # Дожидаемся доставки уже принятых ответов
+        intake.flush_all()
+        dispatcher.shutdown(wait=True)
+        usage_tracker.flush()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,135 @@
+import asyncio
+import traceback
+from functools import partial
+
+import config
+from state_manager import StateManager
+from src.bot import async_vk_client, command_handler, async_message_handler, rate_limiter
+from src.bot.rate_limiter import PRIORITY_COMMAND
+from src.bot.dispatcher import AsyncEventDispatcher
+from src.bot.admission import BUSY_REPLIES
+from src.bot.coalescer import create_intake
+from src.services import async_qwen_client, async_openrouter_client, async_http_pool
+from src.services.usage_tracker import usage_tracker
+
+# /status показывает лимитер и пулы этого рантайма, а не sync-клиента
+STATUS_SOURCES = {
+    "limiter": async_vk_client.rate_limiter,
+    "pool_stats": async_http_pool.format_pool_stats,
+}
+
+
+async def process_event(state, user_id, msg):
+    """Обработка одного сообщения (asyncio-версия bot.process_event)"""
+    text = msg.get("text", "").strip()
+
+    try:
+        # 4. Обработка команд
+        # Команды только меняют state, ответы собираем и отправляем асинхронно
+        replies = []
+        handled = command_handler.handle_command(
+            text, user_id, state,
+            send=lambda uid, reply, mode="math": replies.append((reply, mode)),
+            status_sources=STATUS_SOURCES,
+        )
+        with rate_limiter.priority(PRIORITY_COMMAND):
+            for reply, mode in replies:
+                await async_vk_client.send_message(user_id, reply, mode=mode)
+        if handled:
+            return
+
+        # 5. Обработка сообщений AI
+        await async_message_handler.handle_message(msg, user_id, state)
+
+    except Exception as e:
+        print(f"❌ КРИТИЧЕСКАЯ ОШИБКА В ЦИКЛЕ: {e}")
+        traceback.print_exc()
+        try:
+            await async_vk_client.send_message(
+                user_id,
+                "❌ Произошла непредвиденная внутренняя ошибка. "
+                "Я сообщил о ней администратору.",
+                mode="raw"
+            )
+        except:
+            pass
+
+def submit_event(dispatcher, user_id, msg):
+    """Передаёт событие диспетчеру, при перегрузке сразу отвечает пользователю"""
+    status = dispatcher.submit(user_id, msg)
+    if status in BUSY_REPLIES:
+        # Быстрый отказ отправляем фоном, чтобы не задерживать чтение LongPoll
+        print(f"🚦 [{user_id}] запрос отклонён: {status}")
+        with rate_limiter.priority(PRIORITY_COMMAND):   # задача наследует приоритет
+            dispatcher.spawn(
+                async_vk_client.send_message(user_id, BUSY_REPLIES[status], mode="raw")
+            )
+    return status
+
+async def main():
+    # 1. Инициализация
+    longpoll = async_vk_client.AsyncLongPoll(config.GROUP_ID)
+    state = StateManager()
+    dispatcher = AsyncEventDispatcher(
+        partial(process_event, state),
+        max_concurrency=config.ASYNC_MAX_CONCURRENCY,
+        max_queue=config.WORKER_QUEUE_SIZE,
+        max_per_user=config.MAX_PENDING_PER_USER,
+    )
+    dispatcher.start()
+
+    # Окно склейки работает в своём потоке - события возвращаем в event loop
+    loop = asyncio.get_running_loop()
+    intake = create_intake(
+        lambda user_id, msg: loop.call_soon_threadsafe(submit_event, dispatcher, user_id, msg),
+        config.COALESCE_WINDOW,
+    )
+
+    print(f"✅ Бот запущен (asyncio). Группа ID: {config.GROUP_ID}")
+    if config.TRUSTED_IDS:
+        print(f"🔒 Доверенные ID: {sorted(config.TRUSTED_IDS)}")
+    else:
+        print("⚠️ Бот доступен всем (TRUSTED_IDS не задан)")
+
+    print("👂 Слушаю...")
+
+    # 2. Главный цикл
+    try:
+        async for update in longpoll.listen():
+            if update.get("type") != "message_new":
+                continue
+
+            msg = update["object"]["message"]
+            user_id = msg["from_id"]
+            text = msg.get("text", "").strip()
+            attachments = msg.get("attachments", [])
+
+            # 3. Фильтры
+            if config.TRUSTED_IDS and user_id not in config.TRUSTED_IDS:
+                print(f"[{user_id}] ID нет в списке доверенных, игнорирую.")
+                continue
+
+            if not text and not attachments:
+                print(f"[{user_id}] ...пустой запрос, игнорирую.")
+                continue
+
+            print(f"📩 [{user_id}] {text[:60]}...")
+
+            intake(user_id, msg)
+    except asyncio.CancelledError:
+        print("\n⏹️ Остановка бота...")
+    finally:
+        # Дожидаемся доставки уже принятых ответов и закрываем пулы соединений
+        intake.flush_all()
+        await asyncio.sleep(0)  # даём call_soon_threadsafe передать склеенное
+        await dispatcher.shutdown()
+        await async_qwen_client.close()
+        await async_openrouter_client.close()
+        await async_vk_client.close()
+        usage_tracker.flush()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
\ No newline at end of file
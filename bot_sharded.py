@@ -0,0 +1,119 @@
+"""
+Запуск бота в несколько процессов.
+
+    python bot_sharded.py              - фронт + SHARD_COUNT локальных шардов
+    python bot_sharded.py front        - только фронт (шарды по SHARD_ADDRESSES)
+    python bot_sharded.py shard <N>    - только шард N (например, на другом сервере)
+
+Фронт читает LongPoll и раскидывает события по шардам по хешу user_id,
+каждый шард обрабатывает их обычным путём command_handler/message_handler.
+"""
+
+import sys
+import traceback
+from multiprocessing import Process
+
+import config
+from src.bot.sharding import ShardRouter, serve_shard, parse_address
+from src.bot.coalescer import create_intake
+
+
+def run_shard(index):
+    """Процесс-шард: свой StateManager и свой пул воркеров"""
+    # Импорт внутри: дочерний процесс поднимает свой VK-клиент
+    import bot
+    from state_manager import StateManager
+    from src.services.usage_tracker import usage_tracker, shard_usage_file
+
+    # Пользователь всегда попадает на один шард, поэтому и учёт токенов у шарда свой;
+    # /top дочитывает файлы остальных шардов
+    if config.USAGE_FILE:
+        usage_tracker.use_file(
+            shard_usage_file(config.USAGE_FILE, index),
+            peer_paths=[
+                shard_usage_file(config.USAGE_FILE, other)
+                for other in range(len(config.SHARD_ADDRESSES)) if other != index
+            ],
+        )
+
+    address = config.SHARD_ADDRESSES[index]
+    state = StateManager()
+    dispatcher = bot.create_dispatcher(state)
+    intake = create_intake(
+        lambda user_id, msg: bot.submit_event(dispatcher, user_id, msg),
+        config.COALESCE_WINDOW,
+    )
+    print(f"🧩 Шард #{index} слушает {address}")
+
+    try:
+        serve_shard(parse_address(address), config.SHARD_AUTHKEY, intake)
+    except KeyboardInterrupt:
+        print(f"\n⏹️ Остановка шарда #{index}...")
+    finally:
+        intake.flush_all()
+        dispatcher.shutdown(wait=True)
+        usage_tracker.flush()
+
+
+def run_front():
+    """Фронт: LongPoll -> маршрутизация событий по шардам"""
+    import bot
+    from src.bot import vk_client
+
+    router = ShardRouter(
+        [parse_address(address) for address in config.SHARD_ADDRESSES],
+        config.SHARD_AUTHKEY,
+    )
+    router.connect_all()
+    longpoll = vk_client.get_longpoll_listener()
+
+    bot.print_startup_info()
+    print(f"🧩 Шардов: {len(config.SHARD_ADDRESSES)}")
+    print("👂 Слушаю...")
+
+    try:
+        for user_id, msg in bot.iter_messages(longpoll):
+            try:
+                router.route(user_id, msg)
+            except Exception as e:
+                print(f"❌ Не удалось передать событие шарду: {e}")
+                traceback.print_exc()
+                vk_client.send_message(
+                    user_id,
+                    "❌ Произошла непредвиденная внутренняя ошибка. Попробуйте позже.",
+                    mode="raw"
+                )
+    except KeyboardInterrupt:
+        print("\n⏹️ Остановка фронта...")
+    finally:
+        router.close()
+
+
+def main():
+    args = sys.argv[1:]
+
+    if args[:1] == ["shard"]:
+        run_shard(int(args[1]))
+        return
+
+    if args[:1] == ["front"]:
+        run_front()
+        return
+
+    # Всё на одной машине: шарды - дочерние процессы
+    shards = [
+        Process(target=run_shard, args=(index,), name=f"shard-{index}")
+        for index in range(len(config.SHARD_ADDRESSES))
+    ]
+    for process in shards:
+        process.start()
+
+    try:
+        run_front()
+    finally:
+        # Шарды получают Ctrl+C вместе с фронтом и дообрабатывают свои очереди
+        for process in shards:
+            process.join()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
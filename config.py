@@ -1,4 +1,5 @@
 import os
+import hashlib
 from dotenv import load_dotenv
 
 # Загружаем переменные из .env файла
@@ -35,6 +36,161 @@ MODELS = {
     "deepseek": "deepseek/deepseek-chat-v3.1:free",
 }
 
+# --- Подготовка фото для Qwen ---
+# Скачивать фото самим, уменьшать и передавать прокси как data URI (иначе - ссылкой)
+QWEN_IMAGE_INLINE = os.getenv("QWEN_IMAGE_INLINE", "true").lower() in ("1", "true", "yes")
+# Бюджет пикселей (ширина * высота) и качество JPEG после сжатия
+QWEN_IMAGE_MAX_PIXELS = int(os.getenv("QWEN_IMAGE_MAX_PIXELS", str(1600 * 1200)))
+QWEN_IMAGE_QUALITY = int(os.getenv("QWEN_IMAGE_QUALITY", "85"))
+# Объём кэша подготовленных фото (МБ)
+IMAGE_CACHE_MB = int(os.getenv("IMAGE_CACHE_MB", "64"))
+
+# --- Автомат защиты прокси Qwen ---
+# Размыкается, если среди последних QWEN_BREAKER_WINDOW запросов (минимум QWEN_BREAKER_MIN_CALLS)
+# доля ошибок не меньше QWEN_BREAKER_FAILURE_RATE; через QWEN_BREAKER_OPEN_TIMEOUT сек - пробный запрос
+QWEN_BREAKER_WINDOW = int(os.getenv("QWEN_BREAKER_WINDOW", "20"))
+QWEN_BREAKER_MIN_CALLS = int(os.getenv("QWEN_BREAKER_MIN_CALLS", "4"))
+QWEN_BREAKER_FAILURE_RATE = float(os.getenv("QWEN_BREAKER_FAILURE_RATE", "0.5"))
+QWEN_BREAKER_OPEN_TIMEOUT = float(os.getenv("QWEN_BREAKER_OPEN_TIMEOUT", "60"))
+# Как часто (сек) проверять /api прокси, пока автомат разомкнут
+QWEN_PROBE_INTERVAL = float(os.getenv("QWEN_PROBE_INTERVAL", "10"))
+
+# --- Резервные модели ---
+# Если выбранная модель молчит или ошибается, текстовый запрос без контекста уходит резервной
+AI_ROUTER_ENABLED = os.getenv("AI_ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Через сколько секунд без ответа параллельно спросить резервную модель
+AI_HEDGE_DELAY = float(os.getenv("AI_HEDGE_DELAY", "20"))
+# Сколько секунд всего ждать ответа (основная + резервная)
+AI_LATENCY_BUDGET = float(os.getenv("AI_LATENCY_BUDGET", "90"))
+# Сколько резервных запросов может идти одновременно (у них свой пул потоков)
+AI_HEDGE_WORKERS = int(os.getenv("AI_HEDGE_WORKERS", "4"))
+# Пары "модель:резервная" через запятую
+FALLBACK_MODELS = dict(
+    (part.strip() for part in pair.split(":", 1))
+    for pair in os.getenv("FALLBACK_MODELS", "qwen:deepseek,kimi:deepseek,deepseek:qwen").split(",")
+    if ":" in pair
+)
+
+# --- Лимит запросов к VK API ---
+# Для токена сообщества VK допускает до 20 запросов в секунду
+VK_RATE_LIMIT = float(os.getenv("VK_RATE_LIMIT", "20"))
+VK_RATE_BURST = int(os.getenv("VK_RATE_BURST", "20"))
+# Сколько (сек) обновление индикатора набора может ждать очереди, прежде чем будет пропущено
+VK_TYPING_MAX_WAIT = float(os.getenv("VK_TYPING_MAX_WAIT", "1.0"))
+
+# --- Потоковые ответы ---
+# Текстовый ответ показывается по мере генерации (одно сообщение, которое дописывается)
+STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "true").lower() in ("1", "true", "yes")
+# Как часто (сек) обновлять сообщение через messages.edit
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+# --- Кэш ответов AI (запросы без контекста диалога и фото) ---
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+# Папка для дискового уровня кэша (пусто - только память) и его предельный объём
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", "")
+RESPONSE_CACHE_DISK_MB = int(os.getenv("RESPONSE_CACHE_DISK_MB", "50"))
+
+# --- Поиск почти одинаковых запросов (MinHash) ---
+PROMPT_INDEX_ENABLED = os.getenv("PROMPT_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+PROMPT_INDEX_SIZE = int(os.getenv("PROMPT_INDEX_SIZE", "500"))
+# Минимальное сходство (0..1), при котором берётся готовый ответ
+PROMPT_SIMILARITY_THRESHOLD = float(os.getenv("PROMPT_SIMILARITY_THRESHOLD", "0.9"))
+
+# --- История диалога для OpenRouter ---
+# Лимит истории на пользователя: реплик и токенов (оценка), старые реплики вытесняются первыми
+CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "20"))
+CONVERSATION_MAX_TOKENS = int(os.getenv("CONVERSATION_MAX_TOKENS", "3000"))
+# Общий лимит токенов всех историй (при превышении вытесняются давно неактивные диалоги)
+CONVERSATION_TOTAL_TOKENS = int(os.getenv("CONVERSATION_TOTAL_TOKENS", "500000"))
+
+# --- Рендеринг формул (картинки и PDF) ---
+# mathtext - локально через matplotlib, codecogs - через latex.codecogs.com
+LATEX_RENDERER = os.getenv("LATEX_RENDERER", "mathtext").strip().lower()
+# Запасные рендереры через запятую: для формул, которые основной не осилил (пусто - без запасных)
+LATEX_RENDERER_FALLBACKS = [
+    name.strip().lower() for name in os.getenv("LATEX_RENDERER_FALLBACK", "codecogs").split(",") if name.strip()
+]
+
+# Сколько формул документа рисуется параллельно и сколько (сек) ждём все формулы документа;
+# не успевшие формулы выводятся текстом
+FORMULA_RENDER_WORKERS = int(os.getenv("FORMULA_RENDER_WORKERS", "4"))
+FORMULA_RENDER_DEADLINE = float(os.getenv("FORMULA_RENDER_DEADLINE", "20"))
+
+# --- Кэш отрисованных формул ---
+FORMULA_CACHE_ENABLED = os.getenv("FORMULA_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Объём готовых изображений в памяти (МБ), папка PNG на диске (пусто - только память) и её лимит (МБ)
+FORMULA_CACHE_MB = int(os.getenv("FORMULA_CACHE_MB", "32"))
+FORMULA_CACHE_DIR = os.getenv("FORMULA_CACHE_DIR", os.path.join(BASE_DIR, "cache", "formulas"))
+FORMULA_CACHE_DISK_MB = int(os.getenv("FORMULA_CACHE_DISK_MB", "100"))
+
+# --- Учёт токенов ---
+# Файл со счётчиками (пусто - только в памяти) и как часто (сек) его сохранять
+USAGE_FILE = os.getenv("USAGE_FILE", os.path.join(BASE_DIR, "usage_stats.json"))
+USAGE_FLUSH_INTERVAL = int(os.getenv("USAGE_FLUSH_INTERVAL", "60"))
+# Лимит токенов на пользователя в сутки (0 - без лимита; на администраторов не действует)
+DAILY_TOKEN_BUDGET = int(os.getenv("DAILY_TOKEN_BUDGET", "0"))
+
+# --- Кэш загруженных вложений ---
+# Сколько вложений помнить и сколько (сек) считать их действительными
+UPLOAD_CACHE_SIZE = int(os.getenv("UPLOAD_CACHE_SIZE", "500"))
+UPLOAD_CACHE_TTL = int(os.getenv("UPLOAD_CACHE_TTL", str(24 * 3600)))
+# Фото сообщества переиспользуются во всех диалогах (документы - только в своём)
+UPLOAD_CACHE_SHARE_PHOTOS = os.getenv("UPLOAD_CACHE_SHARE_PHOTOS", "true").lower() in ("1", "true", "yes")
+
+# --- Пул воркеров ---
+# Количество потоков, параллельно обрабатывающих запросы разных пользователей
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", "8"))
+# Максимум событий, ожидающих обработки (во всех очередях).
+# Сверх лимита пользователь сразу получает ответ "бот перегружен"
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "100"))
+# Максимум запросов одного пользователя в работе (в очереди + обрабатывается)
+MAX_PENDING_PER_USER = int(os.getenv("MAX_PENDING_PER_USER", "3"))
+
+# Окно склейки сообщений (сек): быстрые сообщения подряд (текст, затем фото)
+# объединяются в один запрос к AI. 0 - выключено (по умолчанию): окно задерживает
+# на свой размер каждое сообщение, а не только склеиваемые
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "0"))
+
+# --- HTTP (общая сессия с пулами соединений) ---
+# Соединений на хост по умолчанию и для отдельных хостов ("хост:размер" через запятую)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_POOL_SIZES = {
+    host.strip(): int(size)
+    for host, size in (
+        pair.rsplit(":", 1)
+        for pair in os.getenv("HTTP_POOL_SIZES", "api.vk.com:20,latex.codecogs.com:10").split(",")
+        if ":" in pair
+    )
+}
+# Пул к прокси Qwen: по соединению на каждый параллельный запрос (с учётом резервных)
+QWEN_POOL_SIZE = int(os.getenv("QWEN_POOL_SIZE", str(WORKER_POOL_SIZE * 2)))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+# Повторы идемпотентных запросов (GET/HEAD) при сбоях соединения и ответах 429/5xx
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.3"))
+# Как часто (сек) печатать статистику переиспользования соединений (0 - не печатать)
+HTTP_STATS_INTERVAL = int(os.getenv("HTTP_STATS_INTERVAL", "300"))
+
+# --- Asyncio-рантайм (bot_async.py) ---
+# Сколько запросов может одновременно ждать ответа AI
+ASYNC_MAX_CONCURRENCY = int(os.getenv("ASYNC_MAX_CONCURRENCY", "500"))
+# Размер пула HTTP-соединений для каждой aiohttp-сессии
+ASYNC_HTTP_POOL_SIZE = int(os.getenv("ASYNC_HTTP_POOL_SIZE", "100"))
+
+# --- Шардирование (bot_sharded.py) ---
+# Адреса шардов "host:port" через запятую. Если не заданы -
+# поднимается SHARD_COUNT локальных шардов начиная с порта SHARD_BASE_PORT
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "2"))
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", "7100"))
+SHARD_ADDRESSES_RAW = os.getenv("SHARD_ADDRESSES", "").strip()
+SHARD_ADDRESSES = [x.strip() for x in SHARD_ADDRESSES_RAW.split(",") if x.strip()]
+if not SHARD_ADDRESSES:
+    SHARD_ADDRESSES = [f"127.0.0.1:{SHARD_BASE_PORT + i}" for i in range(SHARD_COUNT)]
+# Ключ для аутентификации фронта на шардах (по умолчанию выводится из VK_TOKEN)
+SHARD_AUTHKEY = os.getenv("SHARD_AUTHKEY", "").encode() or hashlib.sha256(VK_TOKEN.encode()).digest()
+
 # --- Доступ ---
 TRUSTED_USER_IDS_RAW = os.getenv("TRUSTED_USER_IDS", "").strip()
 TRUSTED_IDS = set()
@@ -44,10 +200,24 @@ if TRUSTED_USER_IDS_RAW:
         TRUSTED_IDS = set(int(x.strip()) for x in TRUSTED_USER_IDS_RAW.split(",") if x.strip())
     except ValueError:
         raise ValueError("❌ Ошибка в TRUSTED_USER_IDS. Должен быть список ID через запятую (напр. 123,456)")
+
+# Администраторы: служебные команды (/status)
+ADMIN_USER_IDS_RAW = os.getenv("ADMIN_USER_IDS", "").strip()
+ADMIN_IDS = set()
+
+if ADMIN_USER_IDS_RAW:
+    try:
+        ADMIN_IDS = set(int(x.strip()) for x in ADMIN_USER_IDS_RAW.split(",") if x.strip())
+    except ValueError:
+        raise ValueError("❌ Ошибка в ADMIN_USER_IDS. Должен быть список ID через запятую (напр. 123,456)")
     
 # --- Идентификация для OpenRouter ---    
 APP_REFERER = os.getenv("APP_REFERER", "https://my-app.com")
 APP_TITLE = os.getenv("APP_TITLE", "My VK Bot")
 
 if APP_REFERER == "https://my-app.com":
-    print("⚠️ APP_REFERER не задан в .env, OpenRouter может не работать")
\ No newline at end of file
+    print("⚠️ APP_REFERER не задан в .env, OpenRouter может не работать")
+
+# Явная пометка cache_control для системного промпта (Anthropic, Gemini);
+# DeepSeek и Kimi кэшируют одинаковый префикс автоматически
+OPENROUTER_CACHE_CONTROL = os.getenv("OPENROUTER_CACHE_CONTROL", "true").lower() in ("1", "true", "yes")
\ No newline at end of file
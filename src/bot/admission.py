@@ -0,0 +1,79 @@
+from collections import deque
+
+# Результаты AdmissionQueue.offer
+ACCEPTED = "accepted"
+USER_LIMIT = "user_limit"    # у пользователя уже слишком много запросов в работе
+QUEUE_FULL = "queue_full"    # общая очередь переполнена
+
+BUSY_REPLIES = {
+    USER_LIMIT: "⏳ У вас уже есть запросы в работе. Дождитесь ответа и отправьте сообщение снова.",
+    QUEUE_FULL: "⏳ Бот сейчас перегружен. Попробуйте, пожалуйста, чуть позже.",
+}
+
+
+class AdmissionQueue:
+    """
+    Очередь допуска событий к обработке (без собственной синхронизации,
+    блокировки делает вызывающий диспетчер).
+
+    - события одного пользователя выдаются строго по очереди и не параллельно;
+    - пользователи обслуживаются по кругу (round-robin), один активный
+      пользователь не может занять все воркеры;
+    - у каждого пользователя не больше max_per_user запросов в работе
+      (в очереди + обрабатывается);
+    - всего в очереди не больше max_queue событий.
+    """
+    def __init__(self, max_queue=100, max_per_user=3):
+        self.max_queue = max(1, max_queue)
+        self.max_per_user = max(1, max_per_user)
+
+        self._pending = {}        # user_id -> deque событий
+        self._ready = deque()     # пользователи, у которых есть работа (по кругу)
+        self._busy = set()        # пользователи, чьё событие сейчас в работе
+        self.queued = 0
+
+    def in_flight(self, user_id):
+        """Сколько запросов пользователя в очереди и в работе"""
+        queue = self._pending.get(user_id)
+        return (len(queue) if queue else 0) + (1 if user_id in self._busy else 0)
+
+    @property
+    def busy_count(self):
+        return len(self._busy)
+
+    def has_ready(self):
+        return bool(self._ready)
+
+    def offer(self, user_id, event):
+        """Пытается поставить событие в очередь. Возвращает ACCEPTED / USER_LIMIT / QUEUE_FULL"""
+        if self.in_flight(user_id) >= self.max_per_user:
+            return USER_LIMIT
+        if self.queued >= self.max_queue:
+            return QUEUE_FULL
+
+        queue = self._pending.get(user_id)
+        if queue is None:
+            queue = self._pending[user_id] = deque()
+        queue.append(event)
+        self.queued += 1
+
+        # В очередь готовых попадаем, только если пользователь не в работе
+        if len(queue) == 1 and user_id not in self._busy:
+            self._ready.append(user_id)
+        return ACCEPTED
+
+    def take(self):
+        """Забирает следующее событие (по кругу). Вызывать только если has_ready()"""
+        user_id = self._ready.popleft()
+        event = self._pending[user_id].popleft()
+        self.queued -= 1
+        self._busy.add(user_id)
+        return user_id, event
+
+    def done(self, user_id):
+        """Пользователь освободился: если у него ещё есть события - в конец круга"""
+        self._busy.discard(user_id)
+        if self._pending.get(user_id):
+            self._ready.append(user_id)
+        else:
+            self._pending.pop(user_id, None)
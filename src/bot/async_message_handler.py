@@ -0,0 +1,136 @@
+import asyncio
+import time
+import traceback
+from functools import partial
+from src.bot.async_vk_client import send_message, send_as_format, TypingStatusController
+from src.bot.message_handler import (
+    extract_image_urls, image_status_label, UNSUPPORTED_ATTACHMENTS_TEXT,
+    load_history, is_cacheable, find_cached, store_cached, save_context,
+)
+from src.services.usage_tracker import usage_tracker
+from src.services import prompt_builder, async_qwen_client, async_openrouter_client
+
+
+async def handle_message(msg_obj, user_id, state):
+    """
+    Асинхронная версия message_handler.handle_message (та же логика,
+    но ожидание ответа AI не занимает поток).
+    """
+    text = msg_obj.get("text", "").strip()
+    msg_data = msg_obj.get("message", msg_obj)
+    attachments = msg_data.get("attachments", [])
+
+    # --- СБРОС КОНТЕКСТА ---
+    if 'reply_message' not in msg_data:
+        state.clear_user_chat(user_id)
+
+    # --- 1 Обработка вложений ---
+    # Подготовка фото (скачивание и сжатие) - блокирующая, выносим из event loop
+    image_urls, has_unsupported_attachments = await asyncio.to_thread(extract_image_urls, attachments)
+    if has_unsupported_attachments and not image_urls:
+        await send_message(user_id, UNSUPPORTED_ATTACHMENTS_TEXT, mode="raw")
+        return
+
+    # --- 2 Получение настроек ---
+    current_model = state.get_user_model(user_id)
+    current_mode = state.get_mode(user_id)
+    current_format = state.get_format(user_id)
+    chat_context = state.get_user_chat(user_id)
+    chat_id, parent_id = (chat_context[0], chat_context[1]) if chat_context else (None, None)
+
+    if image_urls and current_model != "qwen":
+        await send_message(user_id, f"⚠️ Выбрана модель {current_model}, она не умеет работать с изображениями. Временно переключаю на Qwen.", mode="raw")
+        current_model = "qwen"
+
+    history = load_history(state, user_id, current_model, chat_context)
+
+    # --- 3 Сборка промпта ---
+    # Инструкции режима отдельно от запроса: OpenRouter получает их system-сообщением
+    # (общий префикс кэшируется провайдером), Qwen - одним сообщением
+    system_prompt = prompt_builder.get_system_prompt(current_mode, image_urls)
+    user_prompt = prompt_builder.get_user_prompt(text, current_mode, image_urls)
+    final_prompt = prompt_builder.join_prompt(system_prompt, user_prompt)
+
+    # --- 3.1 Кэш ответов (только запросы без контекста диалога и фото) ---
+    cacheable = is_cacheable(msg_data, chat_context, history, image_urls)
+    if cacheable:
+        cached = find_cached(current_model, current_mode, final_prompt, text)
+        if cached:
+            print(f"-> 💾 [{user_id}] ответ из кэша")
+            await send_as_format(user_id, cached, current_format, current_mode)
+            return
+
+    # --- 3.2 Дневной лимит токенов ---
+    within_budget, used, budget = usage_tracker.check_budget(user_id)
+    if not within_budget:
+        print(f"-> 🚫 [{user_id}] дневной лимит токенов исчерпан ({used}/{budget})")
+        await send_message(user_id, f"🚫 Дневной лимит исчерпан ({used} из {budget} токенов). Лимит обновится завтра.", mode="raw")
+        return
+
+    def on_usage(model, prompt_tokens, completion_tokens, cached_tokens=0):
+        usage_tracker.record(user_id, model, prompt_tokens, completion_tokens)
+        usage_tracker.record_prompt_cache(
+            model, current_mode, prompt_tokens, cached_tokens, time.monotonic() - request_started
+        )
+
+    # --- 4 Отправка подтверждения и запуск индикатора ---
+    model_name = current_model.upper()
+    mode_name = current_mode.upper()
+    image_status = image_status_label(image_urls)
+
+    await send_message(user_id,
+        f"🤖 {model_name} | Режим: {mode_name}{image_status} | Ваш запрос принят в работу...",
+        mode="raw"
+    )
+    print(f"-> 🧠 {current_model} | {current_mode}{image_status} запрос отправлен в работу.")
+
+    typing_controller = TypingStatusController(user_id)
+    typing_controller.start()
+
+    response_text = ""
+    new_chat_id, new_parent_id = None, None
+
+    request_started = time.monotonic()
+    try:
+        # --- 5 Вызов AI ---
+        if current_model == "qwen":
+            # История есть, только если чата на прокси нет (см. load_history)
+            qwen_prompt = prompt_builder.join_prompt(system_prompt, prompt_builder.join_history(history, user_prompt))
+            if image_urls:
+                response_text, new_chat_id, new_parent_id = await async_qwen_client.get_qwen_response_with_image(
+                    qwen_prompt, image_urls, chat_id, parent_id,
+                    on_usage=partial(on_usage, "qwen")
+                )
+            else:
+                response_text, new_chat_id, new_parent_id = await async_qwen_client.get_qwen_response_text_only(
+                    qwen_prompt, chat_id, parent_id,
+                    on_usage=partial(on_usage, "qwen")
+                )
+        else:
+            response_text = await async_openrouter_client.get_openrouter_response(
+                current_model, user_prompt, history,
+                on_usage=partial(on_usage, current_model), system_prompt=system_prompt
+            )
+
+        # Резервной модели в async-версии нет - отвечает выбранная
+        save_context(
+            state, user_id, current_model, current_model, text, response_text, new_chat_id, new_parent_id
+        )
+
+    except Exception as e:
+        print(f"❌ КРИТИЧЕСКАЯ ОШИБКА AI: {e}")
+        traceback.print_exc()
+        await send_message(user_id, f"❌ Ошибка при обработке запроса: {e}", mode="raw")
+        raise e
+
+    finally:
+        typing_controller.stop()
+
+    if cacheable:
+        store_cached(current_model, current_mode, final_prompt, text, current_model, response_text)
+
+    # --- 6 Отправка ответа ---
+    if response_text:
+        await send_as_format(user_id, response_text, current_format, current_mode)
+    else:
+        await send_message(user_id, "❌ Получен пустой ответ от AI.", mode="raw")
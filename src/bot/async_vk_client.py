@@ -0,0 +1,415 @@
+import asyncio
+import io
+import aiohttp
+
+import config
+from src.services import async_http_pool
+from src.bot.vk_batch import (
+    BatchResult, build_execute_code, split_into_chunks, apply_execute_response, error_from_exception
+)
+from src.bot.upload_cache import UploadCache, SHARED_SCOPE, content_digest
+from src.bot.rate_limiter import (
+    AsyncPriorityRateLimiter, RateLimitDropped, PRIORITY_TYPING, priority as rate_priority
+)
+from src.utils.text_helpers import split_message, format_math_response
+from src.utils.pdf_generator import create_pdf_with_formulas, REPORTLAB_AVAILABLE
+from src.utils.image_generator import create_full_answer_image
+
+VK_API_URL = "https://api.vk.com/method/"
+VK_API_VERSION = "5.131"
+
+# Общая сессия с пулом соединений (создаётся внутри event loop)
+_session = None
+
+# Ограничение частоты запросов к VK API (как rate_limiter в vk_client)
+rate_limiter = AsyncPriorityRateLimiter(
+    rate=config.VK_RATE_LIMIT,
+    burst=config.VK_RATE_BURST,
+    max_wait={PRIORITY_TYPING: config.VK_TYPING_MAX_WAIT},
+)
+
+# Кэш загруженных вложений (одинаковые PNG/PDF не загружаются повторно)
+upload_cache = UploadCache(
+    max_entries=config.UPLOAD_CACHE_SIZE,
+    ttl=config.UPLOAD_CACHE_TTL,
+)
+
+
+class AsyncVkApiError(Exception):
+    """Ошибка, которую вернул VK API"""
+    def __init__(self, code, message):
+        super().__init__(f"[{code}] {message}")
+        self.code = code
+        self.message = message
+
+
+def get_session():
+    """Возвращает общую aiohttp-сессию для VK API и загрузок"""
+    global _session
+    if _session is None or _session.closed:
+        _session = async_http_pool.create_session()
+    return _session
+
+
+async def close():
+    """Закрывает сессию при остановке бота"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def call_raw(method, **params):
+    """Вызов метода VK API, возвращает ответ целиком (с execute_errors и т.п.)"""
+    await rate_limiter.acquire()
+    data = {k: str(v) for k, v in params.items() if v is not None}
+    data["access_token"] = config.VK_TOKEN
+    data["v"] = VK_API_VERSION
+
+    async with get_session().post(VK_API_URL + method, data=data) as response:
+        result = await response.json(content_type=None)
+
+    if "error" in result:
+        error = result["error"]
+        raise AsyncVkApiError(error.get("error_code"), error.get("error_msg"))
+    return result
+
+
+async def call(method, **params):
+    """Вызов метода VK API"""
+    return (await call_raw(method, **params))["response"]
+
+
+class AsyncVkBatch:
+    """Асинхронный аналог vk_batch.VkBatch (те же BatchResult и разбиение на пачки)"""
+    def __init__(self):
+        self._calls = []
+
+    def method(self, method, values=None):
+        batch_call = BatchResult(method, dict(values or {}))
+        self._calls.append(batch_call)
+        return batch_call
+
+    async def execute(self):
+        """Выполняет накопленные вызовы. Возвращает список неудачных"""
+        calls, self._calls = self._calls, []
+
+        for chunk in split_into_chunks(calls):
+            try:
+                if len(chunk) == 1:
+                    chunk[0].result = await call(chunk[0].method, **chunk[0].values)
+                    chunk[0].ready = True
+                else:
+                    response = await call_raw("execute", code=build_execute_code(chunk))
+                    apply_execute_response(chunk, response)
+            except AsyncVkApiError as e:
+                for batch_call in chunk:
+                    batch_call.error = {'error_code': e.code, 'error_msg': e.message}
+                    batch_call.ready = True
+            except Exception as e:
+                for batch_call in chunk:
+                    batch_call.error = error_from_exception(e)
+                    batch_call.ready = True
+
+        failed = [batch_call for batch_call in calls if not batch_call.ok]
+        for batch_call in failed:
+            print(f"⚠️ Ошибка вызова в пакете {batch_call.error_text()}")
+        return failed
+
+
+# КЛАСС: АСИНХРОННЫЙ LONGPOLL (вместо VkBotLongPoll.listen())
+class AsyncLongPoll:
+    """Bots LongPoll API поверх aiohttp"""
+    def __init__(self, group_id, wait=25):
+        self.group_id = group_id
+        self.wait = wait
+        self.server = None
+        self.key = None
+        self.ts = None
+
+    async def update_longpoll_server(self, update_ts=True):
+        response = await call("groups.getLongPollServer", group_id=self.group_id)
+        self.server = response["server"]
+        self.key = response["key"]
+        if update_ts:
+            self.ts = response["ts"]
+
+    async def check(self):
+        """Один запрос к LongPoll серверу. Возвращает список событий"""
+        params = {"act": "a_check", "key": self.key, "ts": self.ts, "wait": self.wait}
+        timeout = aiohttp.ClientTimeout(total=self.wait + 10)
+
+        async with get_session().get(self.server, params=params, timeout=timeout) as response:
+            result = await response.json(content_type=None)
+
+        failed = result.get("failed")
+        if failed is None:
+            self.ts = result["ts"]
+            return result.get("updates", [])
+        if failed == 1:
+            # История событий устарела - просто берём новый ts
+            self.ts = result["ts"]
+        elif failed == 2:
+            await self.update_longpoll_server(update_ts=False)
+        else:
+            await self.update_longpoll_server()
+        return []
+
+    async def listen(self):
+        """
+        Асинхронный генератор событий (dict как в ответе LongPoll).
+        Ошибки сети и VK не останавливают цикл (как у VkBotLongPoll): повтор
+        с паузой от 3 до 60 сек; после ошибки API или ответа не того вида
+        сервер LongPoll запрашивается заново.
+        """
+        delay = 3
+        while True:
+            try:
+                if self.server is None:
+                    await self.update_longpoll_server()
+                updates = await self.check()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            except (AsyncVkApiError, RateLimitDropped, KeyError, TypeError, ValueError) as e:
+                error = e
+                self.server = None
+            else:
+                delay = 3
+                for update in updates:
+                    yield update
+                continue
+
+            print(f"⚠️ Ошибка LongPoll: {error!r}. Повтор через {delay} сек...")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+
+# КЛАСС: КОНТРОЛЛЕР СТАТУСА НАБОРА ТЕКСТА (async)
+class TypingStatusController:
+    """Цикличное обновление статуса 'Бот печатает...' в виде asyncio-задачи"""
+    def __init__(self, peer_id: int):
+        self.peer_id = peer_id
+        self._task = None
+
+    async def _run_typing_loop(self):
+        # Обновляем статус каждые 7 сек (10 сек таймаут ВК)
+        while True:
+            try:
+                with rate_priority(PRIORITY_TYPING):
+                    await call("messages.setActivity", peer_id=self.peer_id, type="typing")
+            except RateLimitDropped:
+                pass   # лимитер отбросил обновление - попробуем в следующий раз
+            except Exception as e:
+                print(f"⚠️ Ошибка обновления статуса набора текста для {self.peer_id}: {e}")
+                return
+            await asyncio.sleep(7)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_typing_loop())
+
+    def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+
+# ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ VK
+
+def render_to_bytes(render, text):
+    """Рендерит ответ (create_full_answer_image / create_pdf_with_formulas) в память"""
+    buffer = io.BytesIO()
+    if not render(text, buffer):
+        return None
+    return buffer.getvalue()
+
+
+async def _post_file(upload_url, field, file_data, filename, content_type):
+    form = aiohttp.FormData()
+    form.add_field(field, file_data, filename=filename, content_type=content_type)
+
+    async with get_session().post(upload_url, data=form) as response:
+        if response.status != 200:
+            print(f"❌ Статус: {response.status}")
+            return None
+        return await response.json(content_type=None)
+
+
+async def upload_photo_to_vk(data, user_id, filename="answer.png"):
+    """Загрузка фото из памяти (async, повторная загрузка тех же байтов берётся из upload_cache)"""
+    try:
+        digest = content_digest(data)
+        scope = SHARED_SCOPE if config.UPLOAD_CACHE_SHARE_PHOTOS else user_id
+
+        cached = upload_cache.get("photo", digest, scope)
+        if cached:
+            print(f"♻️ Фото уже загружено: {cached}")
+            return cached
+
+        upload_server = await call("photos.getMessagesUploadServer", peer_id=user_id)
+        response = await _post_file(upload_server['upload_url'], 'photo', data, filename, 'image/png')
+        if not response:
+            return None
+
+        photo = (await call(
+            "photos.saveMessagesPhoto",
+            photo=response['photo'],
+            server=response['server'],
+            hash=response['hash']
+        ))[0]
+
+        attachment = f"photo{photo['owner_id']}_{photo['id']}"
+        upload_cache.put("photo", digest, scope, attachment)
+        return attachment
+    except Exception as e:
+        print(f"❌ Ошибка загрузки фото: {e}")
+        return None
+
+
+async def upload_doc_to_vk(data, user_id, title="document.pdf", filename="document.pdf"):
+    """Загрузка документа из памяти (async, повторная загрузка тех же байтов берётся из upload_cache)"""
+    try:
+        digest = content_digest(data)
+        kind = f"doc:{title}"
+
+        cached = upload_cache.get(kind, digest, user_id)
+        if cached:
+            print(f"♻️ Документ уже загружен: {cached}")
+            return cached
+
+        print(f"📤 Загрузка: {title}")
+
+        upload_data = await call("docs.getMessagesUploadServer", type='doc', peer_id=user_id)
+        if not upload_data or 'upload_url' not in upload_data:
+            return None
+
+        upload_result = await _post_file(upload_data['upload_url'], 'file', data, filename, 'application/pdf')
+        if not upload_result or 'file' not in upload_result:
+            return None
+
+        save_result = await call("docs.save", file=upload_result['file'], title=title)
+
+        if isinstance(save_result, list):
+            doc = save_result[0] if save_result else None
+        elif isinstance(save_result, dict):
+            doc = save_result.get('doc', save_result)
+        else:
+            return None
+
+        if doc and 'owner_id' in doc and 'id' in doc:
+            attachment = f"doc{doc['owner_id']}_{doc['id']}"
+            upload_cache.put(kind, digest, user_id, attachment)
+            return attachment
+
+        return None
+    except Exception as e:
+        print(f"❌ Ошибка загрузки doc: {e}")
+        return None
+
+
+async def send_message(user_id, text, attachment=None, mode="math", batch=None):
+    """Асинхронная версия vk_client.send_message (части уходят одним execute)"""
+    own_batch = batch is None
+    if own_batch:
+        batch = AsyncVkBatch()
+
+    try:
+        if mode == "math":
+            formatted = format_math_response(text)
+        else:
+            formatted = text
+
+        parts = split_message(formatted)
+
+        for i, part in enumerate(parts):
+            if len(parts) > 1:
+                part = f"[Часть {i+1}/{len(parts)}]\n\n" + part
+
+            values = {"user_id": user_id, "message": part, "random_id": 0}
+            if attachment and i == 0:
+                values["attachment"] = attachment
+            batch.method("messages.send", values)
+
+    except Exception as e:
+        print(f"⚠️ Ошибка подготовки сообщения: {e}")
+        await send_fallback(user_id, text)
+        return
+
+    if own_batch:
+        await execute_sends(batch, user_id, text)
+
+
+async def execute_sends(batch, user_id, fallback_text):
+    """Выполняет пакет отправок; если что-то не ушло - отправляет текст без форматирования"""
+    failed = await batch.execute()
+    if failed:
+        print(f"⚠️ Ошибка отправки: не доставлено частей {len(failed)}")
+        forget_rejected_attachments(failed)
+        await send_fallback(user_id, fallback_text)
+
+
+def forget_rejected_attachments(failed):
+    """Вложение из кэша могли удалить в VK - не предлагаем его снова до конца TTL"""
+    for batch_call in failed:
+        attachment = batch_call.values.get("attachment")
+        if attachment and batch_call.error.get("error_code") != "rate_limited":
+            if upload_cache.invalidate(attachment):
+                print(f"♻️ Вложение {attachment} убрано из кэша загрузок")
+
+
+async def send_fallback(user_id, text):
+    try:
+        await call("messages.send", user_id=user_id, message=f"Ошибка отправки. {text[:1000]}", random_id=0)
+    except:
+        pass
+
+
+async def _send_rendered(user_id, text, render, upload, caption, fail_note):
+    """Рендер в память (в пуле потоков), загрузка и отправка"""
+    # Рендеринг - чисто CPU-работа, выносим из event loop
+    data = await asyncio.to_thread(render_to_bytes, render, text)
+    if data:
+        attachment = await upload(data, user_id)
+        if attachment:
+            # Уведомление и текст уходят одним execute
+            batch = AsyncVkBatch()
+            await send_message(user_id, caption, attachment, mode="raw", batch=batch)
+            await send_message(user_id, text, mode="math", batch=batch)
+            await execute_sends(batch, user_id, text)
+            return True
+        return False
+
+    await send_message(user_id, text + fail_note, mode="math")
+    return True
+
+
+async def send_as_format(user_id, text, format_type="text", mode="math"):
+    """Асинхронная версия vk_client.send_as_format"""
+    if mode == "code" or mode == "raw":
+        await send_message(user_id, text, mode=mode)
+        return
+
+    if format_type == "image":
+        print("🎨 Создание изображения с полным ответом...")
+        sent = await _send_rendered(
+            user_id, text, create_full_answer_image, upload_photo_to_vk,
+            "📐 Полное решение с формулами:", "\n\n⚠️ Не удалось создать изображение"
+        )
+        if not sent:
+            await send_message(user_id, text, mode="math")
+
+    elif format_type == "pdf":
+        if not REPORTLAB_AVAILABLE:
+            await send_message(user_id, text + "\n\n⚠️ Модуль PDF (reportlab) не установлен на сервере.", mode="math")
+            return
+
+        print("📄 Создание PDF...")
+        sent = await _send_rendered(
+            user_id, text, create_pdf_with_formulas,
+            lambda data, uid: upload_doc_to_vk(data, uid, "Решение.pdf"),
+            "📄 PDF с решением", "\n\n⚠️ Не удалось создать PDF"
+        )
+        if not sent:
+            await send_message(user_id, "⚠️ Не удалось загрузить PDF\n\n" + text, mode="math")
+
+    else:
+        await send_message(user_id, text, mode="math")
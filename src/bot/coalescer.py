@@ -0,0 +1,163 @@
+import heapq
+import itertools
+import time
+import traceback
+from threading import Thread, Condition, RLock
+
+
+def merge_messages(messages):
+    """
+    Склеивает несколько сообщений пользователя в одно:
+    тексты - через перевод строки, вложения - в общий список.
+    Если хотя бы одно сообщение было ответом (reply_message), контекст сохраняется.
+    """
+    if len(messages) == 1:
+        return messages[0]
+
+    merged = dict(messages[0])
+    merged["text"] = "\n".join(
+        m.get("text", "").strip() for m in messages if m.get("text", "").strip()
+    )
+    merged["attachments"] = [att for m in messages for att in m.get("attachments", [])]
+
+    for m in messages:
+        if "reply_message" in m:
+            merged["reply_message"] = m["reply_message"]
+            break
+    return merged
+
+
+class MessageCoalescer:
+    """
+    Окно склейки сообщений: пока пользователь шлёт сообщения чаще, чем раз
+    в window секунд, они копятся, затем уходят в on_flush(user_id, msg)
+    одним сообщением. max_delay ограничивает общее ожидание первого сообщения.
+    Все таймеры обслуживает один поток (куча дедлайнов).
+
+    Выдача идёт под _emit_lock: пачка извлекается и отдаётся в on_flush одной
+    критической секцией, поэтому события пользователя уходят в том порядке,
+    в каком пришли. Порядок захвата - _emit_lock, затем _cond.
+    """
+    def __init__(self, on_flush, window=1.5, max_delay=None):
+        self.on_flush = on_flush
+        self.window = window
+        self.max_delay = max_delay if max_delay is not None else window * 3
+
+        self._cond = Condition()
+        self._emit_lock = RLock()
+        self._buffers = {}     # user_id -> [сообщения]
+        self._deadlines = {}   # user_id -> (дедлайн, крайний срок)
+        self._heap = []        # (дедлайн, seq, user_id), устаревшие записи пропускаются
+        self._seq = itertools.count()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def start(self):
+        if self.enabled and self._thread is None:
+            self._thread = Thread(target=self._timer_loop, name="coalescer", daemon=True)
+            self._thread.start()
+
+    def add(self, user_id, msg):
+        """Добавляет сообщение в окно пользователя (или отдаёт сразу, если окно выключено)"""
+        if not self.enabled:
+            self.on_flush(user_id, msg)
+            return
+
+        now = time.monotonic()
+        with self._cond:
+            buffer = self._buffers.setdefault(user_id, [])
+            buffer.append(msg)
+
+            _, hard_deadline = self._deadlines.get(user_id, (None, now + self.max_delay))
+            deadline = min(now + self.window, hard_deadline)
+            self._deadlines[user_id] = (deadline, hard_deadline)
+            heapq.heappush(self._heap, (deadline, next(self._seq), user_id))
+            self._cond.notify()
+
+    def flush(self, user_id):
+        """Немедленно отдаёт накопленное (например, перед командой)"""
+        with self._emit_lock:
+            with self._cond:
+                messages = self._pop(user_id)
+            if messages:
+                self._emit(user_id, messages)
+
+    def send_now(self, user_id, msg):
+        """
+        Отдаёт событие мимо окна: сначала накопленное до него, затем само
+        событие - в одной критической секции, чтобы таймер не вклинился между ними
+        """
+        with self._emit_lock:
+            self.flush(user_id)
+            self.on_flush(user_id, msg)
+
+    def flush_all(self):
+        with self._emit_lock:
+            with self._cond:
+                pending = [(user_id, self._pop(user_id)) for user_id in list(self._buffers)]
+            for user_id, messages in pending:
+                self._emit(user_id, messages)
+
+    def _pop(self, user_id):
+        self._deadlines.pop(user_id, None)
+        return self._buffers.pop(user_id, None)
+
+    def _emit(self, user_id, messages):
+        if len(messages) > 1:
+            print(f"🧩 [{user_id}] склеено сообщений: {len(messages)}")
+        try:
+            self.on_flush(user_id, merge_messages(messages))
+        except Exception as e:
+            print(f"❌ Ошибка передачи склеенного сообщения для {user_id}: {e}")
+            traceback.print_exc()
+
+    def _timer_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    deadline, _, user_id = self._heap[0]
+                    current = self._deadlines.get(user_id)
+                    if current is None or current[0] != deadline:
+                        # Окно уже сдвинуто или сброшено - запись устарела
+                        heapq.heappop(self._heap)
+                        continue
+                    delay = deadline - time.monotonic()
+                    if delay > 0:
+                        self._cond.wait(timeout=delay)
+                        continue
+                    heapq.heappop(self._heap)
+                    break
+            # _emit_lock берётся до _cond, поэтому окно перепроверяется заново:
+            # пока его ждали, пачку могли забрать (flush) или продлить (add)
+            with self._emit_lock:
+                with self._cond:
+                    current = self._deadlines.get(user_id)
+                    if current is None or current[0] != deadline:
+                        continue
+                    messages = self._pop(user_id)
+                self._emit(user_id, messages)
+
+
+def create_intake(submit, window):
+    """
+    Вход для событий: обычные сообщения проходят через окно склейки,
+    команды - сразу (накопленное перед ними отдаётся первым, порядок сохраняется).
+    submit(user_id, msg) - куда отдавать готовые события.
+    """
+    coalescer = MessageCoalescer(submit, window=window)
+    coalescer.start()
+
+    def intake(user_id, msg):
+        if msg.get("text", "").strip().startswith('/'):
+            coalescer.send_now(user_id, msg)
+        else:
+            coalescer.add(user_id, msg)
+
+    intake.flush_all = coalescer.flush_all
+    return intake
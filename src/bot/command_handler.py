@@ -1,9 +1,45 @@
 import config
-from src.bot.vk_client import send_message
+from src.bot.vk_client import send_message, rate_limiter
+from src.services import http_pool
+from src.services.qwen_client import qwen_breaker
+from src.services.response_cache import response_cache
+from src.services.prompt_index import prompt_index
+from src.services.formula_cache import formula_cache
+from src.services.usage_tracker import usage_tracker
 
-def handle_command(text, user_id, state):
+
+def build_status_text(state=None, limiter=rate_limiter, pool_stats=http_pool.format_pool_stats):
+    """
+    Состояние бота для администратора (/status).
+    limiter и pool_stats (функция -> строка) - того рантайма, который запущен:
+    по умолчанию sync (vk_client, requests), bot_async передаёт свои.
+    """
+    lines = ["📊 Состояние бота", "", qwen_breaker.format_status()]
+
+    if response_cache is not None:
+        lines.append(response_cache.format_stats())
+    if prompt_index is not None:
+        stats = prompt_index.get_stats()
+        lines.append(
+            f"🔎 Похожие запросы: {stats['entries']} зап., попаданий {stats['hits']}, промахов {stats['misses']}"
+        )
+    if state is not None:
+        stats = state.conversations.get_stats()
+        lines.append(
+            f"💬 Истории OpenRouter: {stats['dialogs']} диал., ~{stats['tokens']} токенов, вытеснено {stats['evicted']}"
+        )
+    if formula_cache is not None:
+        lines.append(formula_cache.format_stats())
+    lines.append(usage_tracker.format_prompt_cache())
+    lines.append(limiter.format_stats())
+    lines.append(pool_stats())
+    return "\n".join(lines)
+
+def handle_command(text, user_id, state, send=send_message, status_sources=None):
     """
     Обрабатывает команды True, если команда была обработана иначе False.
+    send - функция отправки ответа (по умолчанию vk_client.send_message).
+    status_sources - аргументы build_status_text для /status (limiter, pool_stats).
     """
     if not text.startswith('/'):
         return False
@@ -12,7 +48,7 @@ def handle_command(text, user_id, state):
     text = text.lower()
     
     if text == "/help":
-        send_message(user_id,
+        send(user_id,
             "🤖 Команды:\n\n"
             "/model qwen|kimi|deepseek - Выбор ИИ\n"
             "/new - Сбросить/начать новый диалог\n\n"
@@ -29,23 +65,34 @@ def handle_command(text, user_id, state):
         , mode="raw")
         return True
     
+    if text == "/status" and user_id in config.ADMIN_IDS:
+        send(user_id, build_status_text(state, **(status_sources or {})), mode="raw")
+        return True
+    
+    if text.startswith("/top") and user_id in config.ADMIN_IDS:
+        # /top [n] [all] - самые активные пользователи (по умолчанию за сегодня)
+        parts = text.split()
+        limit = next((int(p) for p in parts[1:] if p.isdigit()), 10)
+        send(user_id, usage_tracker.format_top(limit, today="all" not in parts), mode="raw")
+        return True
+    
     if text == "/new":
         state.clear_user_chat(user_id)
-        send_message(user_id, "✅ Контекст диалога сброшен.", mode="raw")
+        send(user_id, "✅ Контекст диалога сброшен.", mode="raw")
         return True
 
     if text.startswith("/model"):
         parts = text.split(maxsplit=1)
         if len(parts) < 2:
-            send_message(user_id, "Укажите: /model qwen|kimi|deepseek", mode="raw")
+            send(user_id, "Укажите: /model qwen|kimi|deepseek", mode="raw")
             return True
         
         model = parts[1].lower()
         if model in config.MODELS:
             state.set_user_model(user_id, model)
-            send_message(user_id, f"✅ Модель: {model}", mode="raw")
+            send(user_id, f"✅ Модель: {model}", mode="raw")
         else:
-            send_message(user_id, "❌ Неизвестная модель", mode="raw")
+            send(user_id, "❌ Неизвестная модель", mode="raw")
         return True
     
     # --- КОМАНДЫ ФОРМАТА (/format, /pdf, /image, /text) ---
@@ -53,30 +100,30 @@ def handle_command(text, user_id, state):
     if text.startswith("/format"):
         parts = text.split(maxsplit=1)
         if len(parts) < 2:
-            send_message(user_id, "Укажите: /format text|image|pdf", mode="raw")
+            send(user_id, "Укажите: /format text|image|pdf", mode="raw")
             return True
         
         fmt = parts[1].lower()
         if state.set_format(user_id, fmt):
-            send_message(user_id, f"✅ Формат: {fmt}", mode="raw")
+            send(user_id, f"✅ Формат: {fmt}", mode="raw")
         else:
-            send_message(user_id, "❌ Доступны: text, image, pdf", mode="raw")
+            send(user_id, "❌ Доступны: text, image, pdf", mode="raw")
         return True
     
     elif text == "/pdf":
         # Команды /pdf /image /text влияют только на формат
         state.set_format(user_id, "pdf")
-        send_message(user_id, "✅ Формат вывода: PDF", mode="raw")
+        send(user_id, "✅ Формат вывода: PDF", mode="raw")
         return True
 
     elif text == "/image":
         state.set_format(user_id, "image")
-        send_message(user_id, "✅ Формат вывода: Изображение", mode="raw")
+        send(user_id, "✅ Формат вывода: Изображение", mode="raw")
         return True
         
     elif text == "/text":
         state.set_format(user_id, "text")
-        send_message(user_id, "✅ Формат вывода: Текст", mode="raw")
+        send(user_id, "✅ Формат вывода: Текст", mode="raw")
         return True
     
     # --- КОМАНДЫ РЕЖИМА (/math, /code, /raw) ---
@@ -85,20 +132,20 @@ def handle_command(text, user_id, state):
         state.set_mode(user_id, "math")
         # Устанавливаем формат по умолчанию PDF
         state.set_format(user_id, "pdf")
-        send_message(user_id, "✅ Режим: Математика (LaTeX). Формат по умолчанию: PDF.", mode="raw")
+        send(user_id, "✅ Режим: Математика (LaTeX). Формат по умолчанию: PDF.", mode="raw")
         return True
 
     elif text == "/code":
         state.set_mode(user_id, "code")
         state.set_format(user_id, "text") # Сбрасываем формат для кода в текст
-        send_message(user_id, "✅ Режим: Код (Форматирование ``` ... ```)", mode="raw")
+        send(user_id, "✅ Режим: Код (Форматирование ``` ... ```)", mode="raw")
         return True
         
     elif text == "/raw":
         state.set_mode(user_id, "raw")
         state.set_format(user_id, "text") # Сбрасываем формат для raw в текст
-        send_message(user_id, "✅ Режим: Raw (Без обработки)", mode="raw")
+        send(user_id, "✅ Режим: Raw (Без обработки)", mode="raw")
         return True
     
-    send_message(user_id, "❓ Неизвестная команда. Введите /help для списка.", mode="raw")
+    send(user_id, "❓ Неизвестная команда. Введите /help для списка.", mode="raw")
     return True
\ No newline at end of file
@@ -0,0 +1,178 @@
+import asyncio
+import traceback
+from threading import Thread, Condition
+
+from src.bot.admission import AdmissionQueue, ACCEPTED
+
+
+class EventDispatcher:
+    """
+    Пул воркеров для обработки событий.
+    События одного пользователя обрабатываются строго по очереди,
+    события разных пользователей - параллельно (по кругу, см. AdmissionQueue).
+    """
+    def __init__(self, handler, workers=8, max_queue=100, max_per_user=3):
+        self.handler = handler
+        self.workers_count = max(1, workers)
+        self.admission = AdmissionQueue(max_queue, max_per_user)
+
+        self._cond = Condition()
+        self._closed = False
+        self._threads = []
+
+    def start(self):
+        """Запускает воркеры"""
+        for i in range(self.workers_count):
+            thread = Thread(target=self._worker_loop, name=f"worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(
+            f"🧵 Запущено воркеров: {self.workers_count} "
+            f"(очередь: {self.admission.max_queue}, на пользователя: {self.admission.max_per_user})"
+        )
+
+    def submit(self, user_id, event):
+        """
+        Ставит событие в очередь пользователя, не блокируясь.
+        Возвращает статус допуска (admission.ACCEPTED / USER_LIMIT / QUEUE_FULL)
+        или None, если диспетчер уже остановлен.
+        """
+        with self._cond:
+            if self._closed:
+                return None
+            status = self.admission.offer(user_id, event)
+            if status == ACCEPTED:
+                self._cond.notify()
+            return status
+
+    def _take(self):
+        """Забирает следующее событие (блокируется, пока нет работы)"""
+        with self._cond:
+            while not self.admission.has_ready():
+                if self._closed and not self.admission.queued:
+                    return None
+                self._cond.wait()
+            return self.admission.take()
+
+    def _done(self, user_id):
+        with self._cond:
+            self.admission.done(user_id)
+            if self._closed:
+                # При остановке будим всех: кому-то пора выходить
+                self._cond.notify_all()
+            elif self.admission.has_ready():
+                self._cond.notify()
+
+    def _worker_loop(self):
+        while True:
+            item = self._take()
+            if item is None:
+                return
+
+            user_id, event = item
+            try:
+                self.handler(user_id, event)
+            except Exception as e:
+                print(f"❌ Ошибка в воркере для {user_id}: {e}")
+                traceback.print_exc()
+            finally:
+                self._done(user_id)
+
+    def shutdown(self, wait=True):
+        """
+        Прекращает приём событий. Уже принятые события дообрабатываются,
+        чтобы пользователи получили свои ответы.
+        """
+        with self._cond:
+            self._closed = True
+            pending = self.admission.queued + self.admission.busy_count
+            self._cond.notify_all()
+
+        if pending:
+            print(f"⏳ Завершаю обработку {pending} событий...")
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        print("🛑 Воркеры остановлены")
+
+
+class AsyncEventDispatcher:
+    """
+    То же самое для asyncio-рантайма: вместо потоков - корутины-воркеры,
+    их число ограничивает количество одновременно обрабатываемых событий.
+    """
+    def __init__(self, handler, max_concurrency=500, max_queue=100, max_per_user=3):
+        self.handler = handler
+        self.workers_count = max(1, max_concurrency)
+        self.admission = AdmissionQueue(max_queue, max_per_user)
+
+        self._wakeup = None
+        self._closed = False
+        self._workers = []
+        # Event loop держит на задачи только слабые ссылки - храним их до завершения
+        self._background = set()
+
+    def start(self):
+        """Запускает воркеры (вызывать внутри event loop)"""
+        self._wakeup = asyncio.Condition()
+        self._workers = [
+            asyncio.create_task(self._worker_loop()) for _ in range(self.workers_count)
+        ]
+
+    def submit(self, user_id, event):
+        """
+        Ставит событие в очередь (вызывается из event loop).
+        Возвращает статус допуска или None, если диспетчер уже остановлен.
+        """
+        if self._closed:
+            return None
+        status = self.admission.offer(user_id, event)
+        if status == ACCEPTED:
+            self.spawn(self._notify())
+        return status
+
+    def spawn(self, coro):
+        """Фоновая задача (вызывается из event loop); ссылка на неё хранится до завершения"""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def _notify(self, wake_all=False):
+        async with self._wakeup:
+            if wake_all:
+                self._wakeup.notify_all()
+            else:
+                self._wakeup.notify()
+
+    async def _worker_loop(self):
+        while True:
+            async with self._wakeup:
+                while not self.admission.has_ready():
+                    if self._closed and not self.admission.queued:
+                        return
+                    await self._wakeup.wait()
+                user_id, event = self.admission.take()
+
+            try:
+                await self.handler(user_id, event)
+            except Exception as e:
+                print(f"❌ Ошибка в обработчике для {user_id}: {e}")
+                traceback.print_exc()
+            finally:
+                self.admission.done(user_id)
+                if self._closed:
+                    await self._notify(wake_all=True)
+                elif self.admission.has_ready():
+                    await self._notify()
+
+    async def shutdown(self):
+        """Прекращает приём событий и дожидается обработки уже принятых"""
+        self._closed = True
+        pending = self.admission.queued + self.admission.busy_count
+        if pending:
+            print(f"⏳ Завершаю обработку {pending} событий...")
+        await self._notify(wake_all=True)
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        print("🛑 Обработчики остановлены")
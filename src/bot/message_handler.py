@@ -1,6 +1,103 @@
+import time
 import traceback
-from src.bot.vk_client import send_message, send_as_format, TypingStatusController
-from src.services import prompt_builder, qwen_client, openrouter_client
+import config
+from src.bot.vk_client import send_message, send_as_format, open_stream, TypingStatusController
+from src.services.response_cache import response_cache
+from src.services.prompt_index import prompt_index
+from src.services.usage_tracker import usage_tracker
+from src.utils.text_helpers import is_error_response
+from src.services import prompt_builder, ai_router, image_preprocessor
+
+UNSUPPORTED_ATTACHMENTS_TEXT = "⚠️ Я умею работать только с *фотографиями* (jpg, png). Пожалуйста, не присылайте документы, видео или другие файлы."
+
+
+def extract_image_urls(attachments):
+    """
+    Собирает фото из вложений (для склеенных сообщений их может быть несколько).
+    Каждое фото готовится для Qwen (размер по метаданным, уменьшение, кэш по id фото).
+    Возвращает (image_urls, has_unsupported_attachments)
+    """
+    image_urls = []
+    has_unsupported_attachments = False
+    for att in attachments or []:
+        if att["type"] == "photo":
+            image = image_preprocessor.prepare_photo(att["photo"])
+            if image:
+                image_urls.append(image)
+        else:
+            # Любой другой тип (doc, video, etc.)
+            has_unsupported_attachments = True
+    return image_urls, has_unsupported_attachments
+
+
+def image_status_label(image_urls):
+    """Пометка о фото для сообщения 'запрос принят'"""
+    if not image_urls:
+        return ""
+    if len(image_urls) == 1:
+        return " 📸 (с фото)"
+    return f" 📸 (с фото: {len(image_urls)})"
+
+
+def wants_streaming(current_format, current_mode):
+    """Потоковый ответ - только когда ответ и так уходит текстом"""
+    if not config.STREAMING_ENABLED:
+        return False
+    return current_format == "text" or current_mode in ("code", "raw")
+
+
+def load_history(state, user_id, model, chat_context):
+    """
+    История реплик для запроса. У OpenRouter контекст - история, которую храним сами.
+    У Qwen - чат на прокси; история у него бывает, только если прошлый ответ дала
+    резервная модель (чата на прокси с этим контекстом нет).
+    """
+    if model == "qwen" and chat_context:
+        return []
+    return state.get_history(user_id)
+
+
+def is_cacheable(msg_data, chat_context, history, image_urls):
+    """
+    Кэш ответов - только для запросов без контекста диалога и фото.
+    Ответ на сообщение - продолжение диалога, даже если контекста не осталось
+    (например, отвечают на ответ из кэша): такой запрос без него не понять.
+    """
+    return 'reply_message' not in msg_data and not chat_context and not history and not image_urls
+
+
+def find_cached(model, mode, final_prompt, text):
+    """Готовый ответ: точное совпадение промпта, затем тот же запрос другими словами"""
+    cached = None
+    if response_cache is not None:
+        cached = response_cache.get(model, mode, final_prompt)
+    if not cached and prompt_index is not None:
+        # Пробелы, пунктуация, "пожалуйста"
+        cached = prompt_index.find(model, mode, text)
+    return cached
+
+
+def store_cached(model, mode, final_prompt, text, answered_by, response_text):
+    """Кладёт ответ в кэш. Ответы резервной модели не кэшируем - в следующий раз ответит выбранная"""
+    if answered_by != model or not response_text or is_error_response(response_text):
+        return
+    if response_cache is not None:
+        response_cache.put(model, mode, final_prompt, response_text)
+    if prompt_index is not None:
+        prompt_index.add(model, mode, text, response_text)
+
+
+def save_context(state, user_id, model, answered_by, text, response_text, new_chat_id, new_parent_id):
+    """
+    Контекст сохраняем для выбранной модели - следующий ответ пойдёт ей,
+    даже если этот дала резервная: чат Qwen, если выбран и ответил Qwen,
+    иначе история реплик (в историю - сам запрос, без инструкций режима).
+    """
+    if model == "qwen" and answered_by == "qwen":
+        if new_chat_id:
+            state.update_user_chat(user_id, new_chat_id, new_parent_id)
+    elif response_text and not is_error_response(response_text):
+        state.add_history_turn(user_id, text, response_text)
 
 
 def handle_message(msg_obj, user_id, state):
@@ -13,27 +110,16 @@ def handle_message(msg_obj, user_id, state):
     attachments = msg_data.get("attachments", [])
     
     # --- СБРОС КОНТЕКСТА ---
-    # Если это НЕ ответ на сообщение (нет reply_message), то сбрасываем контекст Qwen.
+    # Если это НЕ ответ на сообщение (нет reply_message), то сбрасываем контекст
+    # (чат Qwen и историю для OpenRouter).
     if 'reply_message' not in msg_data:
         state.clear_user_chat(user_id) 
         
     # --- 1 Обработка вложений ---
-    image_url = None
-    has_unsupported_attachments = False
-    if attachments:
-        for att in attachments:
-            if att["type"] == "photo":
-                sizes = att["photo"]["sizes"]
-                largest = max(sizes, key=lambda s: s["width"] * s["height"])
-                image_url = largest["url"]
-                break # Поддерживаем только одно фото пока так
-            else:
-                # Любой другой тип (doc, video, etc.)
-                has_unsupported_attachments = True
-        
-        if has_unsupported_attachments and not image_url:
-            send_message(user_id, "⚠️ Я умею работать только с *фотографиями* (jpg, png). Пожалуйста, не присылайте документы, видео или другие файлы.", mode="raw")
-            return
+    image_urls, has_unsupported_attachments = extract_image_urls(attachments)
+    if has_unsupported_attachments and not image_urls:
+        send_message(user_id, UNSUPPORTED_ATTACHMENTS_TEXT, mode="raw")
+        return
 
     # --- 2 Получение настроек ---
     current_model = state.get_user_model(user_id)
@@ -43,17 +129,45 @@ def handle_message(msg_obj, user_id, state):
     chat_id, parent_id = (chat_context[0], chat_context[1]) if chat_context else (None, None)
 
     # Изображения поддерживаются только Qwen
-    if image_url and current_model != "qwen":
+    if image_urls and current_model != "qwen":
         send_message(user_id, f"⚠️ Выбрана модель {current_model}, она не умеет работать с изображениями. Временно переключаю на Qwen.", mode="raw")
         current_model = "qwen"
 
+    history = load_history(state, user_id, current_model, chat_context)
+
     # --- 3 Сборка промпта ---
-    final_prompt = prompt_builder.get_final_prompt(text, current_mode, image_url)
+    # Инструкции режима отдельно от запроса: OpenRouter получает их system-сообщением
+    # (общий префикс кэшируется провайдером), Qwen - одним сообщением
+    system_prompt = prompt_builder.get_system_prompt(current_mode, image_urls)
+    user_prompt = prompt_builder.get_user_prompt(text, current_mode, image_urls)
+    final_prompt = prompt_builder.join_prompt(system_prompt, user_prompt)
+
+    # --- 3.1 Кэш ответов (только запросы без контекста диалога и фото) ---
+    cacheable = is_cacheable(msg_data, chat_context, history, image_urls)
+    if cacheable:
+        cached = find_cached(current_model, current_mode, final_prompt, text)
+        if cached:
+            print(f"-> 💾 [{user_id}] ответ из кэша")
+            send_as_format(user_id, cached, current_format, current_mode)
+            return
+
+    # --- 3.2 Дневной лимит токенов ---
+    within_budget, used, budget = usage_tracker.check_budget(user_id)
+    if not within_budget:
+        print(f"-> 🚫 [{user_id}] дневной лимит токенов исчерпан ({used}/{budget})")
+        send_message(user_id, f"🚫 Дневной лимит исчерпан ({used} из {budget} токенов). Лимит обновится завтра.", mode="raw")
+        return
+
+    def on_usage(model, prompt_tokens, completion_tokens, cached_tokens=0):
+        usage_tracker.record(user_id, model, prompt_tokens, completion_tokens)
+        usage_tracker.record_prompt_cache(
+            model, current_mode, prompt_tokens, cached_tokens, time.monotonic() - request_started
+        )
 
     # --- 4 Отправка подтверждения и запуск индикатора ---
     model_name = current_model.upper()
     mode_name = current_mode.upper()
-    image_status = " 📸 (с фото)" if image_url else ""
+    image_status = image_status_label(image_urls)
 
     send_message(user_id, 
         f"🤖 {model_name} | Режим: {mode_name}{image_status} | Ваш запрос принят в работу...", 
@@ -65,30 +179,31 @@ def handle_message(msg_obj, user_id, state):
     typing_controller = TypingStatusController(user_id)
     typing_controller.start()
     
+    # Потоковый режим: ответ появляется по мере генерации
+    stream = None
+    on_delta = None
+    if wants_streaming(current_format, current_mode):
+        stream = open_stream(user_id, current_mode)
+        
+        def on_delta(delta):
+            # Пользователь уже видит текст - индикатор больше не нужен
+            typing_controller.stop()
+            stream.push(delta)
+    
     response_text = ""
     new_chat_id, new_parent_id = None, None
+    answered_by = current_model
     
+    request_started = time.monotonic()
     try:
-        # --- 5 Вызов AI ---
-        if current_model == "qwen":
-            if image_url:
-                response_text, new_chat_id, new_parent_id = qwen_client.get_qwen_response_with_image(
-                    final_prompt, image_url, chat_id, parent_id
-                )
-            else:
-                response_text, new_chat_id, new_parent_id = qwen_client.get_qwen_response_text_only(
-                    final_prompt, chat_id, parent_id
-                )
-            
-            # Обнова контекста чата qwen
-            if new_chat_id:
-                state.update_user_chat(user_id, new_chat_id, new_parent_id)
-                
-        else:
-            # OpenRouter (Kimi, Deepseek)
-            response_text = openrouter_client.get_openrouter_response(
-                current_model, final_prompt
-            )
+        # --- 5 Вызов AI (с резервной моделью, см. ai_router) ---
+        response_text, new_chat_id, new_parent_id, answered_by = ai_router.get_response(
+            current_model, user_prompt, chat_id, parent_id, image_urls,
+            on_delta=on_delta, on_usage=on_usage, history=history, system_prompt=system_prompt
+        )
+        save_context(
+            state, user_id, current_model, answered_by, text, response_text, new_chat_id, new_parent_id
+        )
 
     except Exception as e:
         print(f"❌ КРИТИЧЕСКАЯ ОШИБКА AI: {e}")
@@ -100,7 +215,16 @@ def handle_message(msg_obj, user_id, state):
         # ОСТАНОВКА ИНДИКАТОРА ПРОИЗВОДИТСЯ ЗДЕСЬ
         typing_controller.stop()
 
+    if cacheable:
+        store_cached(current_model, current_mode, final_prompt, text, answered_by, response_text)
+
     # --- 6 Отправка ответа ---
+    if stream and stream.started:
+        # Дописываем потоковое сообщение; если не вышло - отправляем ответ обычным путём
+        if stream.finish(response_text):
+            return
+        print(f"⚠️ Потоковое сообщение для {user_id} не доставлено, отправляю ответ целиком")
+    
     if response_text:
         send_as_format(user_id, response_text, current_format, current_mode)
     else:
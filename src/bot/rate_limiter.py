@@ -0,0 +1,227 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+# Классы приоритета: чем меньше число, тем раньше получает токен
+PRIORITY_COMMAND = 0   # ответы на команды и быстрые отказы
+PRIORITY_ANSWER = 1    # доставка ответов AI
+PRIORITY_TYPING = 2    # индикатор 'Бот печатает...'
+
+PRIORITY_NAMES = {
+    PRIORITY_COMMAND: "command",
+    PRIORITY_ANSWER: "answer",
+    PRIORITY_TYPING: "typing",
+}
+
+# Свой у каждого потока и у каждой asyncio-задачи
+_priority = contextvars.ContextVar("vk_priority", default=None)
+
+
+@contextmanager
+def priority(level):
+    """Задаёт приоритет вызовов VK API в текущем потоке (или asyncio-задаче)"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    level = _priority.get()
+    return PRIORITY_ANSWER if level is None else level
+
+
+class RateLimitDropped(Exception):
+    """Вызов не дождался токена и был отброшен (низкий приоритет)"""
+    def __init__(self, level, waited):
+        name = PRIORITY_NAMES.get(level, level)
+        super().__init__(f"VK rate limit: вызов '{name}' отброшен после {waited:.2f} сек ожидания")
+        # Формат как у vk_api.ApiError.error, чтобы VkBatch разложил ошибку по вызовам
+        self.error = {"error_code": "rate_limited", "error_msg": str(self)}
+
+
+class PriorityRateLimiter:
+    """
+    Token bucket с очередью по приоритетам.
+    Токены выдаются строго по (приоритет, порядок прихода); если для класса задано
+    максимальное ожидание (max_wait), то при его превышении вызов отбрасывается.
+    Поэтому под нагрузкой первыми страдают индикаторы набора, а не ответы.
+    """
+    def __init__(self, rate=20, burst=None, max_wait=None, stats_interval=60):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.max_wait = dict(max_wait or {})
+        self.stats_interval = stats_interval
+
+        self._cond = threading.Condition()
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._waiters = []            # (приоритет, seq)
+        self._seq = itertools.count()
+
+        # Метрики времени ожидания в очереди по классам
+        self._stats = {
+            level: {"calls": 0, "dropped": 0, "wait_total": 0.0, "wait_max": 0.0}
+            for level in PRIORITY_NAMES
+        }
+        self._last_report = time.monotonic()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _enqueue(self, level):
+        ticket = (level, next(self._seq))
+        heapq.heappush(self._waiters, ticket)
+        return ticket
+
+    def _leave(self, ticket):
+        if ticket in self._waiters:
+            self._waiters.remove(ticket)
+            heapq.heapify(self._waiters)
+
+    def _step(self, ticket, started, max_wait, notify_all):
+        """
+        Одна попытка взять токен (под блокировкой). Возвращает (взят ли токен,
+        сколько ждать до следующей попытки; None - пока не разбудят).
+        """
+        now = time.monotonic()
+        self._refill(now)
+        first = self._waiters[0] == ticket
+
+        if first and self._tokens >= 1:
+            heapq.heappop(self._waiters)
+            self._tokens -= 1
+            notify_all()   # очередь сдвинулась - следующий становится первым
+            return True, None
+
+        waited = now - started
+        if max_wait is not None and waited >= max_wait:
+            self._leave(ticket)
+            notify_all()
+            self._record(ticket[0], waited, dropped=True)
+            raise RateLimitDropped(ticket[0], waited)
+
+        # Первый ждёт появления токена; остальные - пока их не разбудит сдвиг очереди
+        timeout = (1 - self._tokens) / self.rate if first else None
+        if max_wait is not None:
+            timeout = max_wait - waited if timeout is None else min(timeout, max_wait - waited)
+        return False, timeout
+
+    def acquire(self, level=None):
+        """Ждёт токен. Возвращает время ожидания; бросает RateLimitDropped, если вызов отброшен"""
+        level = current_priority() if level is None else level
+        started = time.monotonic()
+        max_wait = self.max_wait.get(level)
+
+        with self._cond:
+            ticket = self._enqueue(level)
+            try:
+                while True:
+                    taken, timeout = self._step(ticket, started, max_wait, self._cond.notify_all)
+                    if taken:
+                        break
+                    self._cond.wait(timeout=timeout)
+            except RateLimitDropped:
+                raise
+            except BaseException:
+                self._leave(ticket)
+                self._cond.notify_all()
+                raise
+
+            waited = time.monotonic() - started
+            self._record(level, waited)
+
+        self._maybe_report()
+        return waited
+
+    def _record(self, level, waited, dropped=False):
+        stats = self._stats.setdefault(level, {"calls": 0, "dropped": 0, "wait_total": 0.0, "wait_max": 0.0})
+        if dropped:
+            stats["dropped"] += 1
+            return
+        stats["calls"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+
+    def get_stats(self):
+        """Метрики по классам: вызовы, отброшенные, среднее и максимальное ожидание (сек)"""
+        with self._cond:
+            result = {}
+            for level, stats in self._stats.items():
+                calls = stats["calls"]
+                result[PRIORITY_NAMES.get(level, level)] = {
+                    "calls": calls,
+                    "dropped": stats["dropped"],
+                    "wait_avg": stats["wait_total"] / calls if calls else 0.0,
+                    "wait_max": stats["wait_max"],
+                }
+            result["queued"] = len(self._waiters)
+            return result
+
+    def format_stats(self):
+        stats = self.get_stats()
+        queued = stats.pop("queued")
+        parts = [
+            f"{name}: {s['calls']} выз., ожид. ср {s['wait_avg'] * 1000:.0f} мс / "
+            f"макс {s['wait_max'] * 1000:.0f} мс, отброшено {s['dropped']}"
+            for name, s in stats.items()
+        ]
+        return f"🚦 VK rate limit (в очереди {queued}) | " + " | ".join(parts)
+
+    def _maybe_report(self):
+        if not self.stats_interval:
+            return
+        now = time.monotonic()
+        if now - self._last_report >= self.stats_interval:
+            self._last_report = now
+            print(self.format_stats())
+
+
+class AsyncPriorityRateLimiter(PriorityRateLimiter):
+    """
+    PriorityRateLimiter для asyncio-версии бота: та же очередь по приоритетам
+    и те же метрики, но ожидание токена не блокирует event loop.
+    Все вызовы acquire - из одного event loop.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._async_cond = None
+
+    async def acquire(self, level=None):
+        """Ждёт токен. Возвращает время ожидания; бросает RateLimitDropped, если вызов отброшен"""
+        level = current_priority() if level is None else level
+        started = time.monotonic()
+        max_wait = self.max_wait.get(level)
+        if self._async_cond is None:
+            self._async_cond = asyncio.Condition()   # создаётся внутри event loop
+        cond = self._async_cond
+
+        async with cond:
+            ticket = self._enqueue(level)
+            try:
+                while True:
+                    taken, timeout = self._step(ticket, started, max_wait, cond.notify_all)
+                    if taken:
+                        break
+                    try:
+                        await asyncio.wait_for(cond.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except RateLimitDropped:
+                raise
+            except BaseException:
+                self._leave(ticket)
+                cond.notify_all()
+                raise
+
+            waited = time.monotonic() - started
+            self._record(level, waited)
+
+        self._maybe_report()
+        return waited
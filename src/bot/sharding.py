@@ -0,0 +1,161 @@
+import socket
+import time
+import zlib
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import (
+    Connection, Listener, answer_challenge, deliver_challenge,
+)
+
+
+def shard_for(user_id, shard_count):
+    """Номер шарда, которому принадлежит пользователь (стабилен между перезапусками)"""
+    return zlib.crc32(str(user_id).encode()) % shard_count
+
+
+def parse_address(address):
+    """'host:port' -> ('host', port)"""
+    host, _, port = address.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+
+class ShardRouter:
+    """
+    Фронт-сторона: держит по соединению на каждый шард и отправляет
+    туда события. Пользователь всегда попадает на один и тот же шард,
+    поэтому его состояние (StateManager) живёт ровно в одном процессе.
+
+    Если шард лежит, события для него копятся в небольшой очереди и
+    уходят, когда шард поднимется; переподключение - не чаще раза в
+    retry_interval и с коротким таймаутом, чтобы не тормозить LongPoll.
+    """
+    def __init__(self, addresses, authkey, connect_timeout=30,
+                 route_timeout=2, retry_interval=5, backlog=100):
+        self.addresses = list(addresses)
+        self.authkey = authkey
+        self.connect_timeout = connect_timeout
+        self.route_timeout = route_timeout
+        self.retry_interval = retry_interval
+        self.backlog = backlog
+        self._connections = [None] * len(self.addresses)
+        self._pending = [deque() for _ in self.addresses]
+        self._retry_at = [0.0] * len(self.addresses)
+
+    def _open(self, index, timeout):
+        """Одна попытка подключения: TCP-соединение с таймаутом + рукопожатие authkey"""
+        sock = socket.create_connection(self.addresses[index], timeout=timeout)
+        sock.settimeout(None)  # Connection работает с блокирующим сокетом
+        conn = Connection(sock.detach())
+        try:
+            answer_challenge(conn, self.authkey)
+            deliver_challenge(conn, self.authkey)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    def _connect(self, index):
+        """Подключение к шарду с повторами (шард может ещё запускаться)"""
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                conn = self._open(index, max(deadline - time.monotonic(), 0.1))
+                self._connections[index] = conn
+                print(f"🔗 Подключён шард #{index} ({self.addresses[index]})")
+                return conn
+            except (ConnectionError, OSError, EOFError, AuthenticationError) as e:
+                if time.monotonic() >= deadline:
+                    raise ConnectionError(f"Шард #{index} недоступен: {e}")
+                time.sleep(0.5)
+
+    def connect_all(self):
+        for index in range(len(self.addresses)):
+            self._connect(index)
+
+    def _disconnect(self, index):
+        conn, self._connections[index] = self._connections[index], None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def _deliver(self, index, reconnect=True):
+        """
+        Отправляет очередь шарда. Если шард недоступен - события остаются
+        в очереди, а следующая попытка будет не раньше чем через retry_interval
+        """
+        pending = self._pending[index]
+        if self._connections[index] is None:
+            if time.monotonic() < self._retry_at[index]:
+                return False
+            try:
+                self._connections[index] = self._open(index, self.route_timeout)
+                print(f"🔗 Подключён шард #{index} ({self.addresses[index]})")
+            except (ConnectionError, OSError, EOFError, AuthenticationError) as e:
+                self._retry_at[index] = time.monotonic() + self.retry_interval
+                print(f"⚠️ Шард #{index} недоступен: {e}; в очереди {len(pending)} событий")
+                return False
+        while pending:
+            try:
+                self._connections[index].send(pending[0])
+            except (ConnectionError, OSError, EOFError):
+                # Шард перезапустился - одна попытка переподключиться сразу
+                print(f"⚠️ Соединение с шардом #{index} потеряно, переподключаюсь...")
+                self._disconnect(index)
+                return reconnect and self._deliver(index, reconnect=False)
+            pending.popleft()
+        return True
+
+    def route(self, user_id, msg):
+        """
+        Отправляет событие на шард пользователя. Возвращает номер шарда.
+        ConnectionError - шард недоступен и его очередь заполнена (событие отброшено)
+        """
+        index = shard_for(user_id, len(self.addresses))
+        msg = dict(msg)  # DotDict из vk_api -> обычный dict для pickle
+        pending = self._pending[index]
+        if len(pending) >= self.backlog:
+            # Очередь полна: сначала пробуем её отдать, иначе отбрасываем событие
+            if not self._deliver(index):
+                raise ConnectionError(f"Шард #{index} недоступен, очередь заполнена")
+        pending.append((user_id, msg))
+        self._deliver(index)
+        # Очереди остальных шардов, если им пора повторить попытку
+        for other, queued in enumerate(self._pending):
+            if queued and other != index:
+                self._deliver(other)
+        return index
+
+    def close(self):
+        for index, pending in enumerate(self._pending):
+            if pending:
+                print(f"⚠️ Шард #{index}: не доставлено {len(pending)} событий")
+        for index in range(len(self.addresses)):
+            self._disconnect(index)
+
+
+def serve_shard(address, authkey, on_event):
+    """
+    Шард-сторона: принимает соединение от фронта и передаёт каждое
+    событие в on_event(user_id, msg). Если фронт отключился - ждёт нового.
+    """
+    with Listener(address, authkey=authkey) as listener:
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, EOFError, OSError) as e:
+                # Чужой клиент, неверный authkey или обрыв на рукопожатии -
+                # шард продолжает ждать фронт
+                print(f"⚠️ Отклонено подключение к шарду: {e!r}")
+                time.sleep(0.1)
+                continue
+            with conn:
+                print(f"🔗 Фронт подключён: {listener.last_accepted}")
+                while True:
+                    try:
+                        user_id, msg = conn.recv()
+                    except (EOFError, ConnectionError, OSError):
+                        print("⚠️ Фронт отключился, жду переподключения...")
+                        break
+                    on_event(user_id, msg)
@@ -0,0 +1,95 @@
+import time
+
+
+def find_cut(text, limit):
+    """Где разрезать текст длиннее limit: по абзацу, строке или пробелу (иначе - жёстко)"""
+    for separator in ('\n\n', '\n', ' '):
+        pos = text.rfind(separator, 0, limit)
+        if pos > limit // 2:
+            return pos
+    return limit
+
+
+class StreamingMessage:
+    """
+    Ответ, который появляется по мере генерации.
+
+    Первый фрагмент сразу уходит новым сообщением (send(text) -> message_id),
+    дальше сообщение обновляется через edit(message_id, text) не чаще, чем раз
+    в interval секунд. Когда текст перерастает max_length (граница split_message),
+    сообщение закрывается и продолжение идёт следующим.
+    """
+    def __init__(self, send, edit, interval=1.5, max_length=4000, formatter=None):
+        self.send = send
+        self.edit = edit
+        self.interval = interval
+        self.max_length = max_length
+        self.formatter = formatter or (lambda text: text)
+
+        self.text = ""
+        self.failed = False
+        self.messages = 0           # сколько сообщений занял ответ
+        self._offset = 0            # начало текущего сообщения в self.text
+        self._message_id = None
+        self._shown = None          # что сейчас показано в текущем сообщении
+        self._last_update = 0.0
+        self._created = time.monotonic()
+
+    @property
+    def started(self):
+        return self.messages > 0
+
+    def push(self, delta):
+        """Новый кусок текста от модели"""
+        if self.failed or not delta:
+            return
+        self.text += delta
+        if time.monotonic() - self._last_update >= self.interval:
+            self._flush()
+
+    def finish(self, final_text=None):
+        """
+        Последнее обновление. final_text - итоговый ответ клиента: если он продолжает
+        показанный текст, дописываем его, иначе (ошибка посреди потока) - добавляем в конец.
+        Возвращает False, если ответ доставить не удалось (нужна обычная отправка).
+        """
+        if final_text and final_text != self.text:
+            if final_text.startswith(self.text):
+                self.text = final_text
+            else:
+                self.text = f"{self.text}\n\n{final_text}" if self.text else final_text
+        if not self.failed:
+            self._flush()
+        return not self.failed
+
+    def _flush(self):
+        self._last_update = time.monotonic()
+        # Перенос в новое сообщение на границе max_length
+        while len(self.text) - self._offset > self.max_length and not self.failed:
+            cut = self._offset + find_cut(self.text[self._offset:], self.max_length)
+            self._show(self.text[self._offset:cut])
+            self._message_id = None
+            self._shown = None
+            self._offset = cut
+            while self._offset < len(self.text) and self.text[self._offset].isspace():
+                self._offset += 1
+        if not self.failed:
+            self._show(self.text[self._offset:])
+
+    def _show(self, segment):
+        rendered = self.formatter(segment).strip()
+        if not rendered or rendered == self._shown:
+            return
+
+        if self._message_id is None:
+            self._message_id = self.send(rendered)
+            if self._message_id is None:
+                self.failed = True
+                return
+            if not self.messages:
+                print(f"⚡ Первый фрагмент ответа через {time.monotonic() - self._created:.2f} сек")
+            self.messages += 1
+        elif not self.edit(self._message_id, rendered):
+            self.failed = True
+            return
+        self._shown = rendered
@@ -0,0 +1,114 @@
+import heapq
+import itertools
+import time
+import traceback
+from threading import Thread, Condition
+
+
+class TypingScheduler:
+    """
+    Один поток на все индикаторы 'Бот печатает...'.
+
+    Держит множество активных собеседников и кучу сроков обновления.
+    Когда подходит срок, собирает всех, кому пора (с небольшим запасом),
+    и обновляет статус одним пакетом через send_batch(peer_ids),
+    который возвращает собеседников, для которых обновить не удалось.
+    start/stop - O(1), устаревшие записи в куче просто пропускаются.
+    """
+    def __init__(self, send_batch, interval=7, slack=1.0):
+        self.send_batch = send_batch
+        self.interval = interval    # ВК держит статус ~10 сек
+        self.slack = slack          # кого обновить заодно, если срок почти подошёл
+
+        self._cond = Condition()
+        self._handles = {}          # handle -> peer_id
+        self._refs = {}             # peer_id -> число активных handle
+        self._due = {}              # peer_id -> ближайший срок обновления
+        self._heap = []             # (срок, peer_id)
+        self._ids = itertools.count(1)
+        self._thread = None
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self._run, name="typing-scheduler", daemon=True)
+            self._thread.start()
+
+    def start(self, peer_id):
+        """Включает индикатор для собеседника. Возвращает handle для stop()"""
+        with self._cond:
+            handle = next(self._ids)
+            self._handles[handle] = peer_id
+            self._refs[peer_id] = self._refs.get(peer_id, 0) + 1
+
+            if peer_id not in self._due:
+                # Новый собеседник - статус нужен сразу
+                now = time.monotonic()
+                self._due[peer_id] = now
+                heapq.heappush(self._heap, (now, peer_id))
+                self._cond.notify()
+
+            self._ensure_thread()
+            return handle
+
+    def stop(self, handle):
+        """Выключает индикатор (повторный вызов безопасен)"""
+        with self._cond:
+            peer_id = self._handles.pop(handle, None)
+            if peer_id is None:
+                return
+            self._refs[peer_id] -= 1
+            if self._refs[peer_id] <= 0:
+                del self._refs[peer_id]
+                self._due.pop(peer_id, None)
+
+    @property
+    def active_count(self):
+        return len(self._due)
+
+    def _collect_due(self):
+        """Ждёт ближайшего срока и забирает всех собеседников, кому пора обновиться"""
+        with self._cond:
+            while True:
+                # Пропускаем устаревшие записи
+                while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                delay = self._heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(timeout=delay)
+                    continue
+                break
+
+            now = time.monotonic()
+            peers = []
+            while self._heap and self._heap[0][0] <= now + self.slack:
+                due, peer_id = heapq.heappop(self._heap)
+                if self._due.get(peer_id) != due:
+                    continue
+                peers.append(peer_id)
+                next_due = now + self.interval
+                self._due[peer_id] = next_due
+                heapq.heappush(self._heap, (next_due, peer_id))
+            return peers
+
+    def _run(self):
+        while True:
+            peers = self._collect_due()
+            if not peers:
+                continue
+            try:
+                failed = self.send_batch(peers) or []
+            except Exception as e:
+                print(f"⚠️ Ошибка обновления статуса набора текста: {e}")
+                traceback.print_exc()
+                failed = []
+
+            if failed:
+                # Как и раньше: при ошибке перестаём обновлять статус этого собеседника
+                with self._cond:
+                    for peer_id in failed:
+                        self._due.pop(peer_id, None)
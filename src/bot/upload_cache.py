@@ -0,0 +1,64 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# Область видимости для вложений, доступных всему сообществу
+SHARED_SCOPE = "shared"
+
+
+def content_digest(data):
+    """Хеш содержимого файла (ключ кэша)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class UploadCache:
+    """
+    Кэш загруженных в VK вложений: (тип, хеш содержимого, область) -> 'photo{owner}_{id}'.
+    Одинаковые PNG/PDF не загружаются повторно. Записи живут ttl секунд,
+    при превышении max_entries вытесняются самые давно использованные.
+    """
+    def __init__(self, max_entries=500, ttl=24 * 3600):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # ключ -> (attachment, срок годности)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, digest, scope):
+        key = (kind, digest, scope)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, kind, digest, scope, attachment):
+        if not attachment:
+            return
+        key = (kind, digest, scope)
+        with self._lock:
+            self._entries[key] = (attachment, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, attachment):
+        """Забывает вложение, с которым VK не принял сообщение (удалено или недоступно)"""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry[0] == attachment]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def get_stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,126 @@
+import json
+
+# Ограничения execute: не больше 25 обращений к API за один вызов,
+# длину кода держим с запасом
+MAX_CALLS_PER_EXECUTE = 25
+MAX_CODE_LENGTH = 60000
+
+
+class BatchResult:
+    """Результат одного вызова внутри пакета"""
+    __slots__ = ('method', 'values', 'ready', 'result', 'error')
+
+    def __init__(self, method, values):
+        self.method = method
+        self.values = values
+        self.ready = False
+        self.result = None
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.ready and self.error is None
+
+    def error_text(self):
+        if not self.error:
+            return ""
+        return f"{self.method}: [{self.error.get('error_code')}] {self.error.get('error_msg')}"
+
+
+def build_execute_code(calls):
+    """VKScript для execute: return [API.m1({...}), API.m2({...}), ...];"""
+    return 'return [{}];'.format(','.join(
+        'API.{}({})'.format(call.method, json.dumps(call.values, ensure_ascii=False, separators=(',', ':')))
+        for call in calls
+    ))
+
+
+def split_into_chunks(calls):
+    """Делит вызовы на пачки для execute (по количеству и длине кода)"""
+    chunk, length = [], 0
+    for call in calls:
+        call_length = len(build_execute_code([call]))
+        if chunk and (len(chunk) >= MAX_CALLS_PER_EXECUTE or length + call_length > MAX_CODE_LENGTH):
+            yield chunk
+            chunk, length = [], 0
+        chunk.append(call)
+        length += call_length
+    if chunk:
+        yield chunk
+
+
+def apply_execute_response(calls, response):
+    """
+    Раскладывает ответ execute по вызовам.
+    Неудачный вызов возвращает false, а его ошибка идёт в execute_errors по порядку.
+    """
+    results = response.get('response') or []
+    errors = iter(response.get('execute_errors') or [])
+
+    for i, call in enumerate(calls):
+        result = results[i] if i < len(results) else False
+        if result is False:
+            call.error = next(errors, {'error_code': None, 'error_msg': 'нет ответа в execute'})
+        else:
+            call.result = result
+        call.ready = True
+
+
+def error_from_exception(e):
+    """Ошибка VK API (vk_api.ApiError хранит её в .error) -> dict"""
+    error = getattr(e, 'error', None)
+    if isinstance(error, dict):
+        return error
+    return {'error_code': getattr(e, 'code', None), 'error_msg': str(e)}
+
+
+class VkBatch:
+    """
+    Копит вызовы VK API и отправляет их через execute - до 25 вызовов
+    за один HTTP-запрос. Каждый вызов получает свой BatchResult.
+
+        batch = VkBatch(vk_session)
+        r = batch.method('messages.send', {...})
+        batch.execute()
+        if not r.ok: ...
+    """
+    def __init__(self, vk_session):
+        self.vk_session = vk_session
+        self._calls = []
+
+    def __len__(self):
+        return len(self._calls)
+
+    def method(self, method, values=None):
+        call = BatchResult(method, dict(values or {}))
+        self._calls.append(call)
+        return call
+
+    def execute(self):
+        """Выполняет накопленные вызовы. Возвращает список неудачных"""
+        calls, self._calls = self._calls, []
+
+        for chunk in split_into_chunks(calls):
+            if len(chunk) == 1:
+                # Один вызов - execute не нужен
+                call = chunk[0]
+                try:
+                    call.result = self.vk_session.method(call.method, call.values)
+                except Exception as e:
+                    call.error = error_from_exception(e)
+                call.ready = True
+                continue
+
+            try:
+                response = self.vk_session.method('execute', {'code': build_execute_code(chunk)}, raw=True)
+                apply_execute_response(chunk, response)
+            except Exception as e:
+                # Упал весь execute - ошибка у всех вызовов пачки
+                for call in chunk:
+                    call.error = error_from_exception(e)
+                    call.ready = True
+
+        failed = [call for call in calls if not call.ok]
+        for call in failed:
+            print(f"⚠️ Ошибка вызова в пакете {call.error_text()}")
+        return failed
@@ -1,81 +1,128 @@
 import vk_api
 from vk_api.bot_longpoll import VkBotLongPoll
-from threading import Thread, Event
-import requests
-import os
-import tempfile
-import time
+import io
 
 import config
+from src.bot.vk_batch import VkBatch
+from src.services import http_pool
+from src.bot.typing_scheduler import TypingScheduler
+from src.bot.streaming import StreamingMessage
+from src.bot.upload_cache import UploadCache, SHARED_SCOPE, content_digest
+from src.bot.rate_limiter import PriorityRateLimiter, PRIORITY_TYPING, priority as rate_priority
 from src.utils.text_helpers import split_message, format_math_response
 from src.utils.pdf_generator import create_pdf_with_formulas, REPORTLAB_AVAILABLE
 from src.utils.image_generator import create_full_answer_image
 
+# --- Ограничение частоты запросов к VK API ---
+rate_limiter = PriorityRateLimiter(
+    rate=config.VK_RATE_LIMIT,
+    burst=config.VK_RATE_BURST,
+    # Индикатор набора не стоит задерживать надолго - проще пропустить обновление
+    max_wait={PRIORITY_TYPING: config.VK_TYPING_MAX_WAIT},
+)
+
+class RateLimitedVkApi(vk_api.VkApi):
+    """VkApi, который перед каждым запросом берёт токен у rate_limiter"""
+    def method(self, method, values=None, *args, **kwargs):
+        rate_limiter.acquire()
+        return super().method(method, values, *args, **kwargs)
+
 # --- Инициализация VK ---
 # объекты будут использоваться всеми функциями тут
 try:
-    vk_session = vk_api.VkApi(token=config.VK_TOKEN)
+    vk_session = RateLimitedVkApi(token=config.VK_TOKEN, session=http_pool.vk_http)
     vk = vk_session.get_api()
-    longpoll = VkBotLongPoll(vk_session, config.GROUP_ID)
 except Exception as e:
     print(f"❌ КРИТИЧЕСКАЯ ОШИБКА: Не удалось подключиться к VK API. {e}")
     exit()
 
+# Кэш загруженных вложений (одинаковые PNG/PDF не загружаются повторно)
+upload_cache = UploadCache(
+    max_entries=config.UPLOAD_CACHE_SIZE,
+    ttl=config.UPLOAD_CACHE_TTL,
+)
+
+# LongPoll создаётся лениво: он нужен только процессу, читающему события
+longpoll = None
+
+# ИНДИКАТОР 'Бот печатает...': один поток-планировщик на всех собеседников
+def _send_typing_batch(peer_ids):
+    """Обновляет статус набора для нескольких собеседников одним execute"""
+    batch = VkBatch(vk_session)
+    results = {
+        peer_id: batch.method("messages.setActivity", {"peer_id": peer_id, "type": "typing"})
+        for peer_id in peer_ids
+    }
+    with rate_priority(PRIORITY_TYPING):
+        batch.execute()
+    # Отброшенное лимитером обновление - не ошибка, попробуем в следующий раз
+    return [
+        peer_id for peer_id, result in results.items()
+        if not result.ok and result.error.get("error_code") != "rate_limited"
+    ]
+
+typing_scheduler = TypingScheduler(_send_typing_batch, interval=7)
+
 # КЛАСС: КОНТРОЛЛЕР СТАТУСА НАБОРА ТЕКСТА (TypingStatusController)
 class TypingStatusController:
-    """Управляет цикличным обновлением статуса 'Бот печатает...'"""
+    """Управляет статусом 'Бот печатает...' (обновление - в общем TypingScheduler)"""
     def __init__(self, peer_id: int):
         self.peer_id = peer_id
-        self._stop_event = Event()
-        self._thread = None
-        
-    def _run_typing_loop(self):
-        """Функция, которая будет выполняться в отдельном потоке"""
-        
-        # Обновляем статус каждые 7 сек (10 сек таймаут ВК)
-        while not self._stop_event.is_set():
-            try:
-                # ВАЖНО: используем глобальный объект vk
-                vk.messages.setActivity(
-                    peer_id=self.peer_id,
-                    type='typing' 
-                )
-                # Ждем 7 секунд. Если за это время _stop_event сработает, цикл прервется.
-                self._stop_event.wait(timeout=7) 
-                
-            except Exception as e:
-                # Если сбой при обновлении статуса, выходим из цикла
-                print(f"⚠️ Ошибка обновления статуса набора текста для {self.peer_id}: {e}")
-                break
+        self._handle = None
 
     def start(self):
-        """Запускает поток обновления статуса"""
-        if self._thread is None or not self._thread.is_alive():
-            self._stop_event.clear()
-            self._thread = Thread(target=self._run_typing_loop)
-            self._thread.start()
+        """Регистрирует собеседника в планировщике"""
+        if self._handle is None:
+            self._handle = typing_scheduler.start(self.peer_id)
             print(f"▶️ Запущен контроллер набора текста для {self.peer_id}")
 
     def stop(self):
-        """Останавливает поток обновления статуса"""
-        if self._thread and self._thread.is_alive():
-            self._stop_event.set()
-            self._thread.join(timeout=8) # Ждем немного, чтобы поток завершился
+        """Снимает собеседника с планировщика"""
+        if self._handle is not None:
+            typing_scheduler.stop(self._handle)
+            self._handle = None
             print(f"⏹️ Остановлен контроллер набора текста для {self.peer_id}")
 
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ VK
 
 def get_longpoll_listener():
     """Возвращает longpoll listener"""
+    global longpoll
+    if longpoll is None:
+        try:
+            longpoll = VkBotLongPoll(vk_session, config.GROUP_ID)
+        except Exception as e:
+            print(f"❌ КРИТИЧЕСКАЯ ОШИБКА: Не удалось подключиться к VK LongPoll. {e}")
+            exit()
     return longpoll
 
-def upload_photo_to_vk(photo_path, user_id):
-    """Загрузка фото"""
+def render_to_bytes(render, text):
+    """Рендерит ответ (create_full_answer_image / create_pdf_with_formulas) в память"""
+    buffer = io.BytesIO()
+    if not render(text, buffer):
+        return None
+    return buffer.getvalue()
+
+def _photo_scope(user_id):
+    """Фото сообщества можно переиспользовать во всех диалогах, остальное - в пределах диалога"""
+    return SHARED_SCOPE if config.UPLOAD_CACHE_SHARE_PHOTOS else user_id
+
+def upload_photo_to_vk(data, user_id, filename="answer.png"):
+    """Загрузка фото из памяти (повторная загрузка тех же байтов берётся из upload_cache)"""
     try:
+        digest = content_digest(data)
+        scope = _photo_scope(user_id)
+        
+        cached = upload_cache.get("photo", digest, scope)
+        if cached:
+            print(f"♻️ Фото уже загружено: {cached}")
+            return cached
+        
         upload_url = vk.photos.getMessagesUploadServer(peer_id=user_id)['upload_url']
         
-        with open(photo_path, 'rb') as f:
-            response = requests.post(upload_url, files={'photo': f}).json()
+        response = http_pool.session.post(
+            upload_url, files={'photo': (filename, io.BytesIO(data), 'image/png')}
+        ).json()
         
         photo = vk.photos.saveMessagesPhoto(
             photo=response['photo'],
@@ -83,14 +130,24 @@ def upload_photo_to_vk(photo_path, user_id):
             hash=response['hash']
         )[0]
         
-        return f"photo{photo['owner_id']}_{photo['id']}"
+        attachment = f"photo{photo['owner_id']}_{photo['id']}"
+        upload_cache.put("photo", digest, scope, attachment)
+        return attachment
     except Exception as e:
         print(f"❌ Ошибка загрузки фото: {e}")
         return None
 
-def upload_doc_to_vk(doc_path, user_id, title="document.pdf"):
-    """Загрузка документа"""
+def upload_doc_to_vk(data, user_id, title="document.pdf", filename="document.pdf"):
+    """Загрузка документа из памяти (повторная загрузка тех же байтов берётся из upload_cache)"""
     try:
+        digest = content_digest(data)
+        kind = f"doc:{title}"
+        
+        cached = upload_cache.get(kind, digest, user_id)
+        if cached:
+            print(f"♻️ Документ уже загружен: {cached}")
+            return cached
+        
         print(f"📤 Загрузка: {title}")
         
         upload_data = vk.docs.getMessagesUploadServer(type='doc', peer_id=user_id)
@@ -99,8 +156,7 @@ def upload_doc_to_vk(doc_path, user_id, title="document.pdf"):
         
         upload_url = upload_data['upload_url']
         
-        with open(doc_path, 'rb') as f:
-            response = requests.post(upload_url, files={'file': f})
+        response = http_pool.session.post(upload_url, files={'file': (filename, io.BytesIO(data), 'application/pdf')})
         
         if response.status_code != 200:
             print(f"❌ Статус: {response.status_code}")
@@ -120,18 +176,26 @@ def upload_doc_to_vk(doc_path, user_id, title="document.pdf"):
             return None
         
         if doc and 'owner_id' in doc and 'id' in doc:
-            return f"doc{doc['owner_id']}_{doc['id']}"
+            attachment = f"doc{doc['owner_id']}_{doc['id']}"
+            upload_cache.put(kind, digest, user_id, attachment)
+            return attachment
         
         return None
     except Exception as e:
         print(f"❌ Ошибка загрузки doc: {e}")
         return None
 
-def send_message(user_id, text, attachment=None, mode="math"):
+def send_message(user_id, text, attachment=None, mode="math", batch=None):
     """
     Отправка (с форматированием LaTeX -> Unicode).
     mode влияет на то, будет ли текст очищаться от LaTeX.
+    Все части уходят одним пакетом через execute. Если передан batch (VkBatch),
+    сообщения только добавляются в него - отправит вызывающий (execute_sends).
     """
+    own_batch = batch is None
+    if own_batch:
+        batch = VkBatch(vk_session)
+    
     try:
         # В режиме 'math' чистим LaTeX, в 'code' и 'raw' - нет
         if mode == "math":
@@ -145,17 +209,69 @@ def send_message(user_id, text, attachment=None, mode="math"):
             if len(parts) > 1:
                 part = f"[Часть {i+1}/{len(parts)}]\n\n" + part
             
+            values = {"user_id": user_id, "message": part, "random_id": 0}
             # Вложение отправляем только с первой частью
-            att = attachment if i == 0 else None
-            vk.messages.send(user_id=user_id, message=part, attachment=att, random_id=0)
+            if attachment and i == 0:
+                values["attachment"] = attachment
+            batch.method("messages.send", values)
             
     except Exception as e:
-        print(f"⚠️ Ошибка отправки: {e}")
-        try:
-            # Попытка №2: отправить ошибку без форматирования
-            vk.messages.send(user_id=user_id, message=f"Ошибка отправки. {text[:1000]}", random_id=0)
-        except:
-            pass # Критическая 
+        print(f"⚠️ Ошибка подготовки сообщения: {e}")
+        send_fallback(user_id, text)
+        return
+    
+    if own_batch:
+        execute_sends(batch, user_id, text)
+
+def execute_sends(batch, user_id, fallback_text):
+    """Выполняет пакет отправок; если что-то не ушло - отправляет текст без форматирования"""
+    failed = batch.execute()
+    if failed:
+        print(f"⚠️ Ошибка отправки: не доставлено частей {len(failed)}")
+        forget_rejected_attachments(failed)
+        send_fallback(user_id, fallback_text)
+
+def forget_rejected_attachments(failed):
+    """Вложение из кэша могли удалить в VK - не предлагаем его снова до конца TTL"""
+    for batch_call in failed:
+        attachment = batch_call.values.get("attachment")
+        if attachment and batch_call.error.get("error_code") != "rate_limited":
+            if upload_cache.invalidate(attachment):
+                print(f"♻️ Вложение {attachment} убрано из кэша загрузок")
+
+def send_fallback(user_id, text):
+    """Попытка №2: отправить ошибку без форматирования"""
+    try:
+        vk.messages.send(user_id=user_id, message=f"Ошибка отправки. {text[:1000]}", random_id=0)
+    except:
+        pass # Критическая 
+
+def send_message_get_id(user_id, text):
+    """Отправляет одно сообщение (без разбиения) и возвращает его id"""
+    try:
+        return vk.messages.send(user_id=user_id, message=text, random_id=0)
+    except Exception as e:
+        print(f"⚠️ Ошибка отправки сообщения: {e}")
+        return None
+
+def edit_message(user_id, message_id, text):
+    """Редактирует отправленное сообщение"""
+    try:
+        vk.messages.edit(peer_id=user_id, message_id=message_id, message=text)
+        return True
+    except Exception as e:
+        print(f"⚠️ Ошибка редактирования сообщения {message_id}: {e}")
+        return False
+
+def open_stream(user_id, mode="math"):
+    """Сообщение, которое дописывается по мере генерации ответа (см. StreamingMessage)"""
+    return StreamingMessage(
+        send=lambda text: send_message_get_id(user_id, text),
+        edit=lambda message_id, text: edit_message(user_id, message_id, text),
+        interval=config.STREAM_EDIT_INTERVAL,
+        # В режиме 'math' чистим LaTeX, как и send_message
+        formatter=format_math_response if mode == "math" else None,
+    )
 
 def send_as_format(user_id, text, format_type="text", mode="math"):
     """
@@ -170,60 +286,43 @@ def send_as_format(user_id, text, format_type="text", mode="math"):
     
     # /math (по умолчанию) использует format_type
     if format_type == "image":
-        tmp_file = None
-        try:
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-                tmp_file = tmp.name
-            
-            print("🎨 Создание изображения с полным ответом...")
-            
-            if create_full_answer_image(text, tmp_file):
-                attachment = upload_photo_to_vk(tmp_file, user_id)
-                if attachment:
-                    # Уведомление отправляем как 'raw', чтобы не парсить LaTeX
-                    send_message(user_id, "📐 Полное решение с формулами:", attachment, mode="raw")
-                    # А сам текст (для копирования) - как 'math' (он очистит LaTeX)
-                    send_message(user_id, text, mode="math")
-                else:
-                    send_message(user_id, text, mode="math")
+        print("🎨 Создание изображения с полным ответом...")
+        
+        data = render_to_bytes(create_full_answer_image, text)
+        if data:
+            attachment = upload_photo_to_vk(data, user_id)
+            if attachment:
+                # Уведомление и текст уходят одним execute
+                batch = VkBatch(vk_session)
+                # Уведомление отправляем как 'raw', чтобы не парсить LaTeX
+                send_message(user_id, "📐 Полное решение с формулами:", attachment, mode="raw", batch=batch)
+                # А сам текст (для копирования) - как 'math' (он очистит LaTeX)
+                send_message(user_id, text, mode="math", batch=batch)
+                execute_sends(batch, user_id, text)
             else:
-                send_message(user_id, text + "\n\n⚠️ Не удалось создать изображение", mode="math")
-        finally:
-            if tmp_file and os.path.exists(tmp_file):
-                try:
-                    time.sleep(0.5)
-                    os.unlink(tmp_file)
-                except:
-                    pass
+                send_message(user_id, text, mode="math")
+        else:
+            send_message(user_id, text + "\n\n⚠️ Не удалось создать изображение", mode="math")
     
     elif format_type == "pdf":
         if not REPORTLAB_AVAILABLE:
             send_message(user_id, text + "\n\n⚠️ Модуль PDF (reportlab) не установлен на сервере.", mode="math")
             return
         
-        tmp_file = None
-        try:
-            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
-                tmp_file = tmp.name
-            
-            print("📄 Создание PDF...")
-            
-            if create_pdf_with_formulas(text, tmp_file):
-                attachment = upload_doc_to_vk(tmp_file, user_id, "Решение.pdf")
-                if attachment:
-                    send_message(user_id, "📄 PDF с решением", attachment, mode="raw")
-                    send_message(user_id, text, mode="math")
-                else:
-                    send_message(user_id, "⚠️ Не удалось загрузить PDF\n\n" + text, mode="math")
+        print("📄 Создание PDF...")
+        
+        data = render_to_bytes(create_pdf_with_formulas, text)
+        if data:
+            attachment = upload_doc_to_vk(data, user_id, "Решение.pdf")
+            if attachment:
+                batch = VkBatch(vk_session)
+                send_message(user_id, "📄 PDF с решением", attachment, mode="raw", batch=batch)
+                send_message(user_id, text, mode="math", batch=batch)
+                execute_sends(batch, user_id, text)
             else:
-                send_message(user_id, text + "\n\n⚠️ Не удалось создать PDF", mode="math")
-        finally:
-            if tmp_file and os.path.exists(tmp_file):
-                try:
-                    time.sleep(0.5)
-                    os.unlink(tmp_file)
-                except:
-                    pass
+                send_message(user_id, "⚠️ Не удалось загрузить PDF\n\n" + text, mode="math")
+        else:
+            send_message(user_id, text + "\n\n⚠️ Не удалось создать PDF", mode="math")
     
     else:
         # Просто текст
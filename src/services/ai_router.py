@@ -0,0 +1,260 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import config
+from src.services import qwen_client, openrouter_client, prompt_builder
+from src.services.usage_tracker import usage_tracker
+from src.utils.text_helpers import is_error_response
+
+# Запросы к моделям идут в отдельных потоках, чтобы основной мог ждать первый ответ.
+# Основные запросы: по одному на обработчик и столько же в запас на брошенные
+_executor = ThreadPoolExecutor(
+    max_workers=max(2, config.WORKER_POOL_SIZE * 2),
+    thread_name_prefix="ai-router"
+)
+# Резервные запросы - в своём пуле и не больше AI_HEDGE_WORKERS одновременно:
+# проигравший запрос не прерывается и держит поток до таймаута своего клиента
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=max(1, config.AI_HEDGE_WORKERS),
+    thread_name_prefix="ai-hedge"
+)
+_hedge_slots = threading.BoundedSemaphore(max(1, config.AI_HEDGE_WORKERS))
+
+# Основные запросы, которые продолжают работать после ответа (резервной модели или по таймауту)
+_orphans = set()
+_orphans_lock = threading.Lock()
+
+TIMEOUT_TEXT = "⏰ Превышено время ожидания ответа от моделей. Попробуйте снова."
+
+
+def call_model(model, prompt, chat_id=None, parent_id=None, image_urls=None, on_delta=None, on_usage=None,
+               history=None, system_prompt=None):
+    """
+    Один запрос к модели -> (ответ, chat_id, parent_id).
+    on_usage(model, prompt_tokens, completion_tokens, cached_tokens) - учёт токенов.
+    history - прошлые реплики диалога для OpenRouter (у Qwen контекст в chat_id;
+    если чата нет, история добавляется к запросу текстом).
+    system_prompt - инструкции режима (OpenRouter получает их system-сообщением).
+    """
+    report = None
+    if on_usage is not None:
+        def report(*counts):
+            on_usage(model, *counts)
+
+    if model == "qwen":
+        prompt = prompt_builder.join_prompt(system_prompt, prompt_builder.join_history(history, prompt))
+        if image_urls:
+            return qwen_client.get_qwen_response_with_image(
+                prompt, image_urls, chat_id, parent_id, on_delta=on_delta, on_usage=report
+            )
+        return qwen_client.get_qwen_response_text_only(
+            prompt, chat_id, parent_id, on_delta=on_delta, on_usage=report
+        )
+    # OpenRouter (Kimi, Deepseek) - контекст передаётся историей сообщений
+    return openrouter_client.get_openrouter_response(
+        model, prompt, history, on_delta=on_delta, on_usage=report, system_prompt=system_prompt
+    ), None, None
+
+
+def is_good(result):
+    return bool(result and result[0]) and not is_error_response(result[0])
+
+
+def _forget(future):
+    with _orphans_lock:
+        _orphans.discard(future)
+
+
+def _abandon(future):
+    """Бросает основной запрос; если он уже выполняется - учитываем занятый им поток"""
+    if future.cancel():
+        return
+    with _orphans_lock:
+        _orphans.add(future)
+    future.add_done_callback(_forget)
+
+
+def _acquire_hedge():
+    """
+    Можно ли запустить резервный запрос: есть свободное место в пуле резервных
+    и брошенные основные запросы не заняли запас _executor (иначе новые основные
+    запросы встанут в очередь за ними).
+    """
+    with _orphans_lock:
+        if len(_orphans) >= config.WORKER_POOL_SIZE:
+            return False
+    return _hedge_slots.acquire(blocking=False)
+
+
+def _release_hedge(future):
+    _hedge_slots.release()
+
+
+class _UsageSplit:
+    """
+    Учёт токенов при резервном запросе: пользователь платит только за модель,
+    чей ответ получил; остальные запросы - расход бота (usage_tracker.record_system).
+    До выбора ответа отчёты копятся.
+    """
+    def __init__(self, on_usage):
+        self.on_usage = on_usage
+        self.winner = None
+        self._settled = False
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def report(self, model, prompt_tokens, completion_tokens, cached_tokens=0):
+        counts = (prompt_tokens, completion_tokens, cached_tokens)
+        with self._lock:
+            if not self._settled:
+                self._pending.append((model, counts))
+                return
+        self._forward(model, counts)
+
+    def settle(self, winner):
+        """winner - модель, чей ответ ушёл пользователю (None - никакой)"""
+        with self._lock:
+            self.winner = winner
+            self._settled = True
+            pending, self._pending = self._pending, []
+        for model, counts in pending:
+            self._forward(model, counts)
+
+    def _forward(self, model, counts):
+        if model == self.winner:
+            if self.on_usage is not None:
+                self.on_usage(model, *counts)
+        else:
+            usage_tracker.record_system(model, counts[0], counts[1])
+
+
+class _StreamOwner:
+    """Пропускает в on_delta куски только той модели, что начала отвечать первой"""
+    def __init__(self, on_delta):
+        self.on_delta = on_delta
+        self.owner = None
+        self._lock = threading.Lock()
+
+    def claim(self, model):
+        """Закрепляет поток за моделью (куски опоздавших больше не пройдут)"""
+        with self._lock:
+            if self.owner is None:
+                self.owner = model
+
+    def for_model(self, model):
+        if self.on_delta is None:
+            return None
+
+        def on_delta(delta):
+            with self._lock:
+                if self.owner is None:
+                    self.owner = model
+                if self.owner != model:
+                    return
+            self.on_delta(delta)
+        return on_delta
+
+
+def get_response(model, prompt, chat_id=None, parent_id=None, image_urls=None, on_delta=None, on_usage=None,
+                 history=None, system_prompt=None):
+    """
+    Запрос к модели с резервом. Возвращает (ответ, chat_id, parent_id, модель).
+    prompt - запрос пользователя, system_prompt - инструкции режима (см. prompt_builder).
+
+    Для запросов только с текстом и без контекста диалога (chat_id, history):
+      - если основная модель не ответила за AI_HEDGE_DELAY сек, параллельно
+        запускается резервная (FALLBACK_MODELS), берётся первый нормальный ответ;
+      - если основная вернула ошибку, запрос сразу уходит резервной;
+      - общий бюджет ожидания - AI_LATENCY_BUDGET сек.
+    Опоздавший запрос не прерывается, его ответ просто игнорируется.
+    Резервных запросов одновременно не больше AI_HEDGE_WORKERS; если мест нет,
+    ждём только основную модель.
+    """
+    fallback = config.FALLBACK_MODELS.get(model)
+    can_hedge = (
+        config.AI_ROUTER_ENABLED and fallback and fallback != model
+        and not image_urls and not chat_id and not history
+    )
+    if not can_hedge:
+        return call_model(
+            model, prompt, chat_id, parent_id, image_urls, on_delta, on_usage, history, system_prompt
+        ) + (model,)
+
+    started = time.monotonic()
+    deadline = started + config.AI_LATENCY_BUDGET
+    stream = _StreamOwner(on_delta)
+    usage = _UsageSplit(on_usage)
+
+    futures = {
+        _executor.submit(
+            call_model, model, prompt, on_delta=stream.for_model(model), on_usage=usage.report,
+            system_prompt=system_prompt
+        ): model
+    }
+    hedged = False
+    last_result, last_model = None, model
+
+    while futures:
+        if stream.owner is not None:
+            # Текст уже идёт пользователю - ждём эту модель без таймеров (у клиента свой таймаут)
+            timeout = None
+        else:
+            timeout = deadline - time.monotonic()
+            if not hedged:
+                timeout = min(timeout, started + config.AI_HEDGE_DELAY - time.monotonic())
+            timeout = max(timeout, 0)
+        done, _ = wait(list(futures), timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            answered_by = futures.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"❌ {answered_by}: ошибка запроса: {e}")
+                result = (f"❌ Ошибка модели {answered_by}: {e}", None, None)
+
+            # Ответ модели, чей текст уже показан пользователю, берём в любом случае
+            if is_good(result) or stream.owner == answered_by:
+                stream.claim(answered_by)
+                if answered_by != model:
+                    print(f"🔀 Ответ получен от резервной модели {answered_by} "
+                          f"за {time.monotonic() - started:.1f} сек")
+                for pending, pending_model in futures.items():
+                    if pending_model == model:
+                        _abandon(pending)
+                usage.settle(answered_by)
+                return result + (answered_by,)
+            last_result, last_model = result, answered_by
+            print(f"⚠️ {answered_by} вернула ошибку: {(result[0] or '')[:100]}")
+
+        now = time.monotonic()
+        if not hedged and (now >= started + config.AI_HEDGE_DELAY or not futures):
+            hedged = True
+            if stream.owner is None:
+                # Основная медлит или уже ошиблась - подключаем резервную
+                reason = "ошибка" if not futures else f"нет ответа {config.AI_HEDGE_DELAY:.0f} сек"
+                if _acquire_hedge():
+                    print(f"🔀 {model}: {reason}, запрос уходит и в {fallback}")
+                    future = _hedge_executor.submit(
+                        call_model, fallback, prompt, on_delta=stream.for_model(fallback), on_usage=usage.report,
+                        system_prompt=system_prompt
+                    )
+                    future.add_done_callback(_release_hedge)
+                    futures[future] = fallback
+                    continue
+                print(f"⚠️ {model}: {reason}, но резервные запросы заняты - {fallback} не подключаем")
+
+        if futures and now >= deadline and stream.owner is None:
+            print(f"⏰ Бюджет ожидания {config.AI_LATENCY_BUDGET:.0f} сек исчерпан")
+            stream.claim("timeout")
+            for future, pending_model in futures.items():
+                if pending_model == model:
+                    _abandon(future)
+                else:
+                    future.cancel()
+            usage.settle(None)
+            return TIMEOUT_TEXT, None, None, model
+
+    usage.settle(last_model)
+    return last_result + (last_model,)
@@ -0,0 +1,47 @@
+import aiohttp
+
+import config
+
+# хост -> [новых соединений, запросов] по всем aiohttp-сессиям бота
+_stats = {}
+
+
+async def _on_request_start(session, trace_ctx, params):
+    host = params.url.host
+    trace_ctx.host = host
+    _stats.setdefault(host, [0, 0])[1] += 1
+
+
+async def _on_connection_create_end(session, trace_ctx, params):
+    _stats.setdefault(getattr(trace_ctx, "host", "?"), [0, 0])[0] += 1
+
+
+def create_session():
+    """
+    aiohttp-сессия с пулом соединений (создаётся внутри event loop).
+    Запросы и новые соединения считаются через TraceConfig - как в http_pool.
+    """
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(_on_request_start)
+    trace.on_connection_create_end.append(_on_connection_create_end)
+    connector = aiohttp.TCPConnector(limit=config.ASYNC_HTTP_POOL_SIZE)
+    return aiohttp.ClientSession(connector=connector, trace_configs=[trace])
+
+
+def get_pool_stats():
+    """Статистика пулов: хост -> (новых соединений, запросов, переиспользовано)"""
+    return {
+        host: (connections, requests_made, max(requests_made - connections, 0))
+        for host, (connections, requests_made) in list(_stats.items())
+    }
+
+
+def format_pool_stats():
+    stats = get_pool_stats()
+    if not stats:
+        return "🔗 HTTP (aiohttp): запросов ещё не было"
+    parts = [
+        f"{host}: {requests_made} запр., соединений {connections}, переисп. {reused}"
+        for host, (connections, requests_made, reused) in sorted(stats.items())
+    ]
+    return "🔗 HTTP пулы (aiohttp) | " + " | ".join(parts)
@@ -0,0 +1,50 @@
+from openai import AsyncOpenAI, APITimeoutError, APIConnectionError
+import traceback
+import config
+from src.services.openrouter_client import build_completion_kwargs, report_usage
+
+# AsyncOpenAI держит собственный пул соединений (httpx)
+try:
+    openrouter_client = AsyncOpenAI(
+        base_url="https://openrouter.ai/api/v1",
+        api_key=config.OPENROUTER_API_KEY,
+    )
+except Exception as e:
+    print(f"❌ Не удалось инициализировать OpenRouter (async): {e}")
+    openrouter_client = None
+
+
+async def close():
+    """Закрывает пул соединений при остановке бота"""
+    if openrouter_client:
+        await openrouter_client.close()
+
+
+async def get_openrouter_response(model_name, user_prompt, history=None, on_usage=None, system_prompt=None):
+    """
+    OpenRouter (async; history - прошлые реплики; on_usage(prompt, completion, cached) - учёт токенов;
+    system_prompt - инструкции режима)
+    """
+    if not openrouter_client:
+        return "❌ Клиент OpenRouter не инициализирован."
+
+    model_id = config.MODELS.get(model_name)
+    if not model_id or model_id == "proxy":
+        return f"❌ Ошибка: модель {model_name} не настроена для OpenRouter."
+
+    print(f"⏳ Запрос к OpenRouter ({model_id})...")
+
+    try:
+        completion = await openrouter_client.chat.completions.create(
+            **build_completion_kwargs(model_id, user_prompt, history, system_prompt)
+        )
+        report_usage(on_usage, completion.usage)
+        return completion.choices[0].message.content
+    except APITimeoutError:
+        return f"⏰ {model_name}: Таймаут"
+    except APIConnectionError:
+        return f"🔌 {model_name}: Ошибка подключения к OpenRouter"
+    except Exception as e:
+        print(f"❌ КРИТИЧЕСКАЯ ОШИБКА OpenRouter: {e}")
+        traceback.print_exc()
+        return "❌ Произошла внутренняя ошибка. Попробуйте снова."
@@ -0,0 +1,158 @@
+import asyncio
+import traceback
+import aiohttp
+import config
+from src.services import async_http_pool
+from src.services.qwen_client import (
+    as_image_list,
+    is_inline_image,
+    check_image_headers,
+    build_image_payload,
+    build_text_payload,
+    parse_image_response,
+    parse_text_response,
+    qwen_breaker,
+    report_usage,
+    BREAKER_OPEN_TEXT,
+)
+from src.services.circuit_breaker import CircuitOpenError
+
+# Общая сессия с пулом соединений (создаётся внутри event loop)
+_session = None
+
+
+def get_session():
+    """Возвращает общую aiohttp-сессию к прокси Qwen"""
+    global _session
+    if _session is None or _session.closed:
+        _session = async_http_pool.create_session()
+    return _session
+
+
+async def close():
+    """Закрывает сессию при остановке бота"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def validate_image_url(url):
+    """Асинхронная версия qwen_client.validate_image_url"""
+    try:
+        if not url or not url.startswith('http'):
+            return False, "Некорректный URL изображения"
+
+        async with get_session().head(
+            url, timeout=aiohttp.ClientTimeout(total=5), allow_redirects=True
+        ) as response:
+            return check_image_headers(response.headers)
+
+    except asyncio.TimeoutError:
+        return False, "Превышено время ожидания при загрузке изображения"
+    except Exception as e:
+        print(f"⚠️ Ошибка проверки изображения: {e}")
+        return False, f"Не удалось проверить изображение: {str(e)}"
+
+
+async def _post_chat(payload, timeout):
+    """Запрос к прокси через общий с sync-клиентом автомат защиты (qwen_breaker)"""
+    if not qwen_breaker.allow():
+        raise CircuitOpenError(qwen_breaker)
+    error = None
+    finished = False
+    try:
+        async with get_session().post(
+            f"{config.QWEN_PROXY_URL}/api/chat",
+            json=payload,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+        finished = True
+        return data
+    except aiohttp.ClientResponseError as e:
+        if e.status >= 500:
+            error = e
+        finished = True
+        raise
+    except Exception as e:
+        error = e
+        finished = True
+        raise
+    finally:
+        # Отмена (CancelledError, проигравший хеджированный запрос) - не ошибка прокси,
+        # но пробный запрос half-open нужно отпустить
+        if not finished:
+            qwen_breaker.release()
+        elif error is not None:
+            qwen_breaker.record_failure(error)
+        else:
+            qwen_breaker.record_success()
+
+
+async def get_qwen_response_with_image(user_prompt, image_url, chat_id=None, parent_id=None, on_usage=None):
+    """Qwen с изображением (async, image_url - URL или список URL; on_usage - учёт токенов)"""
+    try:
+        image_urls = as_image_list(image_url)
+        checks = await asyncio.gather(*(
+            validate_image_url(url) for url in image_urls if not is_inline_image(url)
+        ))
+        for is_valid, error_msg in checks:
+            if not is_valid:
+                print(f"❌ Валидация изображения провалилась: {error_msg}")
+                return f"⚠️ Проблема с изображением: {error_msg}", None, None
+
+        payload = build_image_payload(user_prompt, image_urls, chat_id, parent_id)
+
+        print(f"⏳ Запрос с изображением... ({config.QWEN_PROXY_URL})")
+        for url in image_urls:
+            print(f"📎 URL: {url[:80]}...")
+
+        data = await _post_chat(payload, timeout=360)
+        report_usage(on_usage, data)
+        return parse_image_response(data)
+
+    except CircuitOpenError:
+        print("🔌 Прокси Qwen недоступен, запрос отклонён")
+        return BREAKER_OPEN_TEXT, None, None
+    except asyncio.TimeoutError:
+        print("⏰ Превышено время ожидания")
+        return "⏰ Превышено время ожидания ответа от API. Попробуйте снова.", None, None
+    except aiohttp.ClientResponseError as e:
+        print(f"❌ HTTP ошибка: {e}")
+        return f"❌ Ошибка API (код {e.status}). Проверьте прокси-сервер.", None, None
+    except Exception as e:
+        print(f"❌ КРИТИЧЕСКАЯ ОШИБКА Qwen (Image): {e}")
+        traceback.print_exc()
+        return "❌ Произошла внутренняя ошибка. Попробуйте снова.", None, None
+
+
+async def get_qwen_response_text_only(user_prompt, chat_id=None, parent_id=None, on_usage=None):
+    """Qwen текст (async; on_usage - учёт токенов)"""
+    try:
+        if not user_prompt or user_prompt.strip() == "":
+            return "⚠️ Пустой запрос. Напишите что-нибудь!", None, None
+
+        payload = build_text_payload(user_prompt, chat_id, parent_id)
+
+        print(f"⏳ Запрос (текст)... ({config.QWEN_PROXY_URL})")
+        print(f"   💬 Текст: {user_prompt[:60]}...")
+
+        data = await _post_chat(payload, timeout=90)
+        report_usage(on_usage, data)
+        return parse_text_response(data)
+
+    except CircuitOpenError:
+        print("🔌 Прокси Qwen недоступен, запрос отклонён")
+        return BREAKER_OPEN_TEXT, None, None
+    except asyncio.TimeoutError:
+        print("⏰ Превышено время ожидания")
+        return "⏰ Таймаут. Попробуйте снова.", None, None
+    except aiohttp.ClientResponseError as e:
+        print(f"❌ HTTP ошибка: {e}")
+        return f"❌ Ошибка API (код {e.status}).", None, None
+    except Exception as e:
+        print(f"❌ КРИТИЧЕСКАЯ ОШИБКА Qwen (Text): {e}")
+        traceback.print_exc()
+        return "❌ Произошла внутренняя ошибка. Попробуйте снова.", None, None
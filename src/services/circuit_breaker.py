@@ -0,0 +1,183 @@
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"         # запросы идут как обычно
+OPEN = "open"             # сервис считается недоступным, запросы сразу отклоняются
+HALF_OPEN = "half_open"   # пропускаем один пробный запрос
+
+STATE_LABELS = {
+    CLOSED: "🟢 работает",
+    OPEN: "🔴 недоступен",
+    HALF_OPEN: "🟡 проверка",
+}
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: автомат разомкнут"""
+    def __init__(self, breaker):
+        super().__init__(f"{breaker.name}: сервис временно недоступен")
+        self.breaker = breaker
+
+
+class CircuitBreaker:
+    """
+    Автомат защиты для внешнего сервиса.
+
+    Считает исходы последних window запросов; если ошибок не меньше
+    failure_rate (и запросов было хотя бы min_calls), размыкается на
+    open_timeout секунд - запросы сразу отклоняются. Пока автомат не замкнут,
+    фоновый поток раз в probe_interval секунд вызывает probe(): успешная
+    проверка (или истёкший open_timeout) переводит его в half-open, где
+    пропускается один пробный запрос. Успех замыкает автомат, ошибка снова размыкает.
+    Пробный запрос без исхода (прерван, исход не записан) не держит half-open
+    дольше trial_timeout секунд (по умолчанию probe_interval): после этого
+    пропускается следующий, а успешная фоновая проверка сбрасывает зависшую пробу.
+    """
+    def __init__(self, name, window=20, min_calls=5, failure_rate=0.5,
+                 open_timeout=30, probe=None, probe_interval=10, trial_timeout=None):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_timeout = open_timeout
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.trial_timeout = trial_timeout if trial_timeout is not None else probe_interval
+
+        self._lock = threading.Lock()
+        self._results = deque(maxlen=window)   # True - успех, False - ошибка
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._trial_started = 0.0
+        self._probe_thread = None
+
+        self.rejected = 0
+        self.last_error = None
+        self.last_probe = None    # (время, успех)
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            return self._state
+
+    def allow(self):
+        """Можно ли отправить запрос сейчас"""
+        with self._lock:
+            now = time.monotonic()
+            self._maybe_half_open(now)
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and (not self._trial_in_flight or self._trial_stuck(now)):
+                self._trial_in_flight = True
+                self._trial_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._results.append(True)
+            if self._state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self._results.append(False)
+            if error is not None:
+                self.last_error = str(error)[:200]
+
+            if self._state == HALF_OPEN:
+                self._open()
+            elif self._state == CLOSED and len(self._results) >= self.min_calls:
+                failures = self._results.count(False)
+                if failures / len(self._results) >= self.failure_rate:
+                    self._open()
+
+    def release(self):
+        """Запрос завершился без исхода (отменён) - пробу можно отдать следующему"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def get_stats(self):
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            return {
+                "state": self._state,
+                "calls": len(self._results),
+                "failures": self._results.count(False),
+                "rejected": self.rejected,
+                "last_error": self.last_error,
+                "open_for": time.monotonic() - self._opened_at if self._state != CLOSED else 0.0,
+            }
+
+    def format_status(self):
+        stats = self.get_stats()
+        line = (
+            f"{self.name}: {STATE_LABELS[stats['state']]} | ошибок {stats['failures']}/{stats['calls']}, "
+            f"отклонено {stats['rejected']}"
+        )
+        if stats["state"] != CLOSED:
+            line += f", не работает {stats['open_for']:.0f} сек"
+        if stats["last_error"]:
+            line += f"\n   последняя ошибка: {stats['last_error']}"
+        return line
+
+    # --- Внутреннее (вызывается под self._lock) ---
+
+    def _set_state(self, state):
+        if state == self._state:
+            return
+        print(f"⚡ {self.name}: {STATE_LABELS[self._state]} -> {STATE_LABELS[state]}")
+        self._state = state
+        self._trial_in_flight = False
+        if state == CLOSED:
+            self._results.clear()
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._set_state(OPEN)
+        self._ensure_probe()
+
+    def _trial_stuck(self, now):
+        return self._trial_in_flight and now - self._trial_started >= self.trial_timeout
+
+    def _maybe_half_open(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.open_timeout:
+            self._set_state(HALF_OPEN)
+
+    def _ensure_probe(self):
+        if self.probe is None:
+            return
+        if self._probe_thread is None or not self._probe_thread.is_alive():
+            self._probe_thread = threading.Thread(
+                target=self._probe_loop, name=f"{self.name}-probe", daemon=True
+            )
+            self._probe_thread.start()
+
+    def _probe_loop(self):
+        """Проверяет сервис в фоне, пока автомат не замкнётся"""
+        while True:
+            time.sleep(self.probe_interval)
+            with self._lock:
+                if self._state == CLOSED:
+                    return
+            try:
+                ok = bool(self.probe())
+            except Exception as e:
+                ok = False
+                self.last_error = f"проверка: {e}"
+
+            with self._lock:
+                self.last_probe = (time.time(), ok)
+                if ok and self._state == OPEN:
+                    # Сервис отвечает - следующий настоящий запрос будет пробным
+                    self._set_state(HALF_OPEN)
+                elif ok and self._trial_stuck(time.monotonic()):
+                    # Исход пробы так и не записали - пропускаем новую
+                    self._trial_in_flight = False
+                elif not ok and self._state == OPEN:
+                    self._opened_at = time.monotonic()
+                elif not ok and self._state == HALF_OPEN:
+                    self._open()
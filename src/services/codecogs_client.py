@@ -1,20 +1,19 @@
 import requests
 import io
 from PIL import Image
+from src.services.http_pool import session, timeout
+from src.utils.latex_parser import normalize_latex
 
 def render_latex_via_codecogs(latex_text, dpi=300):
-    """Рендеринг через CodeCogs"""
+    """Рендеринг через CodeCogs (запасной вариант, см. latex_renderer)"""
     try:
         # \frac -> \displaystyle\frac для работы в CodeCogs
-        if r'\frac' in latex_text and r'\displaystyle' not in latex_text:
-             latex_text = r'\displaystyle ' + latex_text
-             
-        latex_clean = latex_text.strip().strip('$').strip()
+        latex_clean = normalize_latex(latex_text)
         latex_encoded = requests.utils.quote(latex_clean)
         
         url = f"https://latex.codecogs.com/png.latex?\\dpi{{{dpi}}}{latex_encoded}"
         
-        response = requests.get(url, timeout=10)
+        response = session.get(url, timeout=timeout(10))
         if response.status_code == 200:
             return Image.open(io.BytesIO(response.content))
         else:
@@ -0,0 +1,107 @@
+import sys
+import threading
+from collections import OrderedDict, deque
+
+import config
+
+# Роли храним одной строкой на весь процесс, а не копией в каждой реплике
+USER = sys.intern("user")
+ASSISTANT = sys.intern("assistant")
+
+
+def estimate_tokens(text):
+    """Грубая оценка числа токенов (кириллица - около 3 символов на токен)"""
+    return len(text) // 3 + 4
+
+
+def truncate_to_tokens(text, tokens):
+    """Обрезает текст, чтобы его оценка не превышала tokens"""
+    if estimate_tokens(text) <= tokens:
+        return text
+    return text[:max(0, tokens - 5) * 3] + "…"
+
+
+class ConversationStore:
+    """
+    История диалога для моделей OpenRouter (у Qwen история хранится на стороне прокси).
+
+    На пользователя - кольцевой буфер реплик (роль, текст, оценка токенов):
+    не больше max_turns реплик и max_tokens токенов, старые реплики вытесняются
+    первыми. Хранится сам запрос пользователя, без инструкций режима - они
+    добавляются к каждому новому промпту и в истории не дублируются.
+    Общий объём всех историй ограничен max_total_tokens: при превышении
+    вытесняются диалоги, к которым дольше всего не обращались.
+    """
+    def __init__(self, max_tokens=3000, max_turns=20, max_total_tokens=500_000):
+        self.max_tokens = max_tokens
+        self.max_turns = max(2, max_turns)
+        self.max_total_tokens = max_total_tokens
+
+        self._lock = threading.Lock()
+        self._dialogs = OrderedDict()   # user_id -> [deque реплик, токенов в диалоге]
+        self._total_tokens = 0
+        self.evicted = 0
+
+    def get_messages(self, user_id):
+        """История в формате messages для chat.completions ([] если диалога нет)"""
+        with self._lock:
+            dialog = self._dialogs.get(user_id)
+            if dialog is None:
+                return []
+            self._dialogs.move_to_end(user_id)
+            return [{"role": role, "content": content} for role, content, _ in dialog[0]]
+
+    def add_turn(self, user_id, prompt, response):
+        """Добавляет пару запрос-ответ в историю пользователя"""
+        if not prompt or not response:
+            return
+        # Пара больше всего бюджета диалога целиком не сохранится (вытеснять её нечем) -
+        # обрезаем: запросу не больше половины бюджета, ответу - остаток
+        prompt = truncate_to_tokens(prompt, self.max_tokens // 2)
+        response = truncate_to_tokens(response, self.max_tokens - estimate_tokens(prompt))
+        with self._lock:
+            dialog = self._dialogs.get(user_id)
+            if dialog is None:
+                dialog = self._dialogs[user_id] = [deque(), 0]
+            self._dialogs.move_to_end(user_id)
+
+            for role, content in ((USER, prompt), (ASSISTANT, response)):
+                tokens = estimate_tokens(content)
+                dialog[0].append((role, content, tokens))
+                dialog[1] += tokens
+                self._total_tokens += tokens
+
+            # Старые реплики уходят парами, чтобы история начиналась с запроса пользователя
+            turns = dialog[0]
+            while len(turns) > 2 and (len(turns) > self.max_turns or dialog[1] > self.max_tokens):
+                for _ in range(2):
+                    _, _, tokens = turns.popleft()
+                    dialog[1] -= tokens
+                    self._total_tokens -= tokens
+
+            while self._total_tokens > self.max_total_tokens and len(self._dialogs) > 1:
+                _, (_, tokens) = self._dialogs.popitem(last=False)
+                self._total_tokens -= tokens
+                self.evicted += 1
+
+    def clear(self, user_id):
+        with self._lock:
+            dialog = self._dialogs.pop(user_id, None)
+            if dialog is not None:
+                self._total_tokens -= dialog[1]
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "dialogs": len(self._dialogs),
+                "tokens": self._total_tokens,
+                "evicted": self.evicted,
+            }
+
+
+def create_conversation_store():
+    return ConversationStore(
+        max_tokens=config.CONVERSATION_MAX_TOKENS,
+        max_turns=config.CONVERSATION_MAX_TURNS,
+        max_total_tokens=config.CONVERSATION_TOTAL_TOKENS,
+    )
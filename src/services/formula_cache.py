@@ -0,0 +1,234 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+import config
+
+
+def formula_key(latex, dpi, renderer):
+    """Ключ кэша: хеш (нормализованная формула, DPI, рендерер)"""
+    raw = json.dumps([renderer, dpi, latex], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def image_bytes(img):
+    """Объём декодированного изображения в памяти"""
+    return img.width * img.height * len(img.getbands())
+
+
+class FormulaCache:
+    """
+    Кэш отрисованных формул.
+
+    Память: LRU готовых RGBA-изображений, не больше max_bytes (по объёму пикселей).
+    Наружу отдаются копии - генераторы закрывают изображения после вставки.
+    Диск (если задан disk_dir): по PNG на формулу, общий объём не больше
+    disk_max_bytes (вытесняются файлы, к которым дольше всего не обращались).
+    Если каталог недоступен, кэш работает только в памяти.
+    Неудачи рендереров (формулу не удалось разобрать) помнятся в памяти,
+    не больше max_failures - такие формулы не разбираются заново.
+    bytes_saved - сколько байт PNG не пришлось рендерить или скачивать заново.
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024, disk_dir=None, disk_max_bytes=100 * 1024 * 1024,
+                 max_failures=4096):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.max_failures = max_failures
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # ключ -> (RGBA-изображение, размер PNG)
+        self._bytes = 0
+        self._failures = OrderedDict()  # ключ -> None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+        self._disk_bytes = 0
+        if self.disk_dir:
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+                self._disk_bytes = sum(size for _, _, size in self._disk_files())
+            except OSError as e:
+                print(f"⚠️ Кэш формул: каталог {self.disk_dir} недоступен ({e}), кэш только в памяти")
+                self.disk_dir = None
+
+    # --- Публичный интерфейс ---
+
+    def get(self, latex, dpi, renderers):
+        """
+        Копия изображения формулы или None. renderers - имена рендереров
+        в порядке предпочтения: берётся первый найденный, промах считается один раз.
+        """
+        keys = [formula_key(latex, dpi, renderer) for renderer in renderers]
+        if not keys:
+            return None  # цепочка рендереров пуста (нет matplotlib, пустой LATEX_RENDERER_FALLBACK)
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.bytes_saved += entry[1]
+                    return entry[0].copy()
+
+        for key in keys:
+            entry = self._disk_get(key)
+            if entry is not None:
+                break
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.bytes_saved += entry[1]
+            self._remember(key, entry)
+        return entry[0].copy()
+
+    def has_failed(self, latex, dpi, renderer):
+        """Рендерер уже не справился с этой формулой?"""
+        with self._lock:
+            return formula_key(latex, dpi, renderer) in self._failures
+
+    def put_failure(self, latex, dpi, renderer):
+        with self._lock:
+            self._failures[formula_key(latex, dpi, renderer)] = None
+            while len(self._failures) > self.max_failures:
+                self._failures.popitem(last=False)
+
+    def put(self, latex, dpi, renderer, img):
+        """Кладёт формулу в кэш (само изображение остаётся у вызывающего)"""
+        key = formula_key(latex, dpi, renderer)
+        rgba = img.convert("RGBA") if img.mode != "RGBA" else img.copy()
+        buffer = io.BytesIO()
+        rgba.save(buffer, "PNG")
+        png = buffer.getvalue()
+
+        with self._lock:
+            self._remember(key, (rgba, len(png)))
+        self._disk_put(key, png)
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def format_stats(self):
+        stats = self.get_stats()
+        return (
+            f"🧮 Кэш формул: {stats['entries']} шт. ({stats['bytes'] // 1024} КБ), попаданий {stats['hits']} "
+            f"(+{stats['disk_hits']} с диска), промахов {stats['misses']}, "
+            f"hit rate {stats['hit_rate'] * 100:.0f}%, сэкономлено {stats['bytes_saved'] // 1024} КБ"
+        )
+
+    # --- Память (вызывается под self._lock) ---
+
+    def _remember(self, key, entry):
+        size = image_bytes(entry[0])
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= image_bytes(old[0])
+        self._entries[key] = entry
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._bytes -= image_bytes(evicted)
+
+    # --- Диск ---
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.png")
+
+    def _disk_files(self):
+        """(mtime, путь, размер) всех формул на диске"""
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".png"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path, stat.st_size))
+        return files
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with Image.open(path) as img:
+                rgba = img.convert("RGBA")
+            size = os.path.getsize(path)
+            os.utime(path)   # свежий mtime - файл не вытеснится первым
+        except (OSError, ValueError):
+            return None
+        return rgba, size
+
+    def _disk_put(self, key, png):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(png)
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._disk_bytes += len(png) - old_size
+                over_limit = self._disk_bytes > self.disk_max_bytes
+            if over_limit:
+                self._disk_evict()
+        except OSError as e:
+            print(f"⚠️ Кэш формул: не удалось записать на диск: {e}")
+
+    def _disk_remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.unlink(path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_bytes -= size
+
+    def _disk_evict(self):
+        """Удаляет давно не использованные формулы, пока объём не станет меньше 90% лимита"""
+        target = self.disk_max_bytes * 0.9
+        for _, path, _ in sorted(self._disk_files()):
+            with self._lock:
+                if self._disk_bytes <= target:
+                    return
+            self._disk_remove(path)
+
+
+def create_formula_cache():
+    """Кэш по настройкам из config (None, если кэш выключен)"""
+    if not config.FORMULA_CACHE_ENABLED:
+        return None
+    return FormulaCache(
+        max_bytes=config.FORMULA_CACHE_MB * 1024 * 1024,
+        disk_dir=config.FORMULA_CACHE_DIR or None,
+        disk_max_bytes=config.FORMULA_CACHE_DISK_MB * 1024 * 1024,
+    )
+
+
+formula_cache = create_formula_cache()
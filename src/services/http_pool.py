@@ -0,0 +1,137 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import config
+
+# Повторяем только идемпотентные запросы: POST к AI и загрузки в VK не дублируем
+RETRY_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+VK_API_URL = "https://api.vk.com/"
+
+
+def timeout(read_timeout):
+    """(таймаут соединения, таймаут чтения) для requests"""
+    return (config.HTTP_CONNECT_TIMEOUT, read_timeout)
+
+
+def make_adapter(pool_size):
+    retry = Retry(
+        total=config.HTTP_RETRIES,
+        connect=config.HTTP_RETRIES,
+        read=config.HTTP_RETRIES,
+        status=config.HTTP_RETRIES,
+        backoff_factor=config.HTTP_RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=RETRY_METHODS,
+        raise_on_status=False,
+    )
+    # pool_connections - сколько хостов держать, pool_maxsize - соединений на хост
+    return HTTPAdapter(pool_connections=10, pool_maxsize=pool_size, max_retries=retry)
+
+
+def host_prefix(url):
+    """'http://localhost:3264/api' -> 'http://localhost:3264/' (префикс для session.mount)"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}/"
+
+
+def pool_size(url):
+    """Размер пула для хоста: из HTTP_POOL_SIZES, иначе HTTP_POOL_SIZE"""
+    prefix = host_prefix(url)
+    for host, size in config.HTTP_POOL_SIZES.items():
+        if "://" not in host:
+            host = f"https://{host}"
+        if host_prefix(host) == prefix:
+            return size
+    return config.HTTP_POOL_SIZE
+
+
+def create_session():
+    """
+    Общая сессия requests с keep-alive: соединения к хостам переиспользуются.
+    Размер пула задаётся для каждого хоста отдельно (HTTP_POOL_SIZES),
+    для остальных - HTTP_POOL_SIZE.
+    """
+    session = requests.Session()
+    default_adapter = make_adapter(config.HTTP_POOL_SIZE)
+    session.mount("https://", default_adapter)
+    session.mount("http://", default_adapter)
+
+    # Прокси Qwen - по соединению на каждый параллельный запрос
+    session.mount(host_prefix(config.QWEN_PROXY_URL), make_adapter(config.QWEN_POOL_SIZE))
+
+    for host, size in config.HTTP_POOL_SIZES.items():
+        if "://" not in host:
+            host = f"https://{host}"
+        session.mount(host_prefix(host), make_adapter(size))
+    return session
+
+
+def create_vk_session():
+    """
+    Отдельная сессия для vk_api: он настраивает сессию под себя (заголовки вроде
+    User-agent), и это не должно уходить в запросы к прокси Qwen и CodeCogs.
+    Пул с keep-alive смонтирован только для api.vk.com.
+    """
+    vk_http = requests.Session()
+    vk_http.mount(VK_API_URL, make_adapter(pool_size(VK_API_URL)))
+    return vk_http
+
+
+def get_pool_stats():
+    """Статистика пулов: хост -> (новых соединений, запросов, переиспользовано)"""
+    stats = {}
+    adapters = {
+        id(adapter): adapter
+        for pooled_session in (session, vk_http) for adapter in pooled_session.adapters.values()
+    }
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.host}:{pool.port}" if pool.port else pool.host
+            connections = getattr(pool, "num_connections", 0)
+            requests_made = getattr(pool, "num_requests", 0)
+            total = stats.setdefault(host, [0, 0])
+            total[0] += connections
+            total[1] += requests_made
+    return {
+        host: (connections, requests_made, max(requests_made - connections, 0))
+        for host, (connections, requests_made) in stats.items()
+    }
+
+
+def format_pool_stats():
+    stats = get_pool_stats()
+    if not stats:
+        return "🔗 HTTP: запросов ещё не было"
+    parts = [
+        f"{host}: {requests_made} запр., соединений {connections}, переисп. {reused}"
+        for host, (connections, requests_made, reused) in sorted(stats.items())
+    ]
+    return "🔗 HTTP пулы | " + " | ".join(parts)
+
+
+def _report_loop():
+    while True:
+        time.sleep(config.HTTP_STATS_INTERVAL)
+        try:
+            if get_pool_stats():
+                print(format_pool_stats())
+        except Exception as e:
+            print(f"⚠️ Ошибка статистики HTTP: {e}")
+
+
+session = create_session()
+vk_http = create_vk_session()
+
+if config.HTTP_STATS_INTERVAL > 0:
+    threading.Thread(target=_report_loop, name="http-pool-stats", daemon=True).start()
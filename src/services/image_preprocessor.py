@@ -0,0 +1,133 @@
+import base64
+import io
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+import config
+from src.services.http_pool import session, timeout
+
+# Qwen не принимает изображения больше 20 МБ - больше и не скачиваем
+MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+
+
+def photo_key(photo):
+    """Ключ кэша: id фото во ВК (одно и то же фото при пересылке и в ответах)"""
+    return f"{photo.get('owner_id')}_{photo.get('id')}"
+
+
+def select_photo_size(sizes, max_pixels):
+    """
+    Выбирает размер фото по метаданным ВК: самый маленький из тех, что не меньше
+    бюджета пикселей (дальше уменьшим сами), иначе - самый большой.
+    """
+    known = [s for s in sizes if s.get("width") and s.get("height")]
+    if not known:
+        # У старых фото размеры бывают нулевыми - берём последний (обычно самый большой)
+        return sizes[-1] if sizes else None
+
+    big_enough = [s for s in known if s["width"] * s["height"] >= max_pixels]
+    if big_enough:
+        return min(big_enough, key=lambda s: s["width"] * s["height"])
+    return max(known, key=lambda s: s["width"] * s["height"])
+
+
+def downscale_to_jpeg(data, max_pixels, quality):
+    """Уменьшает изображение до бюджета пикселей и пережимает в JPEG"""
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert("RGB")
+        pixels = img.width * img.height
+        if pixels > max_pixels:
+            scale = (max_pixels / pixels) ** 0.5
+            img = img.resize(
+                (max(1, int(img.width * scale)), max(1, int(img.height * scale))),
+                Image.LANCZOS,
+            )
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=quality, optimize=True)
+        return buffer.getvalue()
+
+
+def download(url):
+    """Скачивает изображение (не больше MAX_DOWNLOAD_BYTES)"""
+    with session.get(url, timeout=timeout(15), stream=True) as response:
+        response.raise_for_status()
+        if "image" not in response.headers.get("Content-Type", "").lower():
+            raise ValueError(f"неверный тип файла: {response.headers.get('Content-Type')}")
+
+        chunks, size = [], 0
+        for chunk in response.iter_content(64 * 1024):
+            size += len(chunk)
+            if size > MAX_DOWNLOAD_BYTES:
+                raise ValueError("изображение больше 20 MB")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+
+class ImageCache:
+    """LRU подготовленных изображений (ключ - id фото), ограничен по объёму в байтах"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def get_stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+image_cache = ImageCache(config.IMAGE_CACHE_MB * 1024 * 1024)
+
+
+def prepare_photo(photo):
+    """
+    Фото из вложения ВК -> ссылка для Qwen.
+    С QWEN_IMAGE_INLINE фото скачивается один раз, уменьшается до QWEN_IMAGE_MAX_PIXELS
+    и передаётся как data URI (из кэша при повторных запросах); иначе - URL
+    подходящего размера. При ошибке загрузки - тоже URL (его скачает прокси).
+    """
+    size = select_photo_size(photo.get("sizes", []), config.QWEN_IMAGE_MAX_PIXELS)
+    if size is None:
+        return None
+    if not config.QWEN_IMAGE_INLINE:
+        return size["url"]
+
+    key = photo_key(photo)
+    data = image_cache.get(key)
+    if data is None:
+        try:
+            data = downscale_to_jpeg(download(size["url"]), config.QWEN_IMAGE_MAX_PIXELS, config.QWEN_IMAGE_QUALITY)
+        except Exception as e:
+            print(f"⚠️ Не удалось подготовить фото {key}: {e}")
+            return size["url"]
+        image_cache.put(key, data)
+        print(f"🖼️ Фото {key}: {size.get('width')}x{size.get('height')} -> {len(data) // 1024} КБ")
+
+    return "data:image/jpeg;base64," + base64.b64encode(data).decode("ascii")
@@ -0,0 +1,218 @@
+import io
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from PIL import Image
+
+import config
+from src.utils.latex_parser import normalize_latex
+from src.services.codecogs_client import render_latex_via_codecogs
+from src.services.formula_cache import formula_cache
+
+try:
+    import matplotlib
+    from matplotlib import mathtext
+    from matplotlib.font_manager import FontProperties
+
+    MATPLOTLIB_AVAILABLE = True
+except ImportError:
+    MATPLOTLIB_AVAILABLE = False
+    print("⚠️ matplotlib не установлен. Локальный рендеринг формул недоступен.")
+
+
+class MathtextRenderer:
+    """
+    Локальный рендеринг через matplotlib mathtext (без сети).
+    Поддерживает основное подмножество LaTeX; на неподдерживаемом
+    (окружения, \\begin{...}) возвращает None - формулу отрисует следующий рендерер.
+    """
+    name = "mathtext"
+    # Ошибка разбора повторится и в следующий раз - её можно запомнить
+    cache_failures = True
+
+    # Парсер mathtext и кэши шрифтов matplotlib не потокобезопасны
+    _lock = threading.Lock()
+
+    def __init__(self, font_size=12):
+        self.font_size = font_size
+
+    def is_available(self):
+        return MATPLOTLIB_AVAILABLE
+
+    # Команды LaTeX, которых нет в mathtext, -> их синонимы
+    ALIASES = {
+        "le": r"\leq", "ge": r"\geq", "ne": r"\neq", "lt": "<", "gt": ">",
+        "implies": r"\Rightarrow", "iff": r"\Leftrightarrow", "dots": r"\ldots",
+        "frac": r"\dfrac",   # \displaystyle mathtext не знает - дроби сразу крупные
+    }
+    _alias_re = re.compile(r'\\(' + '|'.join(ALIASES) + r')(?![a-zA-Z])')
+
+    def prepare(self, latex):
+        latex = latex.replace(r'\displaystyle', '').strip()
+        return self._alias_re.sub(lambda m: self.ALIASES[m.group(1)], latex)
+
+    def render(self, latex, dpi, deadline_at=None):
+        """deadline_at (time.monotonic) - дольше не ждём своей очереди к mathtext (TimeoutError)"""
+        timeout = -1 if deadline_at is None else max(0, deadline_at - time.monotonic())
+        if not self._lock.acquire(timeout=timeout):
+            raise TimeoutError("mathtext занят, срок документа вышел")
+        buffer = io.BytesIO()
+        try:
+            with matplotlib.rc_context({"mathtext.fontset": "cm"}):
+                mathtext.math_to_image(
+                    f"${self.prepare(latex)}$", buffer,
+                    prop=FontProperties(size=self.font_size), dpi=dpi, format="png",
+                )
+        except Exception as e:
+            print(f"⚠️ mathtext не смог отрисовать {latex[:60]}: {type(e).__name__}")
+            return None
+        finally:
+            self._lock.release()
+
+        buffer.seek(0)
+        img = Image.open(buffer)
+        img.load()
+        return img
+
+
+class CodecogsRenderer:
+    """Рендеринг через latex.codecogs.com (сетевой запрос на каждую формулу)"""
+    name = "codecogs"
+    # Ошибка может быть временной (сеть) - не запоминаем
+    cache_failures = False
+
+    def is_available(self):
+        return True
+
+    def render(self, latex, dpi, deadline_at=None):
+        return render_latex_via_codecogs(latex, dpi=dpi)
+
+
+RENDERERS = {
+    MathtextRenderer.name: MathtextRenderer,
+    CodecogsRenderer.name: CodecogsRenderer,
+}
+
+
+def create_renderers(names):
+    """Цепочка рендереров по именам: следующий пробуется, если предыдущий не справился"""
+    renderers = []
+    for name in dict.fromkeys(names):   # без повторов, порядок сохраняется
+        renderer_class = RENDERERS.get(name)
+        if renderer_class is None:
+            print(f"⚠️ Неизвестный рендерер формул: {name} (доступны: {', '.join(RENDERERS)})")
+            continue
+        renderer = renderer_class()
+        if not renderer.is_available():
+            print(f"⚠️ Рендерер формул {name} недоступен, пропускаю")
+            continue
+        renderers.append(renderer)
+    return renderers
+
+
+renderers = create_renderers([config.LATEX_RENDERER] + config.LATEX_RENDERER_FALLBACKS)
+
+
+def render_latex(latex_text, dpi=300, deadline_at=None):
+    """
+    Формула -> PIL.Image (первым рендерером цепочки, который справился) или None.
+    deadline_at (time.monotonic) - срок документа, см. render_formulas.
+    Готовые формулы берутся из кэша (ключ - формула, DPI и рендерер) - сначала
+    по всем рендерерам цепочки; рендерер, который уже не смог разобрать формулу, пропускается.
+    """
+    latex = normalize_latex(latex_text)
+    if not latex:
+        return None
+    if formula_cache is not None:
+        img = formula_cache.get(latex, dpi, [renderer.name for renderer in renderers])
+        if img is not None:
+            return img
+    for renderer in renderers:
+        if formula_cache is not None and formula_cache.has_failed(latex, dpi, renderer.name):
+            continue
+        img = renderer.render(latex, dpi, deadline_at)
+        if img is None:
+            if formula_cache is not None and renderer.cache_failures:
+                formula_cache.put_failure(latex, dpi, renderer.name)
+            continue
+        if formula_cache is not None:
+            formula_cache.put(latex, dpi, renderer.name, img)
+        return img
+    return None
+
+
+# Формулы документа рисуются параллельно (CodeCogs, чтение кэша с диска);
+# сам mathtext выполняется под блокировкой, по одной формуле.
+# Пул общий для всех документов, поэтому у каждого документа свой срок:
+# формулы подаются в пул порциями, пока срок не вышел, а задача, до которой
+# очередь дошла слишком поздно, сразу завершается и не занимает поток
+_executor = ThreadPoolExecutor(
+    max_workers=config.FORMULA_RENDER_WORKERS,
+    thread_name_prefix="formula"
+)
+
+
+def _render_task(latex, dpi, deadline_at):
+    if time.monotonic() >= deadline_at:
+        return None   # документ уже собран без этой формулы
+    try:
+        return render_latex(latex, dpi, deadline_at)
+    except TimeoutError:
+        return None
+
+
+def render_formulas(blocks, dpi=300, deadline=None):
+    """
+    Рисует формулы документа параллельно -> {block['start']: PIL.Image}.
+    Одинаковые формулы рисуются один раз. Формулы, не готовые за deadline
+    секунд (по умолчанию FORMULA_RENDER_DEADLINE), в результат не попадают -
+    генераторы выводят их текстом (latex_to_unicode). В пуле одновременно
+    не больше FORMULA_RENDER_WORKERS формул документа; после срока новые не подаются.
+    """
+    if not blocks:
+        return {}
+    if deadline is None:
+        deadline = config.FORMULA_RENDER_DEADLINE
+    deadline_at = time.monotonic() + deadline
+
+    queue = deque(dict.fromkeys(normalize_latex(block['latex']) for block in blocks))
+    total = len(queue)
+    futures = {}   # формула -> future
+    pending = set()
+    while queue or pending:
+        while queue and len(pending) < config.FORMULA_RENDER_WORKERS:
+            latex = queue.popleft()
+            future = _executor.submit(_render_task, latex, dpi, deadline_at)
+            futures[latex] = future
+            pending.add(future)
+        timeout = deadline_at - time.monotonic()
+        if timeout <= 0:
+            break
+        _, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+    late = len(pending) + len(queue)
+    for future in pending:
+        future.cancel()
+    if late:
+        print(f"⏰ Не успели отрисовать {late} из {total} формул за {deadline} сек")
+
+    rendered = {}
+    used = set()
+    for block in blocks:
+        future = futures.get(normalize_latex(block['latex']))
+        if future is None or not future.done() or future.cancelled():
+            continue
+        try:
+            img = future.result()
+        except Exception as e:
+            print(f"❌ Ошибка рендеринга формулы: {e}")
+            continue
+        if img is None:
+            continue
+        # Повтор формулы в документе - отдельная копия (генераторы закрывают изображения)
+        rendered[block['start']] = img.copy() if future in used else img
+        used.add(future)
+    return rendered
@@ -11,9 +11,91 @@ except Exception as e:
     print(f"❌ Не удалось инициализировать OpenRouter: {e}")
     openrouter_client = None
 
+# Провайдеры, которым кэш префикса нужно включать явно (cache_control);
+# остальные (DeepSeek, Moonshot, OpenAI) кэшируют одинаковый префикс сами
+CACHE_CONTROL_PROVIDERS = ("anthropic/", "google/")
 
-def get_openrouter_response(model_name, user_prompt):
-    """OpenRouter"""
+
+def system_message(model_id, system_prompt):
+    """Системное сообщение; для поддерживающих провайдеров - с пометкой для кэша префикса"""
+    if config.OPENROUTER_CACHE_CONTROL and model_id.startswith(CACHE_CONTROL_PROVIDERS):
+        return {
+            "role": "system",
+            "content": [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}],
+        }
+    return {"role": "system", "content": system_prompt}
+
+
+def build_messages(model_id, user_prompt, history=None, system_prompt=None):
+    """
+    [system] + история + запрос. Неизменная часть идёт первой,
+    чтобы у запросов одного режима совпадал префикс.
+    """
+    messages = [system_message(model_id, system_prompt)] if system_prompt else []
+    return messages + (history or []) + [{"role": "user", "content": user_prompt}]
+
+
+def build_completion_kwargs(model_id, user_prompt, history=None, system_prompt=None):
+    """
+    Параметры chat.completions.create (общие для sync и async клиентов).
+    history - прошлые реплики диалога (см. ConversationStore), system_prompt - инструкции режима.
+    """
+    return dict(
+        # заголовки берутся из config
+        extra_headers={
+            "HTTP-Referer": config.APP_REFERER, 
+            "X-Title": config.APP_TITLE
+        },
+        # -------------------------
+        model=model_id,
+        messages=build_messages(model_id, user_prompt, history, system_prompt),
+        # Подробный usage (в том числе prompt_tokens_details.cached_tokens)
+        extra_body={"usage": {"include": True}},
+        max_tokens=1000,
+        timeout=45,
+    )
+
+
+def report_usage(on_usage, usage):
+    """
+    Передаёт расход токенов (CompletionUsage) в
+    on_usage(prompt_tokens, completion_tokens, cached_tokens)
+    """
+    if on_usage is None or usage is None:
+        return
+    try:
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", 0) or 0
+        on_usage(usage.prompt_tokens or 0, usage.completion_tokens or 0, cached)
+    except Exception as e:
+        print(f"⚠️ Ошибка учёта токенов: {e}")
+
+
+def stream_completion(kwargs, on_delta, on_usage=None):
+    """Потоковый запрос: куски текста уходят в on_delta, возвращается весь ответ"""
+    parts = []
+    stream = openrouter_client.chat.completions.create(
+        stream=True, stream_options={"include_usage": True}, **kwargs
+    )
+    for chunk in stream:
+        # usage приходит последним куском, без choices
+        if getattr(chunk, "usage", None):
+            report_usage(on_usage, chunk.usage)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            on_delta(delta)
+    return "".join(parts)
+
+
+def get_openrouter_response(model_name, user_prompt, history=None, on_delta=None, on_usage=None,
+                            system_prompt=None):
+    """
+    OpenRouter (history - прошлые реплики диалога; on_delta - потоковый режим;
+    on_usage(prompt, completion, cached) - учёт токенов; system_prompt - инструкции режима)
+    """
     if not openrouter_client:
         return "❌ Клиент OpenRouter не инициализирован."
 
@@ -24,19 +106,12 @@ def get_openrouter_response(model_name, user_prompt):
     print(f"⏳ Запрос к OpenRouter ({model_id})...")
 
     try:
-        completion = openrouter_client.chat.completions.create(
-            
-            # заголовки берутся из config
-            extra_headers={
-                "HTTP-Referer": config.APP_REFERER, 
-                "X-Title": config.APP_TITLE
-            },
-            # -------------------------
-            model=model_id,
-            messages=[{"role": "user", "content": user_prompt}],
-            max_tokens=1000,
-            timeout=45,
-        )
+        kwargs = build_completion_kwargs(model_id, user_prompt, history, system_prompt)
+        if on_delta is not None:
+            return stream_completion(kwargs, on_delta, on_usage)
+        
+        completion = openrouter_client.chat.completions.create(**kwargs)
+        report_usage(on_usage, completion.usage)
         return completion.choices[0].message.content
     except APITimeoutError:
         return f"⏰ {model_name}: Таймаут"
@@ -1,23 +1,53 @@
-def get_final_prompt(text, mode, image_url=None):
-    """Генерация промпта в зависимости от режима"""
+# Инструкции режимов - отдельным системным сообщением: он одинаков для всех
+# запросов режима, и провайдер может переиспользовать закэшированный префикс
+SYSTEM_PROMPTS = {
+    "code": "Ты — эксперт по программированию и ассистент по коду. Твой ответ должен содержать только код и краткие объяснения. Не используй LaTeX. Оборачивай блоки кода в ``` (например, ```python ... ```).",
+    "math": "Ты — ИИ-ассистент, специализирующийся на математике. Решай задачи пошагово. Используй LaTeX для всех формул (например, $\\frac{a}{b}$ или \\\\\\[ ... \\\\\\]).",
+}
+
+# Запрос по умолчанию, если к фото не приложен текст
+IMAGE_PROMPTS = {
+    "code": "Проанализируй код на этом изображении. Объясни, что он делает, и найди ошибки.",
+    "math": "Реши эти задачи подробно с пошаговым объяснением.",
+    "raw": "Что на этом изображении?",
+}
+
+
+def get_system_prompt(mode, image_url=None):
+    """Системный промпт режима (None - без инструкций: raw и запросы с фото)"""
+    if image_url:
+        return None
+    return SYSTEM_PROMPTS.get(mode)
+
+
+def get_user_prompt(text, mode, image_url=None):
+    """Сообщение пользователя (для фото без текста - запрос по умолчанию)"""
     if image_url:
-        if mode == "code":
-            return text or "Проанализируй код на этом изображении. Объясни, что он делает, и найди ошибки."
-        elif mode == "math":
-            return text or "Реши эти задачи подробно с пошаговым объяснением."
-        elif mode == "raw":
-            return text or "Что на этом изображении?"
-    else:
-        # Только текст
-        if mode == "code":
-            return f"""Ты — эксперт по программированию и ассистент по коду. Твой ответ должен содержать только код и краткие объяснения. Не используй LaTeX. Оборачивай блоки кода в ``` (например, ```python ... ```).
-
-Запрос: {text}"""
-        elif mode == "math":
-            return f"""Ты — ИИ-ассистент, специализирующийся на математике. Решай задачи пошагово. Используй LaTeX для всех формул (например, $\\frac{{a}}{{b}}$ или \\\\\\[ ... \\\\\\]).
-
-Запрос: {text}"""
-        elif mode == "raw":
-            return text
-            
-    return text # Fallback
\ No newline at end of file
+        return text or IMAGE_PROMPTS.get(mode, text)
+    return text
+
+
+def join_prompt(system_prompt, user_prompt):
+    """Системный промпт и запрос одним сообщением (для прокси Qwen, он не принимает system)"""
+    if not system_prompt:
+        return user_prompt
+    return f"{system_prompt}\n\nЗапрос: {user_prompt}"
+
+
+def join_history(history, user_prompt):
+    """
+    Прошлые реплики и новый запрос одним сообщением - для Qwen, если прошлый ответ
+    дала резервная модель и чата на прокси с этим контекстом нет.
+    """
+    if not history:
+        return user_prompt
+    turns = "\n\n".join(
+        f"{'Пользователь' if message['role'] == 'user' else 'Ассистент'}: {message['content']}"
+        for message in history
+    )
+    return f"Предыдущий диалог:\n{turns}\n\nНовый запрос: {user_prompt}"
+
+
+def get_final_prompt(text, mode, image_url=None):
+    """Генерация промпта в зависимости от режима (image_url - URL или список URL)"""
+    return join_prompt(get_system_prompt(mode, image_url), get_user_prompt(text, mode, image_url))
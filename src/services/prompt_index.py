@@ -0,0 +1,177 @@
+import random
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import config
+
+# Слова вежливости и обращения, которые не меняют смысл задачи
+FILLER_WORDS = {
+    "пожалуйста", "пожалуйсто", "плиз", "плз", "please", "pls",
+    "спасибо", "заранее", "помогите", "помоги", "срочно",
+}
+
+_WORD_RE = re.compile(r"[a-zа-я]+|\d+(?:[.,]\d+)?|[+\-*/=^()<>√]")
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)?")
+
+# В коде один символ меняет смысл (a[i] и a(i), == и =), а нормализация
+# пунктуацию выбрасывает - такие запросы ищем только точным совпадением (response_cache)
+EXACT_ONLY_MODES = frozenset({"code"})
+
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize_prompt(text):
+    """
+    Приводит запрос к каноническому виду: регистр, ё/е, пробелы и пунктуация,
+    слова вежливости. Числа и знаки операций сохраняются.
+    """
+    text = text.lower().replace("ё", "е")
+    tokens = [token for token in _WORD_RE.findall(text) if token not in FILLER_WORDS]
+    return " ".join(token.replace(",", ".") for token in tokens)
+
+
+def shingles(normalized, size=5):
+    """Множество символьных k-грамм (хешей) нормализованного текста"""
+    if len(normalized) <= size:
+        return {zlib.crc32(normalized.encode("utf-8"))}
+    return {
+        zlib.crc32(normalized[i:i + size].encode("utf-8"))
+        for i in range(len(normalized) - size + 1)
+    }
+
+
+class PromptIndex:
+    """
+    Поиск почти одинаковых запросов (MinHash по k-граммам + LSH по полосам).
+
+    Хранит последние max_entries запросов с ответами отдельно для каждой
+    области (модель, режим). Запрос считается повтором, если оценка сходства
+    Жаккара не ниже threshold и числа в тексте совпадают (иначе "x = 5" и
+    "x = 6" дали бы один ответ). Только CPU, память ограничена max_entries.
+    Записи старше ttl секунд не используются (как в response_cache).
+    Запросы режимов EXACT_ONLY_MODES не индексируются.
+    """
+    def __init__(self, max_entries=500, threshold=0.9, num_perm=64, bands=16, shingle_size=5, seed=1,
+                 ttl=7 * 24 * 3600):
+        if num_perm % bands:
+            raise ValueError("num_perm должен делиться на bands")
+        self.max_entries = max(1, max_entries)
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.ttl = ttl
+
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # id -> (область, сигнатура, числа, ответ, время записи)
+        self._buckets = {}              # (область, номер полосы, полоса) -> {id}
+        self._ids = 0
+        self.hits = 0
+        self.misses = 0
+
+    def signature(self, normalized):
+        hashes = shingles(normalized, self.shingle_size)
+        return tuple(
+            min(((a * h + b) % _PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._perms
+        )
+
+    def _band_keys(self, scope, signature):
+        return [
+            (scope, band, signature[band * self.rows:(band + 1) * self.rows])
+            for band in range(self.bands)
+        ]
+
+    def _remove(self, entry_id):
+        """Удаляет запись и её полосы (под self._lock)"""
+        scope, signature, _, _, _ = self._entries.pop(entry_id)
+        for key in self._band_keys(scope, signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def find(self, model, mode, text):
+        """Ответ на похожий запрос или None"""
+        if mode in EXACT_ONLY_MODES:
+            return None
+        normalized = normalize_prompt(text)
+        if not normalized:
+            return None
+        scope = (model, mode)
+        signature = self.signature(normalized)
+        numbers = _NUMBER_RE.findall(normalized)
+        now = time.time()
+
+        with self._lock:
+            candidates = set()
+            for key in self._band_keys(scope, signature):
+                candidates.update(self._buckets.get(key, ()))
+
+            best_id, best_score = None, 0.0
+            for entry_id in candidates:
+                _, other, other_numbers, _, created = self._entries[entry_id]
+                if now - created >= self.ttl:
+                    self._remove(entry_id)
+                    continue
+                if other_numbers != numbers:
+                    continue
+                score = sum(x == y for x, y in zip(signature, other)) / self.num_perm
+                if score > best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            print(f"🔎 Похожий запрос найден (сходство {best_score:.2f})")
+            return self._entries[best_id][3]
+
+    def add(self, model, mode, text, answer):
+        if mode in EXACT_ONLY_MODES:
+            return
+        normalized = normalize_prompt(text)
+        if not normalized or not answer:
+            return
+        scope = (model, mode)
+        signature = self.signature(normalized)
+        numbers = _NUMBER_RE.findall(normalized)
+
+        with self._lock:
+            self._ids += 1
+            entry_id = self._ids
+            self._entries[entry_id] = (scope, signature, numbers, answer, time.time())
+            for key in self._band_keys(scope, signature):
+                self._buckets.setdefault(key, set()).add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def get_stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def create_prompt_index():
+    """Индекс по настройкам из config (None, если выключен)"""
+    if not config.PROMPT_INDEX_ENABLED:
+        return None
+    return PromptIndex(
+        max_entries=config.PROMPT_INDEX_SIZE,
+        threshold=config.PROMPT_SIMILARITY_THRESHOLD,
+        ttl=config.RESPONSE_CACHE_TTL,
+    )
+
+
+prompt_index = create_prompt_index()
@@ -2,6 +2,9 @@ import requests
 import json
 import traceback
 import config
+from src.services.http_pool import session, timeout
+from src.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from src.services.usage_tracker import usage_from_response
 
 
 def log_response(data):
@@ -31,6 +34,26 @@ def log_response(data):
         print(f"⚠️ Ошибка логирования: {e}")
 
 
+def check_image_headers(headers):
+    """
+    Проверка заголовков ответа с изображением (тип и размер).
+    Возвращает (is_valid, error_message)
+    """
+    # Проверяем тип контента
+    content_type = headers.get('Content-Type', '').lower()
+    if 'image' not in content_type:
+        return False, f"Неверный тип файла: {content_type}"
+    
+    # Проверяем размер
+    content_length = headers.get('Content-Length')
+    if content_length:
+        size_mb = int(content_length) / (1024 * 1024)
+        if size_mb > 20:  # Qwen ограничивает 20MB
+            return False, f"Изображение слишком большое: {size_mb:.1f} MB"
+    
+    return True, None
+
+
 def validate_image_url(url):
     """
     Проверка доступности и корректности изображения.
@@ -42,21 +65,9 @@ def validate_image_url(url):
             return False, "Некорректный URL изображения"
         
         # Быстрая проверка доступности (HEAD запрос)
-        response = requests.head(url, timeout=5, allow_redirects=True)
+        response = session.head(url, timeout=timeout(5), allow_redirects=True)
         
-        # Проверяем тип контента
-        content_type = response.headers.get('Content-Type', '').lower()
-        if 'image' not in content_type:
-            return False, f"Неверный тип файла: {content_type}"
-        
-        # Проверяем размер
-        content_length = response.headers.get('Content-Length')
-        if content_length:
-            size_mb = int(content_length) / (1024 * 1024)
-            if size_mb > 20:  # Qwen ограничивает 20MB
-                return False, f"Изображение слишком большое: {size_mb:.1f} MB"
-        
-        return True, None
+        return check_image_headers(response.headers)
         
     except requests.exceptions.Timeout:
         return False, "Превышено время ожидания при загрузке изображения"
@@ -65,81 +76,277 @@ def validate_image_url(url):
         return False, f"Не удалось проверить изображение: {str(e)}"
 
 
-def get_qwen_response_with_image(user_prompt, image_url, chat_id=None, parent_id=None):
-    """Qwen с изображением"""
-    try:
-        # ВАЛИДАЦИЯ ИЗОБРАЖЕНИЯ
-        is_valid, error_msg = validate_image_url(image_url)
-        if not is_valid:
-            print(f"❌ Валидация изображения провалилась: {error_msg}")
-            return f"⚠️ Проблема с изображением: {error_msg}", None, None
-        
-        payload = {
-            "message": [
-                {"type": "text", "text": user_prompt or "Проанализируй изображение"},
-                {"type": "image", "image": image_url}
-            ],
-            "model": "qwen3-vl-plus",
-        }
-        
-        if chat_id:
-            payload["chatId"] = chat_id
-        if parent_id:
-            payload["parentId"] = parent_id
+def is_inline_image(url):
+    """Изображение передаётся самим запросом (data URI), а не ссылкой"""
+    return url.startswith("data:")
+
+
+def as_image_list(image_url):
+    """URL или список URL -> список"""
+    if isinstance(image_url, (list, tuple)):
+        return list(image_url)
+    return [image_url]
+
+
+def build_image_payload(user_prompt, image_url, chat_id=None, parent_id=None):
+    """Тело запроса к прокси для запроса с изображением (одним или несколькими)"""
+    payload = {
+        "message": [
+            {"type": "text", "text": user_prompt or "Проанализируй изображение"},
+        ] + [
+            {"type": "image", "image": url} for url in as_image_list(image_url)
+        ],
+        "model": "qwen3-vl-plus",
+    }
+    
+    if chat_id:
+        payload["chatId"] = chat_id
+    if parent_id:
+        payload["parentId"] = parent_id
+    return payload
+
+
+def build_text_payload(user_prompt, chat_id=None, parent_id=None):
+    """Тело запроса к прокси для текстового запроса"""
+    payload = {
+        "message": user_prompt, 
+        "model": "qwen3-max"
+    }
+    
+    if chat_id:
+        payload["chatId"] = chat_id
+    if parent_id:
+        payload["parentId"] = parent_id
+    return payload
+
+
+def extract_context_ids(data):
+    """Извлекает (chat_id, parent_id) для продолжения диалога"""
+    new_chat_id = data.get("chatId") or data.get("chat_id")
+    new_parent_id = (
+        data.get("parentId") or 
+        data.get("parent_id") or 
+        data.get("response_id") or
+        data.get("id")
+    )
+    return new_chat_id, new_parent_id
+
+
+def parse_image_response(data):
+    """Разбор ответа прокси на запрос с изображением -> (content, chat_id, parent_id)"""
+    # ПРОВЕРКА СТРУКТУРЫ ОТВЕТА
+    if "choices" not in data or not data["choices"]:
+        print(f"❌ Некорректная структура ответа: {json.dumps(data, ensure_ascii=False)}")
+        return "❌ API вернул некорректный ответ. Попробуйте снова.", None, None
+    
+    log_response(data)
+    
+    # ИЗВЛЕЧЕНИЕ КОНТЕНТА С FALLBACK
+    content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+    
+    # Если контент пустой
+    if not content or content.strip() == "":
+        print("⚠️ Получен пустой контент от API")
+        
+        # Проверяем finish_reason
+        finish_reason = data.get("choices", [{}])[0].get("finish_reason", "unknown")
+        print(f"   Finish reason: {finish_reason}")
+        
+        # Формируем понятное сообщение
+        if finish_reason == "content_filter":
+            content = "⚠️ Модель отказалась обрабатывать изображение (сработал контент-фильтр). Попробуйте другое изображение."
+        elif finish_reason == "length":
+            content = "⚠️ Ответ был обрезан из-за ограничения длины. Попробуйте упростить запрос."
+        else:
+            content = (
+                "⚠️ Модель вернула пустой ответ. \n\n"
+                "Используйте /new для сброса диалога."
+            )
+    
+    # ИЗВЛЕЧЕНИЕ МЕТАДАННЫХ ДЛЯ КОНТЕКСТА
+    new_chat_id, new_parent_id = extract_context_ids(data)
+    
+    print(f"✅ Ответ получен. Chat ID: {new_chat_id}, Parent ID: {new_parent_id}")
+    
+    return content, new_chat_id, new_parent_id
+
+
+def parse_text_response(data):
+    """Разбор ответа прокси на текстовый запрос -> (content, chat_id, parent_id)"""
+    # ПРОВЕРКА СТРУКТУРЫ
+    if "choices" not in data or not data["choices"]:
+        print(f"❌ Некорректная структура ответа")
+        return "❌ API вернул некорректный ответ.", None, None
+    
+    log_response(data)
+    
+    # ИЗВЛЕЧЕНИЕ С ПРОВЕРКОЙ
+    content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+    
+    if not content or content.strip() == "":
+        print("⚠️ Получен пустой контент")
+        content = "⚠️ Модель вернула пустой ответ. Попробуйте переформулировать запрос."
+    
+    new_chat_id, new_parent_id = extract_context_ids(data)
+    
+    return content, new_chat_id, new_parent_id
+
+
+def iter_sse_events(response):
+    """События SSE-ответа ('data: {...}') -> dict, до 'data: [DONE]'"""
+    for raw_line in response.iter_lines():
+        line = raw_line.decode('utf-8', 'replace').strip() if raw_line else ""
+        if not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            break
+        try:
+            yield json.loads(data)
+        except ValueError:
+            continue
+
+
+def _post_chat(payload, read_timeout, on_delta=None):
+    """
+    Запрос к /api/chat. Без on_delta - обычный ответ целиком.
+    С on_delta - потоковый (stream: true): каждый кусок текста сразу уходит в on_delta,
+    а из кусков собирается ответ того же вида, что и без потока (для parse_*_response).
+    """
+    url = f"{config.QWEN_PROXY_URL}/api/chat"
+    if on_delta is None:
+        response = session.post(url, json=payload, timeout=timeout(read_timeout))
+        response.raise_for_status()
+        return response.json()
+    
+    with session.post(url, json=dict(payload, stream=True), timeout=timeout(read_timeout), stream=True) as response:
+        response.raise_for_status()
         
-        print(f"⏳ Запрос с изображением... ({config.QWEN_PROXY_URL})")
-        print(f"📎 URL: {image_url[:80]}...")
+        if 'text/event-stream' not in response.headers.get('Content-Type', ''):
+            # Прокси ответил без потока - отдаём текст одним куском
+            data = response.json()
+            content = (data.get("choices") or [{}])[0].get("message", {}).get("content")
+            if content:
+                on_delta(content)
+            return data
+        
+        parts = []
+        result = {"choices": []}
+        finish_reason = None
+        for event in iter_sse_events(response):
+            choice = (event.get("choices") or [{}])[0]
+            delta = (choice.get("delta") or {}).get("content")
+            if delta:
+                parts.append(delta)
+                on_delta(delta)
+            finish_reason = choice.get("finish_reason") or finish_reason
+            
+            # Метаданные (модель, usage, id для контекста) приходят в событиях
+            for key in ("model", "usage", "chatId", "chat_id", "parentId", "parent_id", "response_id", "id"):
+                if event.get(key):
+                    result[key] = event[key]
+        
+        result["choices"] = [{
+            "message": {"content": "".join(parts)},
+            "finish_reason": finish_reason,
+        }]
+        return result
+
+
+def report_usage(on_usage, data):
+    """Передаёт расход токенов из ответа в on_usage(prompt_tokens, completion_tokens, cached_tokens)"""
+    if on_usage is None:
+        return
+    try:
+        on_usage(*usage_from_response(data))
+    except Exception as e:
+        print(f"⚠️ Ошибка учёта токенов: {e}")
+
+
+def probe_proxy():
+    """Фоновая проверка прокси для автомата: отвечает ли /api"""
+    response = session.get(f"{config.QWEN_PROXY_URL}/api", timeout=timeout(5))
+    return response.status_code < 500
+
+
+# Автомат защиты: при недоступном прокси запросы отклоняются сразу, а не ждут таймаута
+qwen_breaker = CircuitBreaker(
+    "Qwen proxy",
+    window=config.QWEN_BREAKER_WINDOW,
+    min_calls=config.QWEN_BREAKER_MIN_CALLS,
+    failure_rate=config.QWEN_BREAKER_FAILURE_RATE,
+    open_timeout=config.QWEN_BREAKER_OPEN_TIMEOUT,
+    probe=probe_proxy,
+    probe_interval=config.QWEN_PROBE_INTERVAL,
+)
+
+BREAKER_OPEN_TEXT = (
+    "🔌 Qwen временно недоступен (прокси не отвечает). "
+    "Попробуйте позже или выберите другую модель: /model deepseek"
+)
+
+
+def is_proxy_failure(error):
+    """Ошибка говорит о проблеме прокси (а не о плохом запросе)?"""
+    if isinstance(error, requests.exceptions.HTTPError):
+        response = error.response
+        return response is None or response.status_code >= 500
+    return True
+
+
+def post_chat(payload, read_timeout, on_delta=None):
+    """Запрос к прокси через автомат защиты (CircuitOpenError, если он разомкнут)"""
+    if not qwen_breaker.allow():
+        raise CircuitOpenError(qwen_breaker)
+    error = None
+    finished = False
+    try:
+        data = _post_chat(payload, read_timeout, on_delta)
+        finished = True
+        return data
+    except Exception as e:
+        if is_proxy_failure(e):
+            error = e
+        finished = True
+        raise
+    finally:
+        # Исход записывается всегда: иначе пробный запрос half-open так и висел бы
+        if not finished:
+            qwen_breaker.release()
+        elif error is not None:
+            qwen_breaker.record_failure(error)
+        else:
+            qwen_breaker.record_success()
+
+
+def get_qwen_response_with_image(user_prompt, image_url, chat_id=None, parent_id=None, on_delta=None, on_usage=None):
+    """Qwen с изображением (image_url - URL или список URL; on_delta - потоковый режим; on_usage(prompt, completion, cached) - учёт токенов)"""
+    try:
+        image_urls = as_image_list(image_url)
         
-        response = requests.post(
-            f"{config.QWEN_PROXY_URL}/api/chat", 
-            json=payload, 
-            timeout=360
-        )
-        response.raise_for_status()
-        data = response.json()
+        # ВАЛИДАЦИЯ ИЗОБРАЖЕНИЙ
+        for url in image_urls:
+            if is_inline_image(url):
+                continue  # уже скачано и проверено при подготовке
+            is_valid, error_msg = validate_image_url(url)
+            if not is_valid:
+                print(f"❌ Валидация изображения провалилась: {error_msg}")
+                return f"⚠️ Проблема с изображением: {error_msg}", None, None
         
-        # ПРОВЕРКА СТРУКТУРЫ ОТВЕТА
-        if "choices" not in data or not data["choices"]:
-            print(f"❌ Некорректная структура ответа: {json.dumps(data, ensure_ascii=False)}")
-            return "❌ API вернул некорректный ответ. Попробуйте снова.", None, None
+        payload = build_image_payload(user_prompt, image_urls, chat_id, parent_id)
         
-        log_response(data)
+        print(f"⏳ Запрос с изображением... ({config.QWEN_PROXY_URL})")
+        for url in image_urls:
+            print(f"📎 URL: {url[:80]}...")
         
-        # ИЗВЛЕЧЕНИЕ КОНТЕНТА С FALLBACK
-        content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        data = post_chat(payload, read_timeout=360, on_delta=on_delta)
+        report_usage(on_usage, data)
         
-        # Если контент пустой
-        if not content or content.strip() == "":
-            print("⚠️ Получен пустой контент от API")
-            
-            # Проверяем finish_reason
-            finish_reason = data.get("choices", [{}])[0].get("finish_reason", "unknown")
-            print(f"   Finish reason: {finish_reason}")
-            
-            # Формируем понятное сообщение
-            if finish_reason == "content_filter":
-                content = "⚠️ Модель отказалась обрабатывать изображение (сработал контент-фильтр). Попробуйте другое изображение."
-            elif finish_reason == "length":
-                content = "⚠️ Ответ был обрезан из-за ограничения длины. Попробуйте упростить запрос."
-            else:
-                content = (
-                    "⚠️ Модель вернула пустой ответ. \n\n"
-                    "Используйте /new для сброса диалога."
-                )
-        
-        # ИЗВЛЕЧЕНИЕ МЕТАДАННЫХ ДЛЯ КОНТЕКСТА
-        new_chat_id = data.get("chatId") or data.get("chat_id")
-        new_parent_id = (
-            data.get("parentId") or 
-            data.get("parent_id") or 
-            data.get("response_id") or
-            data.get("id")
-        )
-        
-        print(f"✅ Ответ получен. Chat ID: {new_chat_id}, Parent ID: {new_parent_id}")
-        
-        return content, new_chat_id, new_parent_id
+        return parse_image_response(data)
         
+    except CircuitOpenError:
+        print("🔌 Прокси Qwen недоступен, запрос отклонён")
+        return BREAKER_OPEN_TEXT, None, None
     except requests.exceptions.Timeout:
         print("⏰ Превышено время ожидания")
         return "⏰ Превышено время ожидания ответа от API. Попробуйте снова.", None, None
@@ -155,58 +362,26 @@ def get_qwen_response_with_image(user_prompt, image_url, chat_id=None, parent_id
         return "❌ Произошла внутренняя ошибка. Попробуйте снова.", None, None
 
 
-def get_qwen_response_text_only(user_prompt, chat_id=None, parent_id=None):
-    """Qwen текст"""
+def get_qwen_response_text_only(user_prompt, chat_id=None, parent_id=None, on_delta=None, on_usage=None):
+    """Qwen текст (on_delta - потоковый режим; on_usage(prompt, completion, cached) - учёт токенов)"""
     try:
         # ВАЛИДАЦИЯ ВХОДНЫХ ДАННЫХ
         if not user_prompt or user_prompt.strip() == "":
             return "⚠️ Пустой запрос. Напишите что-нибудь!", None, None
         
-        payload = {
-            "message": user_prompt, 
-            "model": "qwen3-max"
-        }
-        
-        if chat_id:
-            payload["chatId"] = chat_id
-        if parent_id:
-            payload["parentId"] = parent_id
+        payload = build_text_payload(user_prompt, chat_id, parent_id)
             
         print(f"⏳ Запрос (текст)... ({config.QWEN_PROXY_URL})")
         print(f"   💬 Текст: {user_prompt[:60]}...")
 
-        response = requests.post(
-            f"{config.QWEN_PROXY_URL}/api/chat", 
-            json=payload, 
-            timeout=90
-        )
-        response.raise_for_status()
-        data = response.json()
-        
-        # ПРОВЕРКА СТРУКТУРЫ
-        if "choices" not in data or not data["choices"]:
-            print(f"❌ Некорректная структура ответа")
-            return "❌ API вернул некорректный ответ.", None, None
-        
-        log_response(data)
-        
-        # ИЗВЛЕЧЕНИЕ С ПРОВЕРКОЙ
-        content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-        
-        if not content or content.strip() == "":
-            print("⚠️ Получен пустой контент")
-            content = "⚠️ Модель вернула пустой ответ. Попробуйте переформулировать запрос."
-        
-        new_chat_id = data.get("chatId") or data.get("chat_id")
-        new_parent_id = (
-            data.get("parentId") or 
-            data.get("parent_id") or 
-            data.get("response_id") or
-            data.get("id")
-        )
+        data = post_chat(payload, read_timeout=90, on_delta=on_delta)
+        report_usage(on_usage, data)
         
-        return content, new_chat_id, new_parent_id
+        return parse_text_response(data)
         
+    except CircuitOpenError:
+        print("🔌 Прокси Qwen недоступен, запрос отклонён")
+        return BREAKER_OPEN_TEXT, None, None
     except requests.exceptions.Timeout:
         print("⏰ Превышено время ожидания")
         return "⏰ Таймаут. Попробуйте снова.", None, None
@@ -234,7 +409,7 @@ def test_qwen_connection():
         
         # Тест 2: Проверка API эндпоинта
         print("2️⃣ Проверяем доступность API...")
-        response = requests.get(f"{config.QWEN_PROXY_URL}/api", timeout=5)
+        response = session.get(f"{config.QWEN_PROXY_URL}/api", timeout=timeout(5))
         print(f"   Статус: {response.status_code}")
         print(f"   Ответ: {response.text[:100]}\n")
         
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+
+def cache_key(model, mode, prompt):
+    """Ключ кэша: хеш (модель, режим, итоговый промпт)"""
+    raw = json.dumps([model, mode, prompt], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Кэш ответов AI на запросы без контекста диалога (нет chatId/parentId и фото).
+
+    Память: LRU на max_entries записей. Диск (если задан disk_dir): по файлу
+    на ответ, общий объём не больше disk_max_bytes (вытесняются самые старые).
+    Записи старше ttl секунд считаются устаревшими в обоих уровнях.
+    Если каталог недоступен, кэш работает только в памяти; повреждённые
+    файлы (оборванная запись, чужой JSON) удаляются при чтении.
+    """
+    def __init__(self, max_entries=1000, ttl=7 * 24 * 3600, disk_dir=None, disk_max_bytes=50 * 1024 * 1024):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # ключ -> (ответ, время записи)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._disk_bytes = 0
+        if self.disk_dir:
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+                self._disk_bytes = sum(size for _, _, size in self._disk_files())
+            except OSError as e:
+                print(f"⚠️ Кэш ответов: каталог {self.disk_dir} недоступен ({e}), кэш только в памяти")
+                self.disk_dir = None
+
+    # --- Публичный интерфейс ---
+
+    def get(self, model, mode, prompt):
+        """Ответ из кэша или None"""
+        key = cache_key(model, mode, prompt)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[1] < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+
+        entry = self._disk_get(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, entry)
+        return entry[0]
+
+    def put(self, model, mode, prompt, response):
+        if not response:
+            return
+        key = cache_key(model, mode, prompt)
+        entry = (response, time.time())
+        with self._lock:
+            self._remember(key, entry)
+        self._disk_put(key, entry)
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def format_stats(self):
+        stats = self.get_stats()
+        return (
+            f"💾 Кэш ответов: {stats['entries']} зап., попаданий {stats['hits']} "
+            f"(+{stats['disk_hits']} с диска), промахов {stats['misses']}, "
+            f"hit rate {stats['hit_rate'] * 100:.0f}%"
+        )
+
+    # --- Память ---
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # --- Диск ---
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_files(self):
+        """(mtime, путь, размер) всех записей на диске"""
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path, stat.st_size))
+        return files
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except OSError:
+            return None
+        except ValueError:
+            data = None
+
+        if (not isinstance(data, dict) or not isinstance(data.get("response"), str)
+                or not isinstance(data.get("created"), (int, float))):
+            print(f"⚠️ Кэш ответов: повреждённый файл {path}, удаляю")
+            self._disk_remove(path)
+            return None
+        if now - data["created"] >= self.ttl:
+            self._disk_remove(path)
+            return None
+        return data["response"], data["created"]
+
+    def _disk_put(self, key, entry):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            payload = json.dumps({"response": entry[0], "created": entry[1]}, ensure_ascii=False)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._disk_bytes += os.path.getsize(path) - old_size
+                over_limit = self._disk_bytes > self.disk_max_bytes
+            if over_limit:
+                self._disk_evict()
+        except OSError as e:
+            print(f"⚠️ Кэш ответов: не удалось записать на диск: {e}")
+
+    def _disk_remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.unlink(path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_bytes -= size
+
+    def _disk_evict(self):
+        """Удаляет самые старые записи, пока объём не станет меньше 90% лимита"""
+        target = self.disk_max_bytes * 0.9
+        for _, path, _ in sorted(self._disk_files()):
+            with self._lock:
+                if self._disk_bytes <= target:
+                    return
+            self._disk_remove(path)
+
+
+def create_response_cache():
+    """Кэш по настройкам из config (None, если кэш выключен)"""
+    if not config.RESPONSE_CACHE_ENABLED:
+        return None
+    return ResponseCache(
+        max_entries=config.RESPONSE_CACHE_SIZE,
+        ttl=config.RESPONSE_CACHE_TTL,
+        disk_dir=config.RESPONSE_CACHE_DIR or None,
+        disk_max_bytes=config.RESPONSE_CACHE_DISK_MB * 1024 * 1024,
+    )
+
+
+response_cache = create_response_cache()
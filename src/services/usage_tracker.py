@@ -0,0 +1,265 @@
+import json
+import os
+import threading
+import time
+from datetime import date
+
+import config
+
+# Индексы в счётчике [prompt, completion, requests]
+PROMPT, COMPLETION, REQUESTS = 0, 1, 2
+# Индексы в счётчике кэша промптов [запросов, токенов промпта, из кэша,
+# запросов с попаданием, их суммарное время, суммарное время остальных]
+CALLS, PROMPT_TOKENS, CACHED_TOKENS, CACHE_HITS, HIT_SECONDS, MISS_SECONDS = range(6)
+# Расход самого бота: при резервировании - запрос, чей ответ не понадобился.
+# Не входит в лимит пользователей и в рейтинг /top (id пользователей VK > 0)
+SYSTEM_USER_ID = 0
+
+
+def shard_usage_file(path, index):
+    """'usage.json' -> 'usage.shard0.json' (у каждого шарда свой файл)"""
+    base, ext = os.path.splitext(path)
+    return f"{base}.shard{index}{ext}"
+
+
+def usage_from_response(data):
+    """usage из ответа в формате OpenAI (dict) -> (prompt_tokens, completion_tokens, cached_tokens)"""
+    usage = (data or {}).get("usage") or {}
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0), int(cached or 0)
+
+
+def parse_aggregate(aggregate):
+    """Агрегат из JSON: ключи - строки, id пользователей храним числами"""
+    return {int(user_id): models for user_id, models in (aggregate or {}).items()}
+
+
+def read_usage_file(path):
+    """Содержимое файла учёта (dict) или None"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Не удалось прочитать учёт токенов {path}: {e}")
+        return None
+
+
+class UsageTracker:
+    """
+    Учёт токенов по пользователям и моделям.
+
+    В памяти - два агрегата {user_id: {model: [prompt, completion, requests]}}:
+    за сегодня и за всё время. Раз в flush_interval секунд (если были изменения)
+    агрегаты сохраняются в JSON-файл path и подхватываются при перезапуске.
+    daily_budget - лимит токенов на пользователя в сутки (0 - без лимита).
+    peer_paths - файлы других шардов: /top складывает их с этим (по последнему сохранению).
+    """
+    def __init__(self, path=None, flush_interval=60, daily_budget=0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.daily_budget = daily_budget
+
+        self._lock = threading.Lock()
+        self._day = date.today().isoformat()
+        self._today = {}
+        self._total = {}
+        self._prompt_cache = {}   # (модель, режим) -> счётчик кэша промптов (только в памяти)
+        self._dirty = False
+        self._thread = None
+        self.peer_paths = []
+        self._load()
+
+    # --- Учёт ---
+
+    def record(self, user_id, model, prompt_tokens, completion_tokens):
+        with self._lock:
+            self._rollover()
+            for aggregate in (self._today, self._total):
+                counters = aggregate.setdefault(user_id, {}).setdefault(model, [0, 0, 0])
+                counters[PROMPT] += prompt_tokens
+                counters[COMPLETION] += completion_tokens
+                counters[REQUESTS] += 1
+            self._dirty = True
+        self._ensure_flusher()
+
+    def record_system(self, model, prompt_tokens, completion_tokens):
+        """Токены, потраченные ботом, а не пользователем (второй запрос при резервировании, чей ответ не понадобился)"""
+        self.record(SYSTEM_USER_ID, model, prompt_tokens, completion_tokens)
+
+    def record_prompt_cache(self, model, mode, prompt_tokens, cached_tokens, seconds):
+        """Сколько токенов промпта провайдер взял из кэша префикса и за сколько ответил"""
+        with self._lock:
+            counters = self._prompt_cache.setdefault((model, mode), [0, 0, 0, 0, 0.0, 0.0])
+            counters[CALLS] += 1
+            counters[PROMPT_TOKENS] += prompt_tokens
+            counters[CACHED_TOKENS] += cached_tokens
+            if cached_tokens:
+                counters[CACHE_HITS] += 1
+                counters[HIT_SECONDS] += seconds
+            else:
+                counters[MISS_SECONDS] += seconds
+
+    def format_prompt_cache(self):
+        with self._lock:
+            rows = sorted(self._prompt_cache.items())
+        if not rows:
+            return "🧩 Кэш промптов: запросов ещё не было"
+        lines = ["🧩 Кэш промптов (модель/режим: из кэша, среднее время с кэшем / без):"]
+        for (model, mode), c in rows:
+            share = c[CACHED_TOKENS] / c[PROMPT_TOKENS] if c[PROMPT_TOKENS] else 0.0
+            misses = c[CALLS] - c[CACHE_HITS]
+            hit_time = f"{c[HIT_SECONDS] / c[CACHE_HITS]:.1f}" if c[CACHE_HITS] else "-"
+            miss_time = f"{c[MISS_SECONDS] / misses:.1f}" if misses else "-"
+            lines.append(
+                f"{model}/{mode}: {c[CALLS]} запр., {share:.0%} токенов промпта, "
+                f"{hit_time} / {miss_time} сек"
+            )
+        return "\n".join(lines)
+
+    def used_today(self, user_id):
+        with self._lock:
+            self._rollover()
+            return sum(c[PROMPT] + c[COMPLETION] for c in self._today.get(user_id, {}).values())
+
+    def check_budget(self, user_id):
+        """(можно ли отправить запрос, израсходовано сегодня, лимит)"""
+        used = self.used_today(user_id)
+        if not self.daily_budget or user_id in config.ADMIN_IDS:
+            return True, used, self.daily_budget
+        return used < self.daily_budget, used, self.daily_budget
+
+    def _merged(self, today):
+        """{user_id: {модель: токенов}} этого процесса и сохранённых файлов других шардов"""
+        merged = {}
+
+        def add(aggregate):
+            for user_id, models in aggregate.items():
+                target = merged.setdefault(user_id, {})
+                for model, c in models.items():
+                    target[model] = target.get(model, 0) + c[PROMPT] + c[COMPLETION]
+
+        with self._lock:
+            self._rollover()
+            add(self._today if today else self._total)
+            day = self._day
+        for path in self.peer_paths:
+            data = read_usage_file(path) if os.path.exists(path) else None
+            if not data:
+                continue
+            if not today:
+                add(parse_aggregate(data.get("total")))
+            elif data.get("day") == day:
+                add(parse_aggregate(data.get("today")))
+        return merged
+
+    @staticmethod
+    def _rank(merged, limit):
+        rows = [
+            (user_id, sum(models.values()), models)
+            for user_id, models in merged.items()
+            if user_id != SYSTEM_USER_ID
+        ]
+        rows.sort(key=lambda row: row[1], reverse=True)
+        return rows[:limit]
+
+    def top(self, limit=10, today=True):
+        """Самые активные пользователи: [(user_id, токенов, {модель: токенов})]"""
+        return self._rank(self._merged(today), limit)
+
+    def format_top(self, limit=10, today=True):
+        merged = self._merged(today)
+        rows = self._rank(merged, limit)
+        title = "сегодня" if today else "за всё время"
+        if not rows:
+            lines = [f"📈 Расход токенов {title}: пока пусто"]
+        else:
+            lines = [f"📈 Расход токенов {title}:"]
+        for i, (user_id, tokens, models) in enumerate(rows, 1):
+            per_model = ", ".join(f"{model} {count}" for model, count in sorted(models.items(), key=lambda m: -m[1]))
+            lines.append(f"{i}. id{user_id} - {tokens} ({per_model})")
+        system = merged.get(SYSTEM_USER_ID)
+        if system:
+            lines.append(f"🔀 Запросы, чей ответ не понадобился (расход бота): {sum(system.values())}")
+        if self.peer_paths:
+            lines.append(
+                f"🧩 Другие шарды - по их последнему сохранению (раз в {self.flush_interval:.0f} сек), "
+                f"шарды на других машинах не учтены"
+            )
+        return "\n".join(lines)
+
+    # --- Хранение ---
+
+    def use_file(self, path, peer_paths=()):
+        """Переключает учёт на другой файл (и загружает его); peer_paths - файлы других шардов"""
+        with self._lock:
+            self.path = path
+            self.peer_paths = list(peer_paths)
+            self._today = {}
+            self._total = {}
+        self._load()
+
+    def _rollover(self):
+        """Новые сутки - обнуляем дневной агрегат (под self._lock)"""
+        today = date.today().isoformat()
+        if today != self._day:
+            self._day = today
+            self._today = {}
+            self._dirty = True
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        data = read_usage_file(self.path)
+        if data is None:
+            return
+
+        self._total = parse_aggregate(data.get("total"))
+        if data.get("day") == self._day:
+            self._today = parse_aggregate(data.get("today"))
+        print(f"📈 Учёт токенов загружен: {len(self._total)} польз.")
+
+    def flush(self):
+        """Сохраняет агрегаты на диск (если были изменения)"""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps(
+                {"day": self._day, "today": self._today, "total": self._total},
+                ensure_ascii=False, separators=(",", ":"),
+            )
+            self._dirty = False
+
+        tmp_path = f"{self.path}.tmp"
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️ Не удалось сохранить учёт токенов: {e}")
+            with self._lock:
+                self._dirty = True
+
+    def _ensure_flusher(self):
+        if not self.path or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_loop, name="usage-flush", daemon=True)
+                self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+usage_tracker = UsageTracker(
+    path=config.USAGE_FILE or None,
+    flush_interval=config.USAGE_FLUSH_INTERVAL,
+    daily_budget=config.DAILY_TOKEN_BUDGET,
+)
@@ -2,14 +2,14 @@ import os
 import traceback
 from PIL import Image, ImageDraw, ImageFont
 import config
-from src.utils.latex_parser import extract_latex_blocks
-from src.services.codecogs_client import render_latex_via_codecogs
+from src.utils.latex_parser import extract_latex_blocks, latex_to_unicode
+from src.services.latex_renderer import render_latex, render_formulas
 
 
 def convert_formula_to_rgba(img):
     """
     Конвертирует изображение формулы в RGBA для безопасной вставки.
-    Решает проблему с палитрой и прозрачностью от CodeCogs.
+    Решает проблему с палитрой и прозрачностью (CodeCogs отдаёт PNG с палитрой).
     """
     try:
         # Если изображение в режиме Palette с прозрачностью
@@ -67,8 +67,11 @@ def paste_formula_with_background(base_img, formula_img, position, bg_color='whi
             print(f"❌ Не удалось вставить формулу даже с fallback")
 
 
-def create_full_answer_image(text, output_path):
-    """Создание большого изображения с полным ответом и формулами"""
+def create_full_answer_image(text, output):
+    """
+    Создание большого изображения с полным ответом и формулами.
+    output - путь или файловый объект (например, BytesIO)
+    """
     try:
         # Параметры изображения
         width = 1200
@@ -89,17 +92,15 @@ def create_full_answer_image(text, output_path):
         
         latex_blocks = extract_latex_blocks(text)
         
-        # Подготовка рендерим все формулы
+        # Подготовка рендерим все формулы (параллельно, с общим дедлайном)
         rendered_formulas = {}
-        for block in latex_blocks:
-            img = render_latex_via_codecogs(block['latex'], dpi=200)
-            if img:
-                # Сразу конвертируем в RGBA
-                img_converted = convert_formula_to_rgba(img)
-                rendered_formulas[block['start']] = img_converted
-                # Закрываем оригинальное изображение
-                if img != img_converted:
-                    img.close()
+        for start, img in render_formulas(latex_blocks, dpi=200).items():
+            # Сразу конвертируем в RGBA
+            img_converted = convert_formula_to_rgba(img)
+            rendered_formulas[start] = img_converted
+            # Закрываем оригинальное изображение
+            if img != img_converted:
+                img.close()
         
         lines = []
         current_pos = 0
@@ -112,9 +113,11 @@ def create_full_answer_image(text, output_path):
                 if line.strip():
                     lines.append(('text', line.strip()))
             
-            # Формула
+            # Формула (не отрисовалась - выводим текстом)
             if block['start'] in rendered_formulas:
                 lines.append(('formula', rendered_formulas[block['start']]))
+            elif latex_to_unicode(block['full']).strip():
+                lines.append(('text', latex_to_unicode(block['full']).strip()))
             
             current_pos = block['end']
         
@@ -191,7 +194,7 @@ def create_full_answer_image(text, output_path):
                 y += formula_img.height + 20
         
         # Сохраняем результат
-        img.save(output_path, 'PNG', quality=95)
+        img.save(output, 'PNG', quality=95)
         
         # Закрываем все изображения формул
         for formula_img in rendered_formulas.values():
@@ -218,7 +221,7 @@ def create_formula_preview(latex_text, output_path, size=(800, 200)):
         size: Размер изображения (ширина, высота)
     """
     try:
-        img = render_latex_via_codecogs(latex_text, dpi=300)
+        img = render_latex(latex_text, dpi=300)
         if not img:
             print("❌ Не удалось отрендерить формулу")
             return False
@@ -1,103 +1,386 @@
 # src/utils/latex_parser.py
 import re
+from functools import lru_cache
+
+_NEWLINES_RE = re.compile(r'\s*\n\s*')
+
+def normalize_latex(latex):
+    """
+    Формула для рендеринга: без $ по краям и лишних пробелов,
+    с \\displaystyle для дробей (иначе они рендерятся мелко).
+    """
+    latex = re.sub(r'\s+', ' ', latex.strip().strip('$').strip())
+    if r'\frac' in latex and r'\displaystyle' not in latex:
+        latex = r'\displaystyle ' + latex
+    return latex
+
+
+# Типы фрагментов текста
+TEXT, INLINE, DISPLAY = 'text', 'inline', 'display'
+
+# Все разделители одним выражением - разбор идёт за один проход finditer.
+# \$ и \\ - экранирование (обычный доллар и обратный слэш), а не разделители.
+# Исключение - \\[...\\] и \\(...\\) (удвоенные слэши, как в недораскрытом JSON):
+# прежний разбор находил в них формулы, поэтому и здесь это разделители.
+# Содержимое формулы не может содержать открывающий разделитель того же вида,
+# поэтому разделитель без пары не заставляет пересматривать остаток текста.
+# Шаблоны "развёрнуты" ([^\\]* между спецсимволами) - так sre не перебирает по символу.
+_TOKEN_RE = re.compile(r"""
+    \\\\\[ (?P<display_escaped> [^\\]* (?: \\(?!\\?[\[\]]) [^\\]* )* ) \\\\?\]
+  | \\\\\( (?P<inline_escaped> [^\\]* (?: \\(?!\\?[()]) [^\\]* )* ) \\\\?\)
+  | \\[\\$]
+  | \\\[ (?P<display> [^\\]* (?: (?:\\\\|\\(?![\[\]\\])) [^\\]* )* ) \\\]
+  | \$\$ (?P<display_dollar> [^$\\]* (?: (?:\\.|\$(?!\$)) [^$\\]* )* ) \$\$
+  | \\\( (?P<inline> [^\\]* (?: (?:\\\\|\\(?![()\\])) [^\\]* )* ) \\\)
+  | \$ (?P<inline_dollar> (?:[^$\\]|\\.) [^$\\]* (?: \\. [^$\\]* )* ) \$
+""", re.DOTALL | re.VERBOSE)
+
+_GROUP_KINDS = {
+    'display_escaped': DISPLAY,
+    'inline_escaped': INLINE,
+    'display': DISPLAY,
+    'display_dollar': DISPLAY,
+    'inline': INLINE,
+    'inline_dollar': INLINE,
+}
+
+
+def tokenize_latex(text):
+    """
+    Разбивает текст на фрагменты за один проход.
+
+    Разделители: \\[...\\] и $$...$$ - выносные, \\(...\\) и $...$ - строчные.
+    \\$ - обычный знак доллара, \\\\ - обратный слэш, но \\\\[...\\\\] и \\\\(...\\\\)
+    (удвоенные слэши) - тоже формулы, как при прежнем разборе.
+    Разделитель без пары считается текстом.
+    Возвращает список кортежей (тип, начало, конец, начало содержимого, конец содержимого),
+    покрывающий весь текст по порядку; тип - TEXT, INLINE или DISPLAY.
+    """
+    spans = []
+    append = spans.append
+    text_start = 0
+
+    for match in _TOKEN_RE.finditer(text):
+        group = match.lastgroup
+        if group is None:
+            continue  # экранирование - часть текста
+        start, end = match.span()
+        if start > text_start:
+            append((TEXT, text_start, start, text_start, start))
+        content_start, content_end = match.span(group)
+        append((_GROUP_KINDS[group], start, end, content_start, content_end))
+        text_start = end
+
+    if text_start < len(text):
+        append((TEXT, text_start, len(text), text_start, len(text)))
+    return spans
+
 
 def extract_latex_blocks(text):
-    """Извлечение LaTeX блоков для рендеринга"""
+    """Извлечение LaTeX блоков для рендеринга (обёртка над tokenize_latex)"""
     blocks = []
-    
-    # 1. Находим все DISPLAY блоки
-    patterns_display = [
-        (r'\\\[(.*?)\\\]', 'display'), # \[ ... \]
-        (r'\$\$(.*?)\$\$', 'display'), # $$...$$
-    ]
-    
-    for pattern, mode in patterns_display:
-        for match in re.finditer(pattern, text, re.DOTALL):
-            latex = match.group(1).strip()
-            latex = re.sub(r'\s*\n\s*', ' ', latex) # Очистка от \n
-            
-            blocks.append({
-                'latex': latex,
-                'mode': mode,
-                'start': match.start(),
-                'end': match.end(),
-                'full': match.group(0)
-            })
-    
-    # 2. Находим ВСЕ INLINE блоки
-    patterns_inline = [
-        (r'\\\((.*?)\\\)', 'inline'),
-        (r'\$([^\$]+)\$', 'inline'),
-    ]
-    
-    for pattern, mode in patterns_inline:
-        for match in re.finditer(pattern, text, re.DOTALL):
-            latex = match.group(1).strip()
-            
-            latex = re.sub(r'\s*\n\s*', ' ', latex) # Очистка от \n
-            blocks.append({
-                'latex': latex,
-                'mode': mode,
-                'start': match.start(),
-                'end': match.end(),
-                'full': match.group(0)
-            })
-
-    # 3. Сортируем все найденные блоки по их начальной позиции
-    sorted_blocks = sorted(blocks, key=lambda x: x['start'])
-    
-    # 4. Фильтруем наложения
-    if not sorted_blocks:
-        return []
-        
-    final_blocks = []
-    last_end = -1
-    
-    for block in sorted_blocks:
-        if block['start'] >= last_end:
-            final_blocks.append(block)
-            last_end = block['end']
-    
-    return final_blocks
+    for kind, start, end, content_start, content_end in tokenize_latex(text):
+        if kind is TEXT:
+            continue
+        latex = text[content_start:content_end].strip()
+        if '\n' in latex:
+            latex = _NEWLINES_RE.sub(' ', latex)  # Очистка от \n
+        blocks.append({
+            'latex': latex,
+            'mode': kind,
+            'start': start,
+            'end': end,
+            'full': text[start:end]
+        })
+    return blocks
+
+
+# --- LaTeX -> Unicode (текстовые ответы) ---
+
+# Команды -> символы. Имя команды читается целиком ([a-zA-Z]+), поэтому
+# \le не срабатывает внутри \left, а \in - внутри \infty.
+SYMBOLS = {
+    # Греческие буквы
+    'alpha': 'α', 'beta': 'β', 'gamma': 'γ', 'delta': 'δ', 'epsilon': 'ε', 'varepsilon': 'ε',
+    'zeta': 'ζ', 'eta': 'η', 'theta': 'θ', 'vartheta': 'ϑ', 'iota': 'ι', 'kappa': 'κ',
+    'lambda': 'λ', 'mu': 'μ', 'nu': 'ν', 'xi': 'ξ', 'omicron': 'ο', 'pi': 'π', 'varpi': 'ϖ',
+    'rho': 'ρ', 'varrho': 'ϱ', 'sigma': 'σ', 'varsigma': 'ς', 'tau': 'τ', 'upsilon': 'υ',
+    'phi': 'φ', 'varphi': 'φ', 'chi': 'χ', 'psi': 'ψ', 'omega': 'ω',
+    'Gamma': 'Γ', 'Delta': 'Δ', 'Theta': 'Θ', 'Lambda': 'Λ', 'Xi': 'Ξ', 'Pi': 'Π',
+    'Sigma': 'Σ', 'Upsilon': 'Υ', 'Phi': 'Φ', 'Psi': 'Ψ', 'Omega': 'Ω',
+    # Операции и отношения
+    'times': '×', 'cdot': '·', 'div': '÷', 'pm': '±', 'mp': '∓', 'ast': '∗', 'star': '⋆',
+    'circ': '∘', 'bullet': '•', 'oplus': '⊕', 'otimes': '⊗',
+    'le': '≤', 'leq': '≤', 'leqslant': '≤', 'ge': '≥', 'geq': '≥', 'geqslant': '≥',
+    'ne': '≠', 'neq': '≠', 'lt': '<', 'gt': '>', 'll': '≪', 'gg': '≫',
+    'approx': '≈', 'equiv': '≡', 'sim': '∼', 'simeq': '≃', 'cong': '≅', 'propto': '∝',
+    'perp': '⊥', 'parallel': '∥', 'mid': '∣', 'angle': '∠', 'triangle': '△', 'degree': '°',
+    # Стрелки и логика
+    'rightarrow': '→', 'to': '→', 'leftarrow': '←', 'gets': '←', 'leftrightarrow': '↔',
+    'Rightarrow': '⇒', 'implies': '⇒', 'Leftarrow': '⇐', 'Leftrightarrow': '⇔', 'iff': '⇔',
+    'longrightarrow': '⟶', 'Longrightarrow': '⟹', 'longleftrightarrow': '⟷', 'Longleftrightarrow': '⟺',
+    'mapsto': '↦', 'uparrow': '↑', 'downarrow': '↓',
+    'forall': '∀', 'exists': '∃', 'nexists': '∄', 'neg': '¬', 'lnot': '¬',
+    'land': '∧', 'wedge': '∧', 'lor': '∨', 'vee': '∨', 'therefore': '∴', 'because': '∵',
+    # Множества
+    'in': '∈', 'notin': '∉', 'ni': '∋', 'subset': '⊂', 'subseteq': '⊆', 'supset': '⊃',
+    'supseteq': '⊇', 'cup': '∪', 'cap': '∩', 'setminus': '∖', 'emptyset': '∅', 'varnothing': '∅',
+    # Анализ
+    'sum': 'Σ', 'prod': 'Π', 'int': '∫', 'iint': '∬', 'iiint': '∭', 'oint': '∮',
+    'infty': '∞', 'partial': '∂', 'nabla': '∇', 'prime': '′',
+    'hbar': 'ℏ', 'ell': 'ℓ', 'aleph': 'ℵ', 'Re': 'ℜ', 'Im': 'ℑ',
+    # Скобки и многоточия
+    'langle': '⟨', 'rangle': '⟩', 'lfloor': '⌊', 'rfloor': '⌋', 'lceil': '⌈', 'rceil': '⌉',
+    'lbrace': '{', 'rbrace': '}', 'vert': '|', 'Vert': '‖',
+    'ldots': '…', 'dots': '…', 'cdots': '⋯', 'vdots': '⋮', 'ddots': '⋱',
+    # Пробелы и оформление
+    'quad': '  ', 'qquad': '    ', 'displaystyle': '', 'limits': '',
+}
+
+# Функции пишутся прямым шрифтом: \sin x -> sin x
+SYMBOLS.update((name, name) for name in (
+    'sin', 'cos', 'tan', 'cot', 'sec', 'csc', 'arcsin', 'arccos', 'arctan',
+    'sinh', 'cosh', 'tanh', 'coth', 'ln', 'log', 'lg', 'exp', 'lim', 'max', 'min',
+    'sup', 'inf', 'det', 'gcd', 'deg', 'arg', 'ker', 'dim', 'mod',
+))
+SYMBOLS['tg'], SYMBOLS['ctg'], SYMBOLS['bmod'] = 'tg', 'ctg', 'mod'
+
+# Экранированные символы: \{ -> {, \, -> пробел; \[ \] \( \) - разделители без пары
+ESCAPES = {
+    '{': '{', '}': '}', '%': '%', '$': '$', '&': '&', '#': '#', '_': '_', '|': '‖',
+    ',': ' ', ';': ' ', ':': ' ', ' ': ' ', '!': '',
+    '[': '', ']': '', '(': '', ')': '',
+}
+
+SUPERSCRIPTS = dict(zip(
+    '0123456789+-−=()abcdefghijklmnoprstuvwxyzABDEGHIJKLMNOPRTUVWαβγδθφχ∘′',
+    '⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻⁻⁼⁽⁾ᵃᵇᶜᵈᵉᶠᵍʰⁱʲᵏˡᵐⁿᵒᵖʳˢᵗᵘᵛʷˣʸᶻᴬᴮᴰᴱᴳᴴᴵᴶᴷᴸᴹᴺᴼᴾᴿᵀᵁⱽᵂᵅᵝᵞᵟᶿᵠᵡ°′',
+))
+
+SUBSCRIPTS = dict(zip(
+    '0123456789+-−=()aehijklmnoprstuvxβγρφχ',
+    '₀₁₂₃₄₅₆₇₈₉₊₋₋₌₍₎ₐₑₕᵢⱼₖₗₘₙₒₚᵣₛₜᵤᵥₓᵦᵧᵨᵩᵪ',
+))
+
+DOUBLE_STRUCK = {'N': 'ℕ', 'Z': 'ℤ', 'Q': 'ℚ', 'R': 'ℝ', 'C': 'ℂ'}
+
+# Команды, от которых остаётся только аргумент
+_STYLE_COMMANDS = frozenset((
+    'text', 'textrm', 'textbf', 'textit', 'mathrm', 'mathbf', 'mathit', 'mathsf',
+    'mathcal', 'boldsymbol', 'operatorname', 'overline', 'vec', 'hat', 'bar',
+))
+# Размерные скобки: \left( -> (, \left. -> ничего
+_SIZE_COMMANDS = frozenset(('left', 'right', 'big', 'Big', 'bigg', 'Bigg', 'bigl', 'bigr', 'Bigl', 'Bigr'))
+_ROOTS = {'2': '√', '3': '∛', '4': '∜'}
+
+# Всё, что требует обработки: команды, экранирование, $$, индексы после символа.
+# Обычный текст между совпадениями копируется срезом, без посимвольного цикла.
+# Каждая ветка начинается с одного из символов \ $ ^ _ (символ перед индексом
+# проверяется после него), поэтому sre пропускает обычный текст, не пробуя ветки.
+_LATEX_RE = re.compile(r"""
+    \\(?P<command>[a-zA-Z]+)
+  | \\(?P<escape>.)
+  | (?P<dollars>\$\$)
+  | (?P<script>[\^_])(?<=[^\s^_][\^_])
+""", re.DOTALL | re.VERBOSE)
+# Скобки и экранирование, которое их касается (\{ \} - не скобки, \\{ - скобка)
+_BRACE_RE = re.compile(r'\\[\\{}]|[{}]')
+_COMMAND_NAME_RE = re.compile(r'\\[a-zA-Z]+')
+# Индекс без фигурных скобок: число или одна буква (x^2, a_n; my_var - не индекс).
+# Несколько букв подряд индексом не считаются: x^ab остаётся как есть
+# (прежний перевод склеивал в "xab", теряя степень)
+_SCRIPT_ATOM_RE = re.compile(r'\d+|[a-zA-Z](?![a-zA-Z])|\\[a-zA-Z]+')
+_SPACES_RE = re.compile(r'\s+')
+_MAX_DEPTH = 20
+
+
+def _brace_pairs(text):
+    """Позиции парных фигурных скобок {открывающая: закрывающая} за один проход"""
+    pairs = {}
+    stack = []
+    for match in _BRACE_RE.finditer(text):
+        char = match.group()
+        if char == '{':
+            stack.append(match.start())
+        elif char == '}' and stack:
+            pairs[stack.pop()] = match.start()
+    return pairs
+
+
+def _group(text, pos, pairs):
+    """Содержимое {...} с учётом вложенности -> (содержимое, конец) или None"""
+    close = pairs.get(pos)
+    if close is None:
+        return None
+    return text[pos + 1:close], close + 1
+
+
+def _argument(text, pos, pairs):
+    """Аргумент команды: {...}, \\команда или один символ -> (аргумент, конец) или None"""
+    while pos < len(text) and text[pos] == ' ':
+        pos += 1
+    if pos >= len(text):
+        return None
+    if text[pos] == '{':
+        return _group(text, pos, pairs)
+    if text[pos] == '\\':
+        match = _COMMAND_NAME_RE.match(text, pos)
+        if match is None:
+            return None
+        return match.group(), match.end()
+    if text[pos] in '}^_':
+        return None
+    return text[pos], pos + 1
+
+
+def _script(content, table, marker):
+    """Индекс символами Unicode (x², aₙ), если все символы есть в таблице, иначе ^(...)"""
+    converted = table.get(content)
+    if converted is not None:
+        return converted  # один символ (x², aₙ) - самый частый случай
+    content = _SPACES_RE.sub('', content)
+    converted = [table.get(char) for char in content]
+    if content and None not in converted:
+        return ''.join(converted)
+    return f"{marker}{content}" if len(content) == 1 else f"{marker}({content})"
+
+
+def _atom(text):
+    """Скобки вокруг составного выражения: √2, но √(x+1)"""
+    return text if len(text) == 1 or text.isalnum() else f"({text})"
+
+
+def _command(name, text, pos, pairs, depth):
+    """Команда \\name (не из SYMBOLS) -> (замена, позиция после аргументов)"""
+    if name in _SIZE_COMMANDS:
+        if text.startswith('.', pos):
+            pos += 1
+        return '', pos
+
+    if name in ('frac', 'dfrac', 'tfrac', 'cfrac', 'binom'):
+        numerator = _argument(text, pos, pairs)
+        denominator = numerator and _argument(text, numerator[1], pairs)
+        if denominator:
+            top = _convert(numerator[0], depth + 1)
+            bottom = _convert(denominator[0], depth + 1)
+            if name == 'binom':
+                return f"C({top}, {bottom})", denominator[1]
+            return f"({top})/({bottom})", denominator[1]
+
+    elif name == 'sqrt':
+        degree = '2'
+        if text.startswith('[', pos):
+            close = text.find(']', pos)
+            if close != -1:
+                degree = text[pos + 1:close].strip()
+                pos = close + 1
+        argument = _argument(text, pos, pairs)
+        if argument:
+            root = _ROOTS.get(degree) or _script(degree, SUPERSCRIPTS, '^') + '√'
+            return root + _atom(_convert(argument[0], depth + 1)), argument[1]
+
+    elif name == 'mathbb':
+        argument = _argument(text, pos, pairs)
+        if argument:
+            return DOUBLE_STRUCK.get(argument[0], argument[0]), argument[1]
+
+    elif name in _STYLE_COMMANDS:
+        argument = _argument(text, pos, pairs)
+        if argument:
+            return _convert(argument[0], depth + 1), argument[1]
+
+    return '\\' + name, pos  # неизвестная команда остаётся как есть
+
+
+def _convert(text, depth=0):
+    """Замена команд, индексов и дробей в одном фрагменте (один проход по тексту)"""
+    search = _LATEX_RE.search
+    match = search(text)
+    if match is None or depth > _MAX_DEPTH:
+        return text
+    parts = []
+    append = parts.append
+    pos = 0
+    pairs = None    # парные скобки ищутся, только когда понадобятся
+
+    while match is not None:
+        append(text[pos:match.start()])
+        pos = match.end()
+        group = match.lastgroup
+
+        if group == 'command':
+            name = match.group(group)
+            replacement = SYMBOLS.get(name)
+            if replacement is None:
+                if pairs is None:
+                    pairs = _brace_pairs(text)
+                replacement, pos = _command(name, text, pos, pairs, depth)
+            append(replacement)
+        elif group == 'escape':
+            append(ESCAPES.get(match.group(group), match.group()))
+        elif group == 'script':
+            marker = match.group()
+            if text.startswith('{', pos):
+                if pairs is None:
+                    pairs = _brace_pairs(text)
+                argument = _group(text, pos, pairs)
+                content = argument and _convert(argument[0], depth + 1)
+            else:
+                atom = _SCRIPT_ATOM_RE.match(text, pos)
+                argument = atom and (atom.group(), atom.end())
+                content = atom and atom.group()
+                if content and content[0] == '\\':
+                    content = SYMBOLS.get(content[1:], content)
+            if argument:
+                table = SUPERSCRIPTS if marker == '^' else SUBSCRIPTS
+                append(_script(content, table, marker))
+                pos = argument[1]
+            else:
+                append(marker)
+        # $$ без пары просто убираем
+
+        match = search(text, pos)
+
+    append(text[pos:])
+    return ''.join(parts)
+
+
+@lru_cache(maxsize=4096)
+def _formula_to_unicode(latex):
+    """Формулы в ответах часто повторяются (и при стриминге перерисовываются заново)"""
+    return _convert(latex)
+
+
+# Целиком кэшируются только короткие тексты (куски PDF и картинок, короткие ответы):
+# длинный ответ почти не повторяется, а в кэше держал бы и ключ, и результат
+_CACHED_TEXT_CHARS = 4096
 
 
 def latex_to_unicode(text):
-    """LaTeX → Unicode (для ТЕКСТА, не PDF)"""
-    
-    text = re.sub(r'\\\[|\\\]|\$\$', '', text) # Display
-    text = re.sub(r'\\\((.*?)\\\)', r'\1', text, flags=re.DOTALL)
-    text = re.sub(r'\$([^\$]+)\$', r'\1', text, flags=re.DOTALL) # $...$
-    
-    text = re.sub(r'\\frac\{([^}]+)\}\{([^}]+)\}', r'(\1)/(\2)', text)
-    
-    superscripts = {'0': '⁰', '1': '¹', '2': '²', '3': '³', '4': '⁴', '5': '⁵',
-                    '6': '⁶', '7': '⁷', '8': '⁸', '9': '⁹', 'n': 'ⁿ', 'x': 'ˣ',
-                    'm': 'ᵐ', 'k': 'ᵏ', '+': '⁺', '-': '⁻', 'i': 'ⁱ'}
-    
-    subscripts = {'0': '₀', '1': '₁', '2': '₂', '3': '₃', '4': '₄', '5': '₅',
-                  '6': '₆', '7': '₇', '8': '₈', '9': '₉', 'n': 'ₙ', 'm': 'ₘ'}
-    
-    def replace_power(m):
-        base, exp = m.groups()
-        return base + ''.join(superscripts.get(c, c) for c in exp)
-    
-    def replace_sub(m):
-        base, sub = m.groups()
-        return base + ''.join(subscripts.get(c, c) for c in sub)
-    
-    text = re.sub(r'(\w+)\^(\w+)', replace_power, text)
-    text = re.sub(r'(\w+)\^\{([^}]+)\}', replace_power, text)
-    text = re.sub(r'(\w+)_(\w+)', replace_sub, text)
-    text = re.sub(r'(\w+)_\{([^}]+)\}', replace_sub, text)
-    
-    replacements = {
-        r'\times': '×', r'\cdot': '·', r'\le': '≤', r'\ge': '≥',
-        r'\ne': '≠', r'\approx': '≈', r'\sum': 'Σ', r'\prod': 'Π',
-        r'\infty': '∞', r'\Rightarrow': '⇒', r'\rightarrow': '→',
-        r'\quad': '  ',
-    }
-    
-    for latex, uni in replacements.items():
-        text = text.replace(latex, uni)
-    
-    return text
\ No newline at end of file
+    """
+    LaTeX → Unicode (для ТЕКСТА, не PDF).
+    Разделители формул убираются, команды заменяются символами (\\alpha → α,
+    \\le → ≤), дроби и корни пишутся в строку, индексы - символами Unicode (x², aₙ).
+    Неизвестные команды остаются как есть.
+    """
+    if len(text) <= _CACHED_TEXT_CHARS:
+        return _cached_to_unicode(text)
+    return _to_unicode(text)
+
+
+@lru_cache(maxsize=512)
+def _cached_to_unicode(text):
+    return _to_unicode(text)
+
+
+def _to_unicode(text):
+    if '\\' not in text and '$' not in text and '^' not in text and '_' not in text:
+        return text
+
+    parts = []
+    for kind, start, end, content_start, content_end in tokenize_latex(text):
+        if kind is TEXT:
+            parts.append(_convert(text[start:end]))
+        else:
+            parts.append(_formula_to_unicode(text[content_start:content_end]))
+    return ''.join(parts)
@@ -1,12 +1,10 @@
+import io
 import os
 import re
-import time
-import tempfile
 import traceback
-from PIL import Image
 import config
 from src.utils.latex_parser import extract_latex_blocks, latex_to_unicode
-from src.services.codecogs_client import render_latex_via_codecogs
+from src.services.latex_renderer import render_formulas
 
 try:
     from reportlab.lib.pagesizes import A4
@@ -51,17 +49,15 @@ except ImportError:
     print("⚠️ reportlab не установлен. Функционал PDF будет недоступен.")
 
 
-def create_pdf_with_formulas(text, output_path):
-    """PDF с формулами"""
+def create_pdf_with_formulas(text, output):
+    """PDF с формулами. output - путь или файловый объект (например, BytesIO)"""
     if not REPORTLAB_AVAILABLE:
         print("❌ Попытка создать PDF без reportlab")
         return False
     
-    temp_images = []
-    
     try:
         doc = SimpleDocTemplate(
-            output_path, 
+            output, 
             pagesize=A4,
             leftMargin=2*cm, 
             rightMargin=2*cm,
@@ -95,21 +91,13 @@ def create_pdf_with_formulas(text, output_path):
         latex_blocks = extract_latex_blocks(text)
         rendered_formulas = {}
         
-        # Рендерим все формулы и сохраняем во временные файлы
-        for block in latex_blocks:
-            img = render_latex_via_codecogs(block['latex'], dpi=200)
-            if img:
-                # Создаём временный файл
-                tmp = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-                tmp_path = tmp.name
-                tmp.close()
-                
-                # Сохраняем изображение
-                img.save(tmp_path, 'PNG')
-                img.close()
-                
-                temp_images.append(tmp_path)
-                rendered_formulas[block['start']] = tmp_path
+        # Рендерим все формулы в память (PNG в BytesIO + размеры), параллельно с общим дедлайном
+        for start, img in render_formulas(latex_blocks, dpi=200).items():
+            buffer = io.BytesIO()
+            img.save(buffer, 'PNG')
+            buffer.seek(0)
+            rendered_formulas[start] = (buffer, img.width, img.height)
+            img.close()
         
         # Строим документ
         if rendered_formulas:
@@ -129,12 +117,9 @@ def create_pdf_with_formulas(text, output_path):
                 
                 # Формула
                 if block['start'] in rendered_formulas:
-                    img_path = rendered_formulas[block['start']]
-                    
-                    # Открываем изображение ТОЛЬКО для получения размеров
-                    with Image.open(img_path) as img_temp:
-                        img_width_pt = img_temp.width * 0.75
-                        img_height_pt = img_temp.height * 0.75
+                    img_buffer, img_width, img_height = rendered_formulas[block['start']]
+                    img_width_pt = img_width * 0.75
+                    img_height_pt = img_height * 0.75
                     
                     # под A4
                     max_width = 16*cm
@@ -143,9 +128,14 @@ def create_pdf_with_formulas(text, output_path):
                         img_width_pt *= ratio
                         img_height_pt *= ratio
                     
-                    # ReportLab сам откроет файл и закроет после build
-                    story.append(RLImage(img_path, width=img_width_pt, height=img_height_pt))
+                    # ReportLab читает PNG прямо из буфера
+                    story.append(RLImage(img_buffer, width=img_width_pt, height=img_height_pt))
                     story.append(Spacer(1, 0.3*cm))
+                else:
+                    # Формула не отрисовалась - выводим текстом
+                    formula_text = latex_to_unicode(block['full']).strip()
+                    formula_text = formula_text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+                    story.append(Paragraph(formula_text, normal_style))
                 
                 current_pos = block['end']
             
@@ -172,41 +162,9 @@ def create_pdf_with_formulas(text, output_path):
         # Генерируем PDF
         doc.build(story)
         
-        # Ждём, пока ReportLab освободит файлы
-        time.sleep(0.5)
-        
-        # Удаляем временные файлы
-        cleanup_temp_files(temp_images)
-        
         return True
         
     except Exception as e:
         print(f"❌ Ошибка PDF: {e}")
         traceback.print_exc()
-        
-        # Пытаемся удалить временные файлы даже при ошибке
-        cleanup_temp_files(temp_images)
-        
         return False
-
-
-def cleanup_temp_files(file_paths, max_retries=3):
-    """
-    Удаление временных файлов с повторными попытками.
-    """
-    for tmp_path in file_paths:
-        if not os.path.exists(tmp_path):
-            continue
-            
-        for attempt in range(max_retries):
-            try:
-                os.unlink(tmp_path)
-                break  # Успешно удалено
-            except PermissionError:
-                if attempt < max_retries - 1:
-                    time.sleep(0.2 * (attempt + 1))  # Увеличиваем задержку
-                else:
-                    print(f"⚠️ Не удалось удалить {os.path.basename(tmp_path)} после {max_retries} попыток")
-            except Exception as e:
-                print(f"⚠️ Ошибка удаления {os.path.basename(tmp_path)}: {e}")
-                break
\ No newline at end of file
@@ -1,6 +1,13 @@
 import re
 from src.utils.latex_parser import latex_to_unicode
 
+# Так начинаются сообщения об ошибках от клиентов AI (их не кэшируем)
+ERROR_PREFIXES = ("❌", "⏰", "⚠️", "🔌")
+
+def is_error_response(text):
+    """Ответ клиента AI - это сообщение об ошибке?"""
+    return text.lstrip().startswith(ERROR_PREFIXES)
+
 def split_message(text, max_length=4000):
     """Разбивка сообщений"""
     if len(text) <= max_length:
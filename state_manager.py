@@ -1,3 +1,6 @@
+from src.services.conversation_store import create_conversation_store
+
+
 class StateManager:
     
     # Управляет состоянием пользователей, заменяя глобальные словари.
@@ -6,6 +9,8 @@ class StateManager:
         self.user_chats = {}
         self.user_format_preference = {}
         self.user_processing_mode = {}
+        # История диалога для моделей OpenRouter
+        self.conversations = create_conversation_store()
 
     # --- Модель ---
     def get_user_model(self, user_id):
@@ -25,6 +30,15 @@ class StateManager:
 
     def clear_user_chat(self, user_id):
         self.user_chats.pop(user_id, None)
+        self.conversations.clear(user_id)
+
+    # --- История (для OpenRouter) ---
+    def get_history(self, user_id):
+        """Прошлые реплики диалога в формате messages"""
+        return self.conversations.get_messages(user_id)
+
+    def add_history_turn(self, user_id, prompt, response):
+        self.conversations.add_turn(user_id, prompt, response)
 
     # --- Формат вывода (/math) ---
     def get_format(self, user_id):
@@ -0,0 +1,9 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.py требует эти переменные при импорте
+os.environ.setdefault("VK_TOKEN", "test")
+os.environ.setdefault("GROUP_ID", "1")
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
@@ -0,0 +1,52 @@
+import time
+
+from src.bot.coalescer import MessageCoalescer, create_intake
+
+
+def collect():
+    events = []
+    return events, lambda user_id, msg: events.append((user_id, msg["text"]))
+
+
+def test_disabled_window_passes_through():
+    events, submit = collect()
+    intake = create_intake(submit, 0)
+    intake(1, {"text": "a"})
+    intake(1, {"text": "b"})
+    assert events == [(1, "a"), (1, "b")]
+
+
+def test_messages_are_merged_after_window():
+    events, submit = collect()
+    coalescer = MessageCoalescer(submit, window=0.05)
+    coalescer.start()
+    coalescer.add(1, {"text": "a"})
+    coalescer.add(1, {"text": "b"})
+    coalescer.add(2, {"text": "c"})
+    time.sleep(0.3)
+    assert sorted(events) == [(1, "a\nb"), (2, "c")]
+
+
+def test_command_goes_after_preceding_messages():
+    events, submit = collect()
+    intake = create_intake(submit, 10)
+    intake(1, {"text": "a"})
+    intake(1, {"text": "/status"})
+    assert events == [(1, "a"), (1, "/status")]
+
+
+def test_command_never_overtakes_timer_flush():
+    # Таймер уже забрал пачку и отдаёт её медленно - команда должна подождать
+    events = []
+
+    def submit(user_id, msg):
+        if msg["text"] == "a":
+            time.sleep(0.2)
+        events.append(msg["text"])
+
+    intake = create_intake(submit, 0.01)
+    intake(1, {"text": "a"})
+    time.sleep(0.05)
+    intake(1, {"text": "/cmd"})
+    time.sleep(0.3)
+    assert events == ["a", "/cmd"]
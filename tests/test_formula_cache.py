@@ -0,0 +1,29 @@
+"""Кэш формул: пустая цепочка рендереров и недоступный каталог"""
+import pytest
+
+pytest.importorskip("dotenv")
+Image = pytest.importorskip("PIL.Image")
+
+from src.services.formula_cache import FormulaCache  # noqa: E402
+
+
+def test_empty_renderer_chain_is_a_miss():
+    cache = FormulaCache()
+    assert cache.get(r"x^2", 300, []) is None
+
+
+def test_put_then_get():
+    cache = FormulaCache()
+    cache.put(r"x^2", 300, "mathtext", Image.new("RGB", (4, 4)))
+    img = cache.get(r"x^2", 300, ["codecogs", "mathtext"])
+    assert img is not None and img.mode == "RGBA"
+    assert cache.get_stats()["hits"] == 1
+
+
+def test_unusable_disk_dir_falls_back_to_memory(tmp_path):
+    not_a_dir = tmp_path / "file"
+    not_a_dir.write_text("")
+    cache = FormulaCache(disk_dir=str(not_a_dir / "formulas"))
+    assert cache.disk_dir is None
+    cache.put(r"y", 300, "mathtext", Image.new("RGB", (4, 4)))
+    assert cache.get(r"y", 300, ["mathtext"]) is not None
@@ -0,0 +1,117 @@
+"""
+Регрессии latex_parser: случаи, на которых ломался прежний разбор
+(4 прохода re.finditer и цепочка re.sub/str.replace).
+
+Запуск из корня проекта:
+    python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils.latex_parser import (  # noqa: E402
+    DISPLAY, INLINE, TEXT, extract_latex_blocks, latex_to_unicode, tokenize_latex,
+)
+
+
+def blocks(text):
+    return [(block['mode'], block['latex']) for block in extract_latex_blocks(text)]
+
+
+def test_tokens_cover_whole_text():
+    text = r"Пусть $a$, тогда \[ a^2 \] и \(b\), $$c$$ конец"
+    spans = tokenize_latex(text)
+    assert spans[0][1] == 0 and spans[-1][2] == len(text)
+    assert all(prev[2] == cur[1] for prev, cur in zip(spans, spans[1:]))
+    assert [kind for kind, *_ in spans] == [
+        TEXT, INLINE, TEXT, DISPLAY, TEXT, INLINE, TEXT, DISPLAY, TEXT,
+    ]
+
+
+def test_escaped_dollar_is_text():
+    assert blocks(r"Цена \$5, скидка \$2") == []
+    assert blocks(r"Итого \$5 за $x$") == [(INLINE, 'x')]
+
+
+def test_unbalanced_delimiters_are_text():
+    assert blocks(r"$x$ и одинокий $") == [(INLINE, 'x')]
+    assert blocks(r"\(a + b") == []
+    assert blocks(r"\[ a + b") == []
+    assert blocks(r"a $$ b") == []
+
+
+def test_left_and_le_stay_inside_formula():
+    text = r"\(\left( x \right) \le 1\)"
+    assert blocks(text) == [(INLINE, r'\left( x \right) \le 1')]
+
+
+def test_nested_frac():
+    assert blocks(r"$$\frac{\frac{a}{b}}{c}$$") == [(DISPLAY, r'\frac{\frac{a}{b}}{c}')]
+
+
+def test_underscore_in_plain_text():
+    assert blocks("my_var = other_var") == []
+
+
+def test_multiline_display_is_joined():
+    assert blocks("\\[\n  a +\n  b\n\\]") == [(DISPLAY, 'a + b')]
+
+
+def test_double_backslash_delimiters():
+    # Удвоенные слэши - тоже разделители, как в прежнем разборе
+    # (только без хвостового слэша: раньше выходило 'x^2 \')
+    assert blocks(r"\\[ x^2 \\]") == [(DISPLAY, 'x^2')]
+    assert blocks(r"\\[ x^2 \\] и $y$") == [(DISPLAY, 'x^2'), (INLINE, 'y')]
+    assert blocks(r"\\( a + b \\)") == [(INLINE, 'a + b')]
+    assert blocks(r"\\[ x \]") == [(DISPLAY, 'x')]
+
+
+# --- latex_to_unicode ---
+
+def test_unicode_escaped_dollar():
+    assert latex_to_unicode(r"Цена \$5, скидка \$2") == "Цена $5, скидка $2"
+
+
+def test_unicode_left_is_not_le():
+    # Прежняя цепочка str.replace превращала \left в "≤ft"
+    assert latex_to_unicode(r"$\left( x \right) \le y \leq z$") == "( x ) ≤ y ≤ z"
+    assert latex_to_unicode(r"$x \in A, x < \infty$") == "x ∈ A, x < ∞"
+
+
+def test_unicode_nested_frac_and_roots():
+    assert latex_to_unicode(r"$\frac{1}{\frac{2}{3}}$") == "(1)/((2)/(3))"
+    assert latex_to_unicode(r"$\sqrt{x^2 + 1}$") == "√(x² + 1)"
+    assert latex_to_unicode(r"$\sqrt[3]{8}$") == "∛8"
+
+
+def test_unicode_scripts():
+    assert latex_to_unicode(r"$a_n^2$") == "aₙ²"
+    assert latex_to_unicode(r"\(x_{10}\)") == "x₁₀"
+
+
+def test_unicode_multiletter_script_is_kept():
+    # Прежний перевод давал "xab" - степень терялась; теперь индекс из
+    # нескольких букв без скобок остаётся как есть
+    assert latex_to_unicode(r"$x^ab$") == "x^ab"
+    assert latex_to_unicode(r"$x^{ab}$") == "xᵃᵇ"
+
+
+def test_unicode_long_text_matches_short_pieces():
+    # Длинные тексты не кэшируются целиком - результат тот же
+    piece = r"Пусть $x^2 \le \frac{1}{2}$, тогда \(a_n \to 0\). "
+    text = piece * 200
+    assert latex_to_unicode(text) == latex_to_unicode(piece) * 200
+
+
+def test_unicode_underscore_in_plain_text():
+    # Прежний перевод терял подчёркивание: "myvar"
+    assert latex_to_unicode("my_var = other_var") == "my_var = other_var"
+
+
+def test_unicode_unbalanced_dollar():
+    assert latex_to_unicode(r"$x^2$ и одинокий $") == "x² и одинокий $"
+
+
+def test_unicode_double_backslash_delimiters():
+    assert latex_to_unicode(r"\\[ x^2 \\]") == " x² "
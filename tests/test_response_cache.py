@@ -0,0 +1,27 @@
+"""Кэш ответов: недоступный каталог и повреждённые файлы"""
+import os
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+from src.services.response_cache import ResponseCache, cache_key  # noqa: E402
+
+
+def test_unusable_disk_dir_falls_back_to_memory(tmp_path):
+    not_a_dir = tmp_path / "file"
+    not_a_dir.write_text("")
+    cache = ResponseCache(disk_dir=str(not_a_dir / "responses"))
+    assert cache.disk_dir is None
+    cache.put("deepseek", "math", "2+2", "4")
+    assert cache.get("deepseek", "math", "2+2") == "4"
+
+
+@pytest.mark.parametrize("content", ["[1, 2]", '{"response": "4", "crea', '"4"', '{"response": null, "created": 0}'])
+def test_corrupt_file_is_removed(tmp_path, content):
+    cache = ResponseCache(disk_dir=str(tmp_path))
+    path = os.path.join(str(tmp_path), f"{cache_key('deepseek', 'math', '2+2')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    assert cache.get("deepseek", "math", "2+2") is None
+    assert not os.path.exists(path)